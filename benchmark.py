@@ -0,0 +1,274 @@
+"""Замеры производительности DatabaseManager и окна списка партнеров.
+
+Результаты выводятся в JSON, чтобы сравнивать их между коммитами:
+
+    python generate_data.py bench.db --partners 100000 --sales 20000000
+    python benchmark.py bench.db --output before.json
+    python benchmark.py bench.db --output after.json
+
+Замеры записи добавляют и изменяют партнеров с ИНН вида bench-N и по
+окончании удаляют их. Сообщения DatabaseManager выводятся в stderr.
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6.QtWidgets import QApplication
+
+from database import DatabaseManager, partner_discounts_python
+from main import PartnersViewWindow
+
+
+BENCHMARK_INN_PREFIX = 'bench-'
+
+
+def timings(function, args_list, repeat=1):
+    """Время каждого вызова function(*args) в миллисекундах"""
+    result = []
+    for _ in range(repeat):
+        for args in args_list:
+            started = time.perf_counter()
+            function(*args)
+            result.append((time.perf_counter() - started) * 1000)
+    return result
+
+
+def summary(samples, operations=None):
+    """Сводка по замерам: медиана, 95-й перцентиль, минимум и пропускная способность"""
+    ordered = sorted(samples)
+    result = {
+        'calls': len(ordered),
+        'median_ms': round(statistics.median(ordered), 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        'min_ms': round(ordered[0], 3),
+    }
+    if operations is not None:
+        total = sum(ordered) / 1000
+        result['ops_per_second'] = round(operations / total, 1) if total else None
+    return result
+
+
+def sample_partner_ids(db_manager, count, seed):
+    conn = db_manager.get_connection()
+    try:
+        ids = [row[0] for row in conn.execute("SELECT id_partner FROM partners ORDER BY id_partner")]
+    finally:
+        conn.close()
+    rng = random.Random(seed)
+    return rng.sample(ids, min(count, len(ids)))
+
+
+def memory_usage(function, *args):
+    """Память результата function(*args) по tracemalloc: удерживаемая и пиковая, МиБ"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return round(current / 2 ** 20, 1), round(peak / 2 ** 20, 1)
+
+
+def bench_get_all_partners(db_manager, repeat):
+    rows = len(db_manager.get_all_partners())
+    retained, peak = memory_usage(db_manager.get_all_partners)
+    return dict(summary(timings(db_manager.get_all_partners, [()], repeat)), rows=rows,
+                retained_mib=retained, peak_mib=peak)
+
+
+def bench_sales_stats(db_manager, partner_ids, repeat):
+    samples = timings(db_manager.get_partner_sales_stats, [(i,) for i in partner_ids], repeat)
+    return summary(samples, len(samples))
+
+
+def python_partner_discounts(db_manager):
+    """Скидки партнеров по строкам продаж, суммированным в Python (эталон для SQL)"""
+    conn = db_manager.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute("SELECT id_partner, amount_product FROM sales_history")
+        return partner_discounts_python(cursor, db_manager.discount_brackets)
+    finally:
+        conn.close()
+
+
+def bench_partner_discounts(db_manager, repeat):
+    """Скидки всех партнеров: группировка в SQL против суммирования в Python"""
+    expected = python_partner_discounts(db_manager)
+    actual = db_manager.get_partner_discounts()
+    return {
+        'partners': len(actual),
+        'results_match': actual == expected,
+        'sql': summary(timings(db_manager.get_partner_discounts, [()], repeat)),
+        'python': summary(timings(python_partner_discounts, [(db_manager,)], repeat)),
+    }
+
+
+def bench_sales_analytics(db_manager, partner_ids, repeat):
+    conn = db_manager.get_connection()
+    try:
+        last = conn.execute("SELECT MAX(sale_date) FROM sales_history").fetchone()[0]
+    finally:
+        conn.close()
+    if not last:
+        return None
+    first = f"{int(last[:4]) - 1}{last[4:]}"
+    samples = timings(db_manager.get_partner_sales_analytics,
+                      [(i, first, last, 'month') for i in partner_ids], repeat)
+    return summary(samples, len(samples))
+
+
+def bench_add_partner(db_manager, count):
+    samples = timings(db_manager.add_partner,
+                      [(f"Замер {i}", 1, "Директор", f"bench{i}@example.ru", "+7-000-000-00-00",
+                        "Адрес", f"{BENCHMARK_INN_PREFIX}{i}", 5) for i in range(count)])
+    return summary(samples, count)
+
+
+def bench_update_partner(db_manager, count):
+    conn = db_manager.get_connection()
+    try:
+        partners = [dict(row) for row in conn.execute('''
+            SELECT id_partner, name_partner, id_type_partner, director, email,
+                   phone_number, legal_address, inn, current_rating
+            FROM partners WHERE inn LIKE ? ORDER BY id_partner LIMIT ?
+        ''', (BENCHMARK_INN_PREFIX + '%', count))]
+    finally:
+        conn.close()
+
+    samples = timings(db_manager.update_partner,
+                      [(p['id_partner'], p['name_partner'] + " (изменён)", p['id_type_partner'],
+                        p['director'], p['email'], p['phone_number'], p['legal_address'], p['inn'],
+                        p['current_rating'] % 10 + 1) for p in partners])
+    return summary(samples, len(partners))
+
+
+def remove_benchmark_partners(db_manager):
+    conn = db_manager.get_connection()
+    try:
+        ids = [row[0] for row in conn.execute("SELECT id_partner FROM partners WHERE inn LIKE ?",
+                                              (BENCHMARK_INN_PREFIX + '%',))]
+        conn.executemany("DELETE FROM partners WHERE id_partner = ?", [(i,) for i in ids])
+        conn.executemany("DELETE FROM partner_tombstones WHERE id_partner = ?", [(i,) for i in ids])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def bench_load_partners(db_manager, repeat):
+    """Время от load_partners() до первой показанной страницы списка"""
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = PartnersViewWindow({'full_name': 'Замер'}, db_manager)
+    model = window.partners_model
+
+    def first_page():
+        window.load_partners()
+        while model.pending is not None:
+            app.processEvents()
+            time.sleep(0.0005)
+
+    try:
+        samples = timings(first_page, [()], repeat)
+        return dict(summary(samples), rows=model.rowCount())
+    finally:
+        model.close()
+        window.db_executor.shutdown()
+        window.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(database, repeat=5, sample=200, writes=500, seed=1, gui=True):
+    db_manager = DatabaseManager(database)
+    try:
+        conn = db_manager.get_connection()
+        try:
+            counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ('partners', 'products', 'sales_history')}
+        finally:
+            conn.close()
+
+        partner_ids = sample_partner_ids(db_manager, sample, seed)
+        results = {
+            'get_all_partners': bench_get_all_partners(db_manager, repeat),
+            'get_partner_sales_stats': bench_sales_stats(db_manager, partner_ids, repeat),
+            'get_partner_sales_analytics': bench_sales_analytics(db_manager, partner_ids, repeat),
+            'get_partner_discounts': bench_partner_discounts(db_manager, repeat),
+        }
+        try:
+            results['add_partner'] = bench_add_partner(db_manager, writes)
+            results['update_partner'] = bench_update_partner(db_manager, writes)
+        finally:
+            remove_benchmark_partners(db_manager)
+        if gui:
+            results['load_partners'] = bench_load_partners(db_manager, repeat)
+    finally:
+        db_manager.close()
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'database': os.path.abspath(database),
+            'rows': counts,
+            'repeat': repeat,
+            'sample': len(partner_ids),
+            'writes': writes,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности с выводом в JSON")
+    parser.add_argument('database', help="база, созданная generate_data.py")
+    parser.add_argument('--output', help="файл для результатов (по умолчанию stdout)")
+    parser.add_argument('--repeat', type=int, default=5, help="повторов каждого замера чтения")
+    parser.add_argument('--sample', type=int, default=200, help="партнеров в замерах статистики")
+    parser.add_argument('--writes', type=int, default=500, help="операций в замерах записи")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-gui', action='store_true', help="без замера окна списка партнеров")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Файл {args.database} не найден, создайте его generate_data.py", file=sys.stderr)
+        sys.exit(1)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmarks(args.database, args.repeat, args.sample, args.writes, args.seed,
+                                not args.no_gui)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Работа с базой партнеров из командной строки, без графического интерфейса.
+
+    python -m cli export partners --output partners.csv
+    python -m cli export sales-stats --format jsonl > sales_stats.jsonl
+    python -m cli export partners --snapshot --output partners.csv
+
+Строки записываются по мере чтения из базы, поэтому память не растёт
+с размером выгрузки. С --snapshot выгрузка читает копию базы и не держит
+транзакцию чтения в рабочем файле, пока пишется результат.
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import time
+
+from database import DatabaseManager, EXPORT_QUERIES
+
+
+def write_csv(export, output):
+    writer = csv.writer(output)
+    writer.writerow(export.columns)
+    count = 0
+    for rows in export.chunks():
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def write_jsonl(export, output):
+    columns = export.columns
+    # Один кодировщик на всю выгрузку: json.dumps с параметрами создаёт его на каждый вызов
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    count = 0
+    for rows in export.chunks():
+        output.write("".join(encode(dict(zip(columns, row))) + "\n" for row in rows))
+        count += len(rows)
+    return count
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
+
+
+def export(db_manager, name, file_format, output):
+    """Выгрузка EXPORT_QUERIES[name] в открытый файл; возвращает число строк"""
+    export_cursor = db_manager.open_export_cursor(name)
+    if export_cursor is None:
+        raise sqlite3.OperationalError("Не удалось выполнить запрос выгрузки")
+    with export_cursor:
+        if export_cursor.snapshot is not None:
+            print(f"Выгрузка из снимка базы на {export_cursor.snapshot['taken_at']}", file=sys.stderr)
+        return WRITERS[file_format](export_cursor, output)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m cli",
+                                     description="Работа с базой партнеров без графического интерфейса")
+    parser.add_argument('--database', default="partners_management.db")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help="выгрузка в CSV или JSON Lines")
+    export_parser.add_argument('name', choices=sorted(EXPORT_QUERIES))
+    export_parser.add_argument('--format', choices=sorted(WRITERS), dest='file_format',
+                               help="по умолчанию по расширению --output, иначе csv")
+    export_parser.add_argument('--output', help="файл выгрузки (по умолчанию stdout)")
+    export_parser.add_argument('--snapshot', action='store_true',
+                               help="выгружать из копии базы, снятой перед выгрузкой")
+    args = parser.parse_args()
+
+    file_format = args.file_format
+    if file_format is None:
+        file_format = 'jsonl' if args.output and args.output.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+    started = time.perf_counter()
+    db_manager = DatabaseManager(args.database, snapshot=args.snapshot, snapshot_max_age=None)
+    try:
+        if args.output:
+            with open(args.output, 'w', newline='', encoding='utf-8') as output:
+                count = export(db_manager, args.name, file_format, output)
+        else:
+            count = export(db_manager, args.name, file_format, sys.stdout)
+    except BrokenPipeError:
+        # Вывод закрыт раньше времени (например, | head)
+        sys.stderr.close()
+        sys.exit(1)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Ошибка выгрузки: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        db_manager.close()
+
+    print(f"Выгружено строк: {count} за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Хранение и проверка паролей менеджеров.
+
+Пароли хранятся в managers.password_hash в виде
+scrypt$n$r$p$соль$хэш (или pbkdf2_sha256$итерации$соль$хэш, если Python
+собран без scrypt). Параметры записываются вместе с хэшем, поэтому их
+можно повышать, не ломая старые записи. Строки со старым MD5 без соли
+проверяются как раньше и при успешном входе перезаписываются.
+
+Проверка пароля намеренно медленная, поэтому CredentialStore.authenticate
+вызывается из рабочего потока, а не из потока интерфейса.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+
+
+SCRYPT_AVAILABLE = hasattr(hashlib, 'scrypt')
+
+# Параметры по умолчанию, пока стоимость не откалибрована под машину
+DEFAULT_SCRYPT = {'n': 2 ** 14, 'r': 8, 'p': 1}
+DEFAULT_PBKDF2_ITERATIONS = 200000
+MAX_SCRYPT_N = 2 ** 20
+MAX_PBKDF2_ITERATIONS = 10000000
+
+LEGACY_MD5 = re.compile(r"[0-9a-f]{32}")
+
+
+class AuthenticationError(Exception):
+    """Вход отклонён; текст исключения показывается пользователю"""
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _scrypt(password, salt, n, r, p):
+    # Память scrypt - примерно 128 * r * n байт, лимит OpenSSL по умолчанию меньше
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * r * (n + p + 2) + 2 ** 20, dklen=32)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+
+def default_params():
+    if SCRYPT_AVAILABLE:
+        return dict(DEFAULT_SCRYPT, algorithm='scrypt')
+    return {'algorithm': 'pbkdf2_sha256', 'iterations': DEFAULT_PBKDF2_ITERATIONS}
+
+
+def hash_password(password, params=None):
+    """Хэш пароля со случайной солью в формате для managers.password_hash"""
+    params = params or default_params()
+    salt = os.urandom(16)
+    if params['algorithm'] == 'scrypt':
+        digest = _scrypt(password, salt, params['n'], params['r'], params['p'])
+        return f"scrypt${params['n']}${params['r']}${params['p']}${_b64(salt)}${_b64(digest)}"
+    digest = _pbkdf2(password, salt, params['iterations'])
+    return f"pbkdf2_sha256${params['iterations']}${_b64(salt)}${_b64(digest)}"
+
+
+def parse_hash(encoded):
+    """Параметры сохранённого хэша: словарь с algorithm, для старого MD5 - {'algorithm': 'md5'}"""
+    if LEGACY_MD5.fullmatch(encoded or ''):
+        return {'algorithm': 'md5'}
+    parts = (encoded or '').split('$')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            return {'algorithm': 'scrypt', 'n': int(parts[1]), 'r': int(parts[2]), 'p': int(parts[3]),
+                    'salt': base64.b64decode(parts[4]), 'digest': base64.b64decode(parts[5])}
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            return {'algorithm': 'pbkdf2_sha256', 'iterations': int(parts[1]),
+                    'salt': base64.b64decode(parts[2]), 'digest': base64.b64decode(parts[3])}
+    except ValueError:
+        pass
+    return None
+
+
+def verify_password(password, encoded):
+    """Проверка пароля по сохранённому хэшу с постоянным временем сравнения"""
+    stored = parse_hash(encoded)
+    if stored is None:
+        return False
+    if stored['algorithm'] == 'md5':
+        return hmac.compare_digest(hashlib.md5(password.encode()).hexdigest(), encoded)
+    if stored['algorithm'] == 'scrypt':
+        if not SCRYPT_AVAILABLE:
+            return False
+        digest = _scrypt(password, stored['salt'], stored['n'], stored['r'], stored['p'])
+    else:
+        digest = _pbkdf2(password, stored['salt'], stored['iterations'])
+    return hmac.compare_digest(digest, stored['digest'])
+
+
+def needs_rehash(encoded, params):
+    """True, если хэш устарел: MD5, другой алгоритм или стоимость ниже текущей"""
+    stored = parse_hash(encoded)
+    if stored is None or stored['algorithm'] != params['algorithm']:
+        return True
+    if stored['algorithm'] == 'scrypt':
+        return (stored['n'], stored['r'], stored['p']) < (params['n'], params['r'], params['p'])
+    return stored['iterations'] < params['iterations']
+
+
+def calibrate(target_ms=250):
+    """Параметры KDF, при которых проверка пароля занимает около target_ms на этой машине"""
+    params = default_params()
+    if params['algorithm'] == 'scrypt':
+        while params['n'] < MAX_SCRYPT_N:
+            started = time.perf_counter()
+            _scrypt("calibration", b"0" * 16, params['n'], params['r'], params['p'])
+            if (time.perf_counter() - started) * 1000 >= target_ms:
+                break
+            params['n'] *= 2
+        return params
+
+    started = time.perf_counter()
+    _pbkdf2("calibration", b"0" * 16, params['iterations'])
+    elapsed = time.perf_counter() - started
+    if elapsed > 0:
+        iterations = int(params['iterations'] * target_ms / 1000 / elapsed)
+        params['iterations'] = min(max(iterations, DEFAULT_PBKDF2_ITERATIONS), MAX_PBKDF2_ITERATIONS)
+    return params
+
+
+class CredentialStore:
+    """Вход менеджеров: проверка пароля, перехэширование и ограничение попыток.
+
+    После max_failures неудачных попыток подряд вход под этим логином
+    блокируется на lockout_seconds, каждая следующая неудача удваивает
+    блокировку (не больше max_lockout_seconds). Счётчики хранятся в
+    login_attempts и переживают перезапуск приложения.
+    """
+
+    def __init__(self, db_manager, target_ms=250, max_failures=5, lockout_seconds=30,
+                 max_lockout_seconds=900):
+        self.db_manager = db_manager
+        self.target_ms = target_ms
+        self.max_failures = max_failures
+        self.lockout_seconds = lockout_seconds
+        self.max_lockout_seconds = max_lockout_seconds
+        self._params = None
+        self._lock = threading.Lock()
+        self._dummy_hash = None
+
+    def params(self):
+        """Откалиброванные параметры KDF; первая калибровка занимает несколько проверок"""
+        with self._lock:
+            if self._params is None:
+                self._params = calibrate(self.target_ms)
+                self._dummy_hash = hash_password("", self._params)
+            return self._params
+
+    def hash_password(self, password):
+        return hash_password(password, self.params())
+
+    def retry_after(self, conn, login):
+        """Сколько секунд осталось до разблокировки входа под login"""
+        row = conn.execute("SELECT failures, last_failure FROM login_attempts WHERE login = ?",
+                           (login,)).fetchone()
+        if row is None or row['failures'] < self.max_failures:
+            return 0
+        lockout = min(self.lockout_seconds * 2 ** (row['failures'] - self.max_failures),
+                      self.max_lockout_seconds)
+        return max(0, row['last_failure'] + lockout - time.time())
+
+    def authenticate(self, login, password):
+        """Данные менеджера при успешном входе, иначе AuthenticationError"""
+        conn = self.db_manager.get_connection()
+        if not conn:
+            raise AuthenticationError("Ошибка подключения к базе данных")
+
+        try:
+            wait = self.retry_after(conn, login)
+            if wait:
+                raise AuthenticationError(f"Слишком много неудачных попыток, "
+                                          f"повторите через {int(wait) + 1} с")
+
+            manager = conn.execute('''
+                SELECT id_manager, login, full_name, role, password_hash
+                FROM managers
+                WHERE login = ? AND is_active = 1
+            ''', (login,)).fetchone()
+
+            if manager is None:
+                # Та же стоимость проверки, чтобы по времени нельзя было узнать, есть ли логин
+                self.params()
+                verify_password(password, self._dummy_hash)
+                valid = False
+            else:
+                valid = verify_password(password, manager['password_hash'])
+
+            if not valid:
+                conn.execute('''
+                    INSERT INTO login_attempts (login, failures, last_failure) VALUES (?, 1, ?)
+                    ON CONFLICT (login) DO UPDATE SET
+                        failures = failures + 1, last_failure = excluded.last_failure
+                ''', (login, time.time()))
+                conn.commit()
+                raise AuthenticationError("Неверный логин или пароль")
+
+            # Новый хэш считается до первой записи, чтобы не держать блокировку базы на время KDF
+            new_hash = None
+            if needs_rehash(manager['password_hash'], self.params()):
+                new_hash = self.hash_password(password)
+
+            conn.execute("DELETE FROM login_attempts WHERE login = ?", (login,))
+            if new_hash is not None:
+                conn.execute("UPDATE managers SET password_hash = ? WHERE id_manager = ? AND password_hash = ?",
+                             (new_hash, manager['id_manager'], manager['password_hash']))
+            conn.commit()
+
+            result = dict(manager)
+            del result['password_hash']
+            return result
+        finally:
+            conn.close()
@@ -0,0 +1,2310 @@
+"""Работа с базой данных партнеров без зависимости от Qt.
+
+Модуль используется приложением (main.py), инструментами загрузки и
+выгрузки данных и командной строкой (cli.py).
+"""
+import os
+import re
+import sys
+import json
+import time
+import queue
+import shutil
+import socket
+import tempfile
+import bisect
+import sqlite3
+import functools
+import threading
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from credentials import hash_password
+
+
+# Сводные таблицы продаж: агрегаты с нуля (для заполнения и проверки)
+PARTNER_SUMMARY_SELECT = '''
+    SELECT id_partner, COALESCE(SUM(amount_product), 0) AS total_quantity,
+           COALESCE(SUM(total_sale_amount), 0) AS total_amount, COUNT(*) AS sales_count
+    FROM sales_history
+    WHERE id_partner IS NOT NULL
+    GROUP BY id_partner
+'''
+
+PRODUCT_SUMMARY_SELECT = '''
+    SELECT id_partner, id_product, COALESCE(SUM(amount_product), 0) AS quantity,
+           COALESCE(SUM(total_sale_amount), 0) AS amount, COUNT(*) AS sales_count
+    FROM sales_history
+    WHERE id_partner IS NOT NULL AND id_product IS NOT NULL
+    GROUP BY id_partner, id_product
+'''
+
+
+# Пакетный учёт новых строк sales_history (id_sale > ?) в сводных таблицах
+SUMMARY_APPEND_SQL = [
+    '''
+    INSERT INTO partner_sales_summary (id_partner, total_quantity, total_amount, sales_count)
+    SELECT id_partner, COALESCE(SUM(amount_product), 0), COALESCE(SUM(total_sale_amount), 0), COUNT(*)
+    FROM sales_history
+    WHERE id_sale > ? AND id_partner IS NOT NULL
+    GROUP BY id_partner
+    ON CONFLICT (id_partner) DO UPDATE SET
+        total_quantity = total_quantity + excluded.total_quantity,
+        total_amount = total_amount + excluded.total_amount,
+        sales_count = sales_count + excluded.sales_count
+    ''',
+    '''
+    INSERT INTO partner_product_summary (id_partner, id_product, quantity, amount, sales_count)
+    SELECT id_partner, id_product, COALESCE(SUM(amount_product), 0),
+           COALESCE(SUM(total_sale_amount), 0), COUNT(*)
+    FROM sales_history
+    WHERE id_sale > ? AND id_partner IS NOT NULL AND id_product IS NOT NULL
+    GROUP BY id_partner, id_product
+    ON CONFLICT (id_partner, id_product) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        amount = amount + excluded.amount,
+        sales_count = sales_count + excluded.sales_count
+    ''',
+]
+
+SALES_SUMMARY_INSERT_TRIGGER = 'trg_sales_summary_insert'
+
+# Вставка или обновление партнера по ИНН; неизменённые строки не перезаписываются
+PARTNER_UPSERT = '''
+    INSERT INTO partners
+    (name_partner, id_type_partner, director, email, phone_number,
+     legal_address, inn, current_rating)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (inn) DO UPDATE SET
+        name_partner = excluded.name_partner,
+        id_type_partner = excluded.id_type_partner,
+        director = excluded.director,
+        email = excluded.email,
+        phone_number = excluded.phone_number,
+        legal_address = excluded.legal_address,
+        current_rating = excluded.current_rating
+    WHERE (name_partner, id_type_partner, director, email, phone_number,
+           legal_address, current_rating)
+       IS NOT (excluded.name_partner, excluded.id_type_partner, excluded.director,
+               excluded.email, excluded.phone_number, excluded.legal_address,
+               excluded.current_rating)
+'''
+
+
+def _summary_add_sql(row):
+    """Тело триггера: учесть строку продаж row (NEW) в сводных таблицах"""
+    return f'''
+        INSERT INTO partner_sales_summary (id_partner, total_quantity, total_amount, sales_count)
+        SELECT {row}.id_partner, COALESCE({row}.amount_product, 0),
+               COALESCE({row}.total_sale_amount, 0), 1
+        WHERE {row}.id_partner IS NOT NULL
+        ON CONFLICT (id_partner) DO UPDATE SET
+            total_quantity = total_quantity + excluded.total_quantity,
+            total_amount = total_amount + excluded.total_amount,
+            sales_count = sales_count + 1;
+        INSERT INTO partner_product_summary (id_partner, id_product, quantity, amount, sales_count)
+        SELECT {row}.id_partner, {row}.id_product, COALESCE({row}.amount_product, 0),
+               COALESCE({row}.total_sale_amount, 0), 1
+        WHERE {row}.id_partner IS NOT NULL AND {row}.id_product IS NOT NULL
+        ON CONFLICT (id_partner, id_product) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            amount = amount + excluded.amount,
+            sales_count = sales_count + 1;
+    '''
+
+
+def _summary_remove_sql(row):
+    """Тело триггера: исключить строку продаж row (OLD) из сводных таблиц"""
+    return f'''
+        UPDATE partner_sales_summary SET
+            total_quantity = total_quantity - COALESCE({row}.amount_product, 0),
+            total_amount = total_amount - COALESCE({row}.total_sale_amount, 0),
+            sales_count = sales_count - 1
+        WHERE id_partner = {row}.id_partner;
+        DELETE FROM partner_sales_summary
+        WHERE id_partner = {row}.id_partner AND sales_count <= 0;
+        UPDATE partner_product_summary SET
+            quantity = quantity - COALESCE({row}.amount_product, 0),
+            amount = amount - COALESCE({row}.total_sale_amount, 0),
+            sales_count = sales_count - 1
+        WHERE id_partner = {row}.id_partner AND id_product = {row}.id_product;
+        DELETE FROM partner_product_summary
+        WHERE id_partner = {row}.id_partner AND id_product = {row}.id_product AND sales_count <= 0;
+    '''
+
+
+def duplicate_partner_inns(conn, limit=20):
+    """ИНН, которые встречаются у нескольких партнеров: (ИНН, id партнеров через запятую)"""
+    return conn.execute('''
+        SELECT inn, GROUP_CONCAT(id_partner, ', ')
+        FROM partners
+        WHERE inn IS NOT NULL
+        GROUP BY inn
+        HAVING COUNT(*) > 1
+        LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+def has_partner_inn_index(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_partners_inn'"
+                        ).fetchone() is not None
+
+
+def create_partner_inn_index(conn):
+    """Уникальный индекс по ИНН; при повторяющихся ИНН не создаётся, дубли выводятся"""
+    duplicates = duplicate_partner_inns(conn)
+    if duplicates:
+        print("Уникальный индекс по ИНН не создан, ИНН повторяются у партнеров:")
+        for inn, partner_ids in duplicates:
+            print(f"  ИНН {inn}: id_partner {partner_ids}")
+        print("Исправьте или объедините эти записи и перезапустите приложение; "
+              "до этого синхронизация партнеров по ИНН недоступна")
+        return False
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_partners_inn ON partners (inn)")
+    return True
+
+
+# Загрузка с --defer-indexes отмечается каждой транзакцией; индексы загрузки,
+# не отмечавшейся дольше этого срока, возвращаются при открытии базы
+DEFERRED_INDEXES_STALE_SECONDS = 600
+
+
+def deferred_indexes_owner():
+    """Владелец снятых индексов: (pid, имя компьютера) процесса загрузки"""
+    return os.getpid(), socket.gethostname()
+
+
+def touch_deferred_indexes(conn):
+    """Отметка о том, что загрузка, снявшая индексы, ещё работает"""
+    conn.execute("UPDATE import_deferred_indexes SET updated_at = CURRENT_TIMESTAMP "
+                 "WHERE owner_pid = ? AND owner_host = ?", deferred_indexes_owner())
+
+
+def deferred_indexes_abandoned(index):
+    """Загрузка, снявшая индекс, завершилась, не вернув его"""
+    if index['owner_pid'] is None or index['stale']:
+        return True
+    pid, host = deferred_indexes_owner()
+    # На другом компьютере и в Windows процесс не проверить: ждём, пока устареет отметка
+    if index['owner_host'] != host or index['owner_pid'] == pid or os.name != 'posix':
+        return False
+    try:
+        os.kill(index['owner_pid'], 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def restore_deferred_indexes(conn, abandoned=False):
+    """Пересоздание индексов sales_history, удалённых на время загрузки продаж.
+
+    По умолчанию возвращаются индексы, снятые текущим процессом; с abandoned -
+    индексы загрузок, процесс которых завершился или давно не отмечался.
+    """
+    indexes = conn.execute('''
+        SELECT name, sql, owner_pid, owner_host,
+               COALESCE(updated_at < datetime('now', ?), 1) AS stale
+        FROM import_deferred_indexes
+    ''', (f"-{DEFERRED_INDEXES_STALE_SECONDS} seconds",)).fetchall()
+    if abandoned:
+        indexes = [index for index in indexes if deferred_indexes_abandoned(index)]
+    else:
+        owner = deferred_indexes_owner()
+        indexes = [index for index in indexes if (index['owner_pid'], index['owner_host']) == owner]
+    if not indexes:
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    for index in indexes:
+        conn.execute(index['sql'].replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1))
+        conn.execute("DELETE FROM import_deferred_indexes WHERE name = ?", (index['name'],))
+    conn.commit()
+    print(f"Восстановлены индексы продаж после загрузки: {len(indexes)}")
+
+
+# Миграции схемы: (версия, описание, SQL-выражения или функции от соединения).
+# Номер применённой версии хранится в PRAGMA user_version.
+MIGRATIONS = [
+    (1, "Базовые таблицы", [
+        '''
+        CREATE TABLE IF NOT EXISTS type_partners (
+            id_type_partner INTEGER PRIMARY KEY AUTOINCREMENT,
+            type_name TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS partners (
+            id_partner INTEGER PRIMARY KEY AUTOINCREMENT,
+            name_partner TEXT NOT NULL,
+            id_type_partner INTEGER,
+            director TEXT,
+            email TEXT,
+            phone_number TEXT,
+            legal_address TEXT,
+            inn TEXT,
+            current_rating INTEGER DEFAULT 5,
+            logo TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (id_type_partner) REFERENCES type_partners(id_type_partner)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS managers (
+            id_manager INTEGER PRIMARY KEY AUTOINCREMENT,
+            login TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            full_name TEXT NOT NULL,
+            role TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS products (
+            id_product INTEGER PRIMARY KEY AUTOINCREMENT,
+            name_product TEXT NOT NULL,
+            price REAL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sales_history (
+            id_sale INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_partner INTEGER,
+            id_product INTEGER,
+            amount_product INTEGER,
+            total_sale_amount REAL,
+            sale_date DATE,
+            FOREIGN KEY (id_partner) REFERENCES partners(id_partner),
+            FOREIGN KEY (id_product) REFERENCES products(id_product)
+        )
+        ''',
+    ]),
+    (2, "Индексы для списка партнеров и статистики продаж", [
+        "CREATE INDEX IF NOT EXISTS idx_partners_name ON partners (name_partner, id_partner)",
+        "CREATE INDEX IF NOT EXISTS idx_partners_type ON partners (id_type_partner)",
+        # Покрывающий индекс: итоги и группировка по продукции без чтения таблицы
+        """CREATE INDEX IF NOT EXISTS idx_sales_partner_product
+           ON sales_history (id_partner, id_product, amount_product, total_sale_amount)""",
+        "CREATE INDEX IF NOT EXISTS idx_sales_product ON sales_history (id_product)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_date ON sales_history (sale_date)",
+    ]),
+    (3, "Индексы для постраничной сортировки списка партнеров", [
+        "CREATE INDEX IF NOT EXISTS idx_partners_director ON partners (COALESCE(director, ''), id_partner)",
+        "CREATE INDEX IF NOT EXISTS idx_partners_email ON partners (COALESCE(email, ''), id_partner)",
+        "CREATE INDEX IF NOT EXISTS idx_partners_phone ON partners (COALESCE(phone_number, ''), id_partner)",
+        "CREATE INDEX IF NOT EXISTS idx_partners_rating ON partners (COALESCE(current_rating, 0), id_partner)",
+        "CREATE INDEX IF NOT EXISTS idx_type_partners_name ON type_partners (type_name)",
+    ]),
+    (4, "Сводные таблицы продаж, поддерживаемые триггерами", [
+        '''
+        CREATE TABLE IF NOT EXISTS partner_sales_summary (
+            id_partner INTEGER PRIMARY KEY,
+            total_quantity INTEGER NOT NULL DEFAULT 0,
+            total_amount REAL NOT NULL DEFAULT 0,
+            sales_count INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS partner_product_summary (
+            id_partner INTEGER NOT NULL,
+            id_product INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0,
+            sales_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (id_partner, id_product)
+        ) WITHOUT ROWID
+        ''',
+        "INSERT INTO partner_sales_summary " + PARTNER_SUMMARY_SELECT,
+        "INSERT INTO partner_product_summary " + PRODUCT_SUMMARY_SELECT,
+        "CREATE TRIGGER IF NOT EXISTS trg_sales_summary_insert AFTER INSERT ON sales_history BEGIN"
+        + _summary_add_sql('NEW') + "END",
+        "CREATE TRIGGER IF NOT EXISTS trg_sales_summary_delete AFTER DELETE ON sales_history BEGIN"
+        + _summary_remove_sql('OLD') + "END",
+        "CREATE TRIGGER IF NOT EXISTS trg_sales_summary_update AFTER UPDATE ON sales_history BEGIN"
+        + _summary_remove_sql('OLD') + _summary_add_sql('NEW') + "END",
+    ]),
+    (5, "Служебные таблицы пакетной загрузки продаж", [
+        '''
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            records INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS import_deferred_indexes (
+            name TEXT PRIMARY KEY,
+            sql TEXT NOT NULL
+        )
+        ''',
+    ]),
+    # При повторяющихся ИНН индекс пропускается, см. DatabaseManager.init_database
+    (6, "Уникальный индекс по ИНН партнера", [
+        create_partner_inn_index,
+    ]),
+    (7, "Версии строк партнеров для инкрементального обновления списка", [
+        "ALTER TABLE partners ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_partners_row_version ON partners (row_version)",
+        '''
+        CREATE TABLE IF NOT EXISTS partner_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO partner_version (id, value) VALUES (1, 0)",
+        '''
+        CREATE TABLE IF NOT EXISTS partner_tombstones (
+            id_partner INTEGER PRIMARY KEY,
+            row_version INTEGER NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_partner_tombstones_version ON partner_tombstones (row_version)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_partners_version_insert AFTER INSERT ON partners BEGIN
+            UPDATE partner_version SET value = value + 1;
+            UPDATE partners SET row_version = (SELECT value FROM partner_version)
+            WHERE id_partner = NEW.id_partner;
+            DELETE FROM partner_tombstones WHERE id_partner = NEW.id_partner;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_partners_version_update
+        AFTER UPDATE OF name_partner, id_type_partner, director, email, phone_number,
+                        legal_address, inn, current_rating, logo ON partners BEGIN
+            UPDATE partner_version SET value = value + 1;
+            UPDATE partners SET row_version = (SELECT value FROM partner_version)
+            WHERE id_partner = NEW.id_partner;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_partners_version_delete AFTER DELETE ON partners BEGIN
+            UPDATE partner_version SET value = value + 1;
+            INSERT OR REPLACE INTO partner_tombstones (id_partner, row_version)
+            VALUES (OLD.id_partner, (SELECT value FROM partner_version));
+        END
+        ''',
+    ]),
+    (8, "Полнотекстовый поиск партнеров (FTS5)", [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS partners_fts USING fts5(
+            name_partner, director, email, phone_number, inn,
+            content='partners', content_rowid='id_partner',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''',
+        "INSERT INTO partners_fts (partners_fts) VALUES ('rebuild')",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_partners_fts_insert AFTER INSERT ON partners BEGIN
+            INSERT INTO partners_fts (rowid, name_partner, director, email, phone_number, inn)
+            VALUES (NEW.id_partner, NEW.name_partner, NEW.director, NEW.email,
+                    NEW.phone_number, NEW.inn);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_partners_fts_delete AFTER DELETE ON partners BEGIN
+            INSERT INTO partners_fts (partners_fts, rowid, name_partner, director, email,
+                                      phone_number, inn)
+            VALUES ('delete', OLD.id_partner, OLD.name_partner, OLD.director, OLD.email,
+                    OLD.phone_number, OLD.inn);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_partners_fts_update
+        AFTER UPDATE OF name_partner, director, email, phone_number, inn ON partners BEGIN
+            INSERT INTO partners_fts (partners_fts, rowid, name_partner, director, email,
+                                      phone_number, inn)
+            VALUES ('delete', OLD.id_partner, OLD.name_partner, OLD.director, OLD.email,
+                    OLD.phone_number, OLD.inn);
+            INSERT INTO partners_fts (rowid, name_partner, director, email, phone_number, inn)
+            VALUES (NEW.id_partner, NEW.name_partner, NEW.director, NEW.email,
+                    NEW.phone_number, NEW.inn);
+        END
+        ''',
+    ]),
+    (9, "Версии справочников для кэша в памяти", [
+        '''
+        CREATE TABLE IF NOT EXISTS reference_version (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "INSERT OR IGNORE INTO reference_version (name, value) VALUES ('type_partners', 0), ('products', 0)",
+        "CREATE TRIGGER IF NOT EXISTS trg_type_partners_version_insert AFTER INSERT ON type_partners "
+        "BEGIN UPDATE reference_version SET value = value + 1 WHERE name = 'type_partners'; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_type_partners_version_update AFTER UPDATE ON type_partners "
+        "BEGIN UPDATE reference_version SET value = value + 1 WHERE name = 'type_partners'; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_type_partners_version_delete AFTER DELETE ON type_partners "
+        "BEGIN UPDATE reference_version SET value = value + 1 WHERE name = 'type_partners'; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_products_version_insert AFTER INSERT ON products "
+        "BEGIN UPDATE reference_version SET value = value + 1 WHERE name = 'products'; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_products_version_update AFTER UPDATE ON products "
+        "BEGIN UPDATE reference_version SET value = value + 1 WHERE name = 'products'; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_products_version_delete AFTER DELETE ON products "
+        "BEGIN UPDATE reference_version SET value = value + 1 WHERE name = 'products'; END",
+    ]),
+    (10, "Покрывающий индекс продаж партнера по дате", [
+        """CREATE INDEX IF NOT EXISTS idx_sales_partner_date
+           ON sales_history (id_partner, sale_date, id_product, amount_product, total_sale_amount)""",
+    ]),
+    (11, "Счётчики неудачных попыток входа", [
+        '''
+        CREATE TABLE IF NOT EXISTS login_attempts (
+            login TEXT PRIMARY KEY,
+            failures INTEGER NOT NULL,
+            last_failure REAL NOT NULL
+        )
+        ''',
+    ]),
+    # Количество и скидка в списке партнеров берутся из partner_sales_summary,
+    # поэтому её изменение тоже меняет версию строки партнера
+    (12, "Версии строк партнеров при изменении итогов продаж", [
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_partner_summary_version_insert
+        AFTER INSERT ON partner_sales_summary BEGIN
+            UPDATE partner_version SET value = value + 1;
+            UPDATE partners SET row_version = (SELECT value FROM partner_version)
+            WHERE id_partner = NEW.id_partner;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_partner_summary_version_update
+        AFTER UPDATE OF total_quantity ON partner_sales_summary
+        WHEN NEW.total_quantity IS NOT OLD.total_quantity BEGIN
+            UPDATE partner_version SET value = value + 1;
+            UPDATE partners SET row_version = (SELECT value FROM partner_version)
+            WHERE id_partner = NEW.id_partner;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_partner_summary_version_delete
+        AFTER DELETE ON partner_sales_summary BEGIN
+            UPDATE partner_version SET value = value + 1;
+            UPDATE partners SET row_version = (SELECT value FROM partner_version)
+            WHERE id_partner = OLD.id_partner;
+        END
+        ''',
+    ]),
+    # Владелец снятых индексов, см. restore_deferred_indexes
+    (13, "Владелец индексов продаж, снятых на время загрузки", [
+        "ALTER TABLE import_deferred_indexes ADD COLUMN owner_pid INTEGER",
+        "ALTER TABLE import_deferred_indexes ADD COLUMN owner_host TEXT",
+        "ALTER TABLE import_deferred_indexes ADD COLUMN updated_at TIMESTAMP",
+    ]),
+    (14, "Отметка о завершённой загрузке продаж", [
+        "ALTER TABLE import_checkpoints ADD COLUMN completed INTEGER NOT NULL DEFAULT 0",
+    ]),
+    # Новые продажи видны по id_sale, изменённые и удалённые - по этой версии
+    (15, "Версия изменений истории продаж", [
+        '''
+        CREATE TABLE IF NOT EXISTS sales_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO sales_version (id, value) VALUES (1, 0)",
+        "CREATE TRIGGER IF NOT EXISTS trg_sales_version_update AFTER UPDATE ON sales_history "
+        "BEGIN UPDATE sales_version SET value = value + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_sales_version_delete AFTER DELETE ON sales_history "
+        "BEGIN UPDATE sales_version SET value = value + 1; END",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+PARTNERS_QUERY = '''
+    SELECT p.id_partner, p.name_partner, tp.type_name, p.director, 
+           p.email, p.phone_number, p.legal_address, p.inn, 
+           p.current_rating, p.logo, p.id_type_partner
+    FROM partners p
+    LEFT JOIN type_partners tp ON p.id_type_partner = tp.id_type_partner
+    ORDER BY p.name_partner
+'''
+
+# {discount} подставляет DatabaseManager по своей шкале скидок
+PARTNERS_PAGE_SELECT = '''
+    SELECT p.id_partner, p.name_partner, tp.type_name, p.director, 
+           p.email, p.phone_number, p.legal_address, p.inn, 
+           p.current_rating, p.logo, p.id_type_partner, p.row_version,
+           COALESCE(ss.total_quantity, 0) AS total_quantity,
+           {discount} AS discount
+    FROM partners p
+    LEFT JOIN type_partners tp ON p.id_type_partner = tp.id_type_partner
+    LEFT JOIN partner_sales_summary ss ON ss.id_partner = p.id_partner
+'''
+
+# Столбцы списка партнеров с немногими различными значениями, см. fetch_records
+PARTNER_SHARED_FIELDS = ('type_name',)
+
+# Выгрузки без интерфейса (cli.py). Строки идут в порядке первичного ключа,
+# поэтому первая строка доступна сразу, без сортировки всей таблицы.
+EXPORT_QUERIES = {
+    'partners': '''
+        SELECT p.id_partner, p.name_partner, tp.type_name, p.director, p.email,
+               p.phone_number, p.legal_address, p.inn, p.current_rating,
+               COALESCE(ss.total_quantity, 0) AS total_quantity,
+               COALESCE(ss.total_amount, 0) AS total_amount,
+               {discount} AS discount
+        FROM partners p
+        LEFT JOIN type_partners tp ON p.id_type_partner = tp.id_type_partner
+        LEFT JOIN partner_sales_summary ss ON ss.id_partner = p.id_partner
+        ORDER BY p.id_partner
+    ''',
+    'sales-stats': '''
+        SELECT s.id_partner, p.name_partner, p.inn, s.id_product, pr.name_product,
+               s.quantity, s.amount, s.sales_count
+        FROM partner_product_summary s
+        JOIN partners p ON p.id_partner = s.id_partner
+        LEFT JOIN products pr ON pr.id_product = s.id_product
+        ORDER BY s.id_partner, s.id_product
+    ''',
+}
+
+# Шкала скидок: (минимальное количество проданной продукции, скидка в процентах)
+DEFAULT_DISCOUNT_BRACKETS = ((0, 0), (10000, 5), (50000, 10), (300000, 15))
+
+
+def discount_case_sql(column, brackets):
+    """Выражение SQL, переводящее количество продукции в процент скидки"""
+    cases = " ".join(f"WHEN {column} >= {int(minimum)} THEN {int(percent)}"
+                     for minimum, percent in sorted(brackets, reverse=True))
+    return f"CASE {cases} ELSE 0 END"
+
+
+def partner_discounts_python(rows, brackets=DEFAULT_DISCOUNT_BRACKETS):
+    """Скидки без SQL-агрегации: rows - пары (id_partner, amount_product).
+
+    Используется как эталон для сравнения с запросом в бенчмарках.
+    """
+    totals = {}
+    get = totals.get
+    for partner_id, amount in rows:
+        if partner_id is not None:
+            totals[partner_id] = get(partner_id, 0) + (amount or 0)
+
+    thresholds = sorted(brackets)
+    minimums = [minimum for minimum, percent in thresholds]
+    percents = [percent for minimum, percent in thresholds]
+    result = {}
+    for partner_id, quantity in totals.items():
+        position = bisect.bisect_right(minimums, quantity) - 1
+        result[partner_id] = {'total_quantity': quantity,
+                              'discount': percents[position] if position >= 0 else 0}
+    return result
+
+# Интервалы группировки продаж: выражение SQL над sale_date -> метка периода. Даты хранятся
+# как YYYY-MM-DD (так их пишет загрузка продаж), поэтому месяц и квартал берутся substr.
+# Неделя обозначается датой своего понедельника, квартал - строкой вида 2024-Q1.
+SALES_BUCKETS = {
+    'day': "sale_date",
+    'week': "date(sale_date, '-6 days', 'weekday 1')",
+    'month': "substr(sale_date, 1, 7)",
+    'quarter': "substr(sale_date, 1, 4) || '-Q' || ((CAST(substr(sale_date, 6, 2) AS INTEGER) + 2) / 3)",
+}
+
+
+def sales_bucket_start(value, bucket):
+    """Первый день периода, в который попадает дата или метка периода"""
+    if bucket == 'quarter' and '-Q' in value:
+        year, quarter = value.split('-Q')
+        return date(int(year), int(quarter) * 3 - 2, 1)
+    if bucket in ('month', 'quarter') and len(value) == 7:
+        value += '-01'
+    day = date.fromisoformat(value[:10])
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    if bucket == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day
+
+
+def sales_bucket_label(start, bucket):
+    """Метка периода в том же виде, что выдаёт выражение из SALES_BUCKETS"""
+    if bucket == 'month':
+        return start.strftime('%Y-%m')
+    if bucket == 'quarter':
+        return f"{start.year}-Q{(start.month + 2) // 3}"
+    return start.isoformat()
+
+
+def sales_bucket_labels(first, last, bucket):
+    """Все метки периодов от first до last включительно, без пропусков"""
+    start = sales_bucket_start(first, bucket)
+    end = sales_bucket_start(last, bucket)
+    months = {'month': 1, 'quarter': 3}.get(bucket)
+    labels = []
+    while start <= end:
+        labels.append(sales_bucket_label(start, bucket))
+        if months:
+            month = start.month - 1 + months
+            start = date(start.year + month // 12, month % 12 + 1, 1)
+        else:
+            start += timedelta(days=7 if bucket == 'week' else 1)
+    return labels
+
+
+# Ключи сортировки списка партнеров: поле -> выражение из индекса (поле, id_partner).
+# type_name сортируется по группам типов, см. DatabaseManager.get_partners_page.
+PARTNER_SORT_KEYS = {
+    'id_partner': "p.id_partner",
+    'name_partner': "p.name_partner",
+    'type_name': None,
+    'director': "COALESCE(p.director, '')",
+    'email': "COALESCE(p.email, '')",
+    'phone_number': "COALESCE(p.phone_number, '')",
+    'current_rating': "COALESCE(p.current_rating, 0)",
+}
+
+
+SEARCH_RANKING_LIMIT = 5000
+
+
+def partner_search_query(text):
+    """Запрос FTS5 из введённой строки: все слова как префиксы.
+
+    Однобуквенные слова (например, "7" из "+7-912") почти ничего не отсекают,
+    но дорого обходятся, поэтому в запрос не попадают.
+    """
+    words = [word for word in re.findall(r"\w+", text) if len(word) > 1]
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def partner_sort_position(sort_key, partner):
+    """Позиция партнера для keyset-пагинации: (значение ключа, id_partner)"""
+    value = partner[sort_key]
+    if value is None:
+        value = 0 if sort_key == 'current_rating' else ''
+    return value, partner['id_partner']
+
+
+
+class Record(Mapping):
+    """Строка результата: кортеж значений и общий для всех строк индекс полей.
+
+    Читается как словарь (row['name_partner'], row.get('logo'), dict(row))
+    и как объект (row.name_partner). В отличие от словаря на строку, хранит
+    только кортеж, а кортежи из неизменяемых значений сборщик мусора
+    перестаёт отслеживать и не обходит. Классы под набор столбцов создаёт
+    record_class.
+    """
+
+    __slots__ = ('_values',)
+    fields = ()
+    index = {}
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self.index[key]]
+
+    def __getattr__(self, name):
+        # Служебные имена (и _values до __init__) не ищутся среди полей
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._values[self.index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return f"Record({dict(self)!r})"
+
+
+_RECORD_CLASSES = {}
+
+
+def record_class(fields):
+    """Подкласс Record со столбцами fields; класс на каждый набор столбцов один"""
+    fields = tuple(fields)
+    cls = _RECORD_CLASSES.get(fields)
+    if cls is None:
+        cls = type('Record', (Record,), {'__slots__': (), '__module__': __name__, 'fields': fields,
+                                         'index': {name: i for i, name in enumerate(fields)}})
+        cls = _RECORD_CLASSES.setdefault(fields, cls)
+    return cls
+
+
+def fetch_records(cursor, shared=()):
+    """Оставшиеся строки выполненного запроса как Record.
+
+    Значения столбцов shared повторяются от строки к строке (type_name),
+    они хранятся одним объектом через sys.intern.
+    """
+    cls = record_class(column[0] for column in cursor.description)
+    cursor.row_factory = None
+    if not shared:
+        return [cls(row) for row in cursor]
+
+    positions = [cls.index[name] for name in shared]
+    rows = []
+    for row in cursor:
+        values = list(row)
+        for i in positions:
+            if type(values[i]) is str:
+                values[i] = sys.intern(values[i])
+        rows.append(cls(tuple(values)))
+    return rows
+
+EXPLAINABLE_SQL = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\b", re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """Текст запроса без литералов, чтобы запросы с разными параметрами считались вместе"""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\?(?:\s*,\s*\?)+", "?, ...", sql)
+    return " ".join(sql.split())
+
+
+class QueryMetrics:
+    """Замеры запросов, методов DatabaseManager и зависаний интерфейса.
+
+    Запросы и методы агрегируются (число вызовов, суммарное и наибольшее
+    время), медленные запросы с планом и зависания хранятся последними
+    max_events записями. Все методы можно вызывать из любого потока.
+    """
+
+    def __init__(self, slow_query_ms=100, max_statements=500, max_events=200):
+        self.slow_query_ms = slow_query_ms
+        self.max_statements = max_statements
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = datetime.now().isoformat(timespec='seconds')
+            self.statements = {}
+            self.methods = {}
+            self.slow_queries = deque(maxlen=self.max_events)
+            self.stalls = deque(maxlen=self.max_events)
+
+    @staticmethod
+    def _add(table, key, milliseconds):
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+        entry['calls'] += 1
+        entry['total_ms'] += milliseconds
+        if milliseconds > entry['max_ms']:
+            entry['max_ms'] = milliseconds
+
+    def record_statement(self, sql, seconds):
+        """Учёт выполненного выражения; True, если оно медленнее порога"""
+        milliseconds = seconds * 1000
+        key = normalize_sql(sql)
+        with self._lock:
+            if key in self.statements or len(self.statements) < self.max_statements:
+                self._add(self.statements, key, milliseconds)
+        return milliseconds >= self.slow_query_ms
+
+    def record_slow_query(self, sql, seconds, plan):
+        with self._lock:
+            self.slow_queries.append({
+                'time': datetime.now().isoformat(timespec='milliseconds'),
+                'thread': threading.current_thread().name,
+                'ms': round(seconds * 1000, 3),
+                'sql': sql,
+                'plan': plan,
+            })
+
+    def record_call(self, name, seconds):
+        with self._lock:
+            self._add(self.methods, name, seconds * 1000)
+
+    def record_stall(self, milliseconds, call, stack):
+        with self._lock:
+            self.stalls.append({
+                'time': datetime.now().isoformat(timespec='milliseconds'),
+                'ms': round(milliseconds, 1),
+                'call': call,
+                'stack': stack,
+            })
+
+    def snapshot(self):
+        """Текущие замеры в виде, пригодном для JSON"""
+        def ordered(table, field):
+            rows = [dict(entry, **{field: key}, total_ms=round(entry['total_ms'], 3),
+                         max_ms=round(entry['max_ms'], 3),
+                         avg_ms=round(entry['total_ms'] / entry['calls'], 3))
+                    for key, entry in table.items()]
+            return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+        with self._lock:
+            return {
+                'started': self.started,
+                'exported': datetime.now().isoformat(timespec='seconds'),
+                'slow_query_ms': self.slow_query_ms,
+                'statements': ordered(self.statements, 'sql'),
+                'methods': ordered(self.methods, 'method'),
+                'slow_queries': list(self.slow_queries),
+                'stalls': list(self.stalls),
+            }
+
+    def export(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+
+def timed_methods(cls):
+    """Замер времени каждого публичного метода класса в self.metrics"""
+    def wrap(name, method):
+        @functools.wraps(method)
+        def timed(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                metrics.record_call(name, time.perf_counter() - started)
+        return timed
+
+    for name, method in list(vars(cls).items()):
+        if not name.startswith('_') and callable(method):
+            setattr(cls, name, wrap(f"{cls.__name__}.{name}", method))
+    return cls
+
+
+class PooledConnection(sqlite3.Connection):
+    """Соединение из пула: close() возвращает его в пул, а не закрывает"""
+
+    pool = None
+    owner = None
+    metrics = None
+    traced_sql = None
+    traced_at = 0.0
+    slow_pending = ()
+
+    def trace(self, sql):
+        """Обработчик set_trace_callback.
+
+        SQLite сообщает только о начале выражения, поэтому выражение считается
+        выполняющимся до начала следующего или до возврата соединения в пул -
+        строки результата выбираются как раз в этом промежутке.
+        """
+        # Выражения триггеров приходят повторно с тем же текстом, вложенные
+        # выражения FTS5 - с префиксом "--"; их время входит во внешнее выражение
+        if sql == self.traced_sql or sql.startswith('--'):
+            return
+        now = time.perf_counter()
+        self.finish_trace(now)
+        self.traced_sql = sql
+        self.traced_at = now
+
+    def finish_trace(self, now=None):
+        sql = self.traced_sql
+        if sql is None or self.metrics is None:
+            return
+        self.traced_sql = None
+        seconds = (now or time.perf_counter()) - self.traced_at
+        if self.metrics.record_statement(sql, seconds):
+            if not self.slow_pending:
+                self.slow_pending = []
+            self.slow_pending.append((sql, seconds))
+
+    def stop_trace(self):
+        """Отключение трассировки до возврата соединения в пул"""
+        self.finish_trace()
+        self.set_trace_callback(None)
+
+    def explain_slow_queries(self):
+        """План медленных выражений; выполняется вне обработчика трассировки"""
+        pending, self.slow_pending = self.slow_pending, ()
+        self.set_trace_callback(None)
+        for sql, seconds in pending:
+            plan = None
+            if EXPLAINABLE_SQL.match(sql):
+                try:
+                    plan = [row[3] for row in self.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                except sqlite3.Error as e:
+                    plan = [f"Ошибка при получении плана: {e}"]
+            self.metrics.record_slow_query(sql, seconds, plan)
+
+    def close(self):
+        if self.metrics is not None:
+            self.finish_trace()
+            if self.slow_pending:
+                self.explain_slow_queries()
+        if self.pool is not None and self.pool.release(self):
+            return
+        super().close()
+
+    def close_physical(self):
+        """Действительное закрытие соединения"""
+        super().close()
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite, отдельный для каждого потока"""
+
+    DEFAULT_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 134217728,
+        'temp_store': 'MEMORY',
+    }
+
+    def __init__(self, database, pragmas=None, max_idle_per_thread=2, timeout=5.0, metrics=None):
+        self.database = database
+        self.metrics = metrics
+        self.pragmas = dict(self.DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self.max_idle_per_thread = max_idle_per_thread
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._closed = False
+
+    def _idle(self):
+        idle = getattr(self._local, 'idle', None)
+        if idle is None:
+            idle = self._local.idle = []
+        return idle
+
+    def _configure(self, conn):
+        for name, value in self.pragmas.items():
+            if value is not None:
+                conn.execute(f"PRAGMA {name}={value}")
+
+    def acquire(self):
+        """Свободное соединение текущего потока или новое"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Пул соединений закрыт")
+
+        idle = self._idle()
+        if idle:
+            conn = idle.pop()
+            conn.owner = threading.get_ident()
+            self._trace(conn)
+            return conn
+
+        # Соединение используется только потоком, который его взял,
+        # но закрывается при остановке из главного потока.
+        conn = sqlite3.connect(self.database, timeout=self.timeout,
+                               factory=PooledConnection, check_same_thread=False)
+        try:
+            self._configure(conn)
+        except sqlite3.Error:
+            conn.close_physical()
+            raise
+        conn.row_factory = sqlite3.Row
+        conn.pool = self
+        conn.owner = threading.get_ident()
+        self._trace(conn)
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def _trace(self, conn):
+        # Пакетная загрузка может отключить трассировку, при выдаче она включается снова
+        conn.metrics = self.metrics
+        conn.set_trace_callback(conn.trace if self.metrics is not None else None)
+
+    def release(self, conn):
+        """Возврат соединения в пул; False, если его нужно закрыть"""
+        idle = self._idle()
+        if conn in idle:
+            return True
+
+        conn.owner = None
+        if not self._closed and len(idle) < self.max_idle_per_thread:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                idle.append(conn)
+                return True
+            except sqlite3.Error:
+                pass
+
+        with self._lock:
+            self._connections.discard(conn)
+        return False
+
+    def interrupt(self, thread_id):
+        """Прерывание запросов, выполняемых соединениями указанного потока"""
+        with self._lock:
+            connections = [conn for conn in self._connections if conn.owner == thread_id]
+        for conn in connections:
+            conn.interrupt()
+
+    def close(self):
+        """Закрытие всех соединений пула"""
+        with self._lock:
+            self._closed = True
+            connections = list(self._connections)
+            self._connections.clear()
+
+        for conn in connections:
+            try:
+                conn.close_physical()
+            except sqlite3.Error:
+                pass
+
+
+class SnapshotConnection(sqlite3.Connection):
+    """Соединение со снимком; снимок помнит его поток, чтобы прервать отчёт"""
+
+    snapshot = None
+    owner = None
+
+    def close(self):
+        if self.snapshot is not None:
+            self.snapshot.release(self)
+            self.snapshot = None
+        super().close()
+
+
+class DatabaseSnapshot:
+    """Копия базы на момент времени для тяжёлых отчётов.
+
+    Копия снимается через backup API во временный файл и читается
+    соединениями immutable=1. Отчёт по копии не держит транзакцию чтения в
+    рабочей базе, поэтому не задерживает контрольные точки WAL и не мешает
+    записи. Снимок обновляется при обращении, если он старше max_age секунд
+    (None - не обновляется сам), каждые refresh_interval секунд в фоне или
+    вызовом refresh().
+    """
+
+    def __init__(self, database, max_age=300.0, refresh_interval=None, directory=None):
+        self.database = database
+        self.max_age = max_age
+        self.directory = tempfile.mkdtemp(prefix='partners-snapshot-', dir=directory)
+        self.path = None
+        self.taken_at = None
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if refresh_interval:
+            self.thread = threading.Thread(target=self._refresh_periodically, args=(refresh_interval,),
+                                           name='db-snapshot', daemon=True)
+            self.thread.start()
+
+    def refresh(self):
+        """Новая копия базы; возвращает время, на которое она снята"""
+        with self.lock:
+            return self._take()
+
+    def _take(self):
+        self.generation += 1
+        path = os.path.join(self.directory, f"snapshot-{self.generation}.db")
+        source = sqlite3.connect(self.database)
+        target = sqlite3.connect(path)
+        try:
+            # Копия соответствует началу транзакции чтения backup
+            taken_at = time.time()
+            source.backup(target)
+            target.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            target.close()
+            source.close()
+
+        self.path, self.taken_at = path, taken_at
+        # Предыдущая копия остаётся для соединений, открытых до обновления
+        stale = os.path.join(self.directory, f"snapshot-{self.generation - 2}.db")
+        if os.path.exists(stale):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+        return taken_at
+
+    def _refresh_periodically(self, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.refresh()
+            except (sqlite3.Error, OSError) as e:
+                print(f"Ошибка при обновлении снимка базы: {e}")
+
+    def is_stale(self):
+        if self.path is None:
+            return True
+        return self.max_age is not None and time.time() - self.taken_at > self.max_age
+
+    def connect(self):
+        """(соединение только для чтения со снимком, сведения о свежести снимка)"""
+        if self.is_stale():
+            # Устаревший снимок обновляет один поток, остальные пока читают текущий
+            if self.lock.acquire(blocking=self.path is None):
+                try:
+                    if self.is_stale():
+                        self._take()
+                finally:
+                    self.lock.release()
+
+        path, taken_at = self.path, self.taken_at
+        conn = sqlite3.connect(Path(path).as_uri() + "?mode=ro&immutable=1", uri=True,
+                               check_same_thread=False, factory=SnapshotConnection)
+        conn.row_factory = sqlite3.Row
+        conn.snapshot = self
+        conn.owner = threading.get_ident()
+        with self.connections_lock:
+            self.connections.add(conn)
+        return conn, self.freshness(taken_at)
+
+    def release(self, conn):
+        with self.connections_lock:
+            self.connections.discard(conn)
+
+    def interrupt(self, thread_id):
+        """Прерывание отчётов, читающих снимок в указанном потоке"""
+        with self.connections_lock:
+            connections = [conn for conn in self.connections if conn.owner == thread_id]
+        for conn in connections:
+            conn.interrupt()
+
+    @staticmethod
+    def freshness(taken_at):
+        return {
+            'taken_at': datetime.fromtimestamp(taken_at).isoformat(timespec='seconds'),
+            'age_seconds': round(time.time() - taken_at, 1),
+        }
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _insert_partner(conn, params):
+    return conn.execute('''
+        INSERT INTO partners
+        (name_partner, id_type_partner, director, email, phone_number,
+         legal_address, inn, current_rating)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', params).lastrowid
+
+
+def _update_partner(conn, params):
+    return conn.execute('''
+        UPDATE partners
+        SET name_partner=?, id_type_partner=?, director=?, email=?,
+            phone_number=?, legal_address=?, inn=?, current_rating=?
+        WHERE id_partner=?
+    ''', params).rowcount
+
+
+def _insert_sale(conn, params):
+    return conn.execute('''
+        INSERT INTO sales_history (id_partner, id_product, amount_product, total_sale_amount, sale_date)
+        VALUES (?, ?, ?, ?, ?)
+    ''', params).lastrowid
+
+
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+
+
+def is_busy_error(error):
+    """Ошибка из-за блокировки базы другим соединением"""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (SQLITE_BUSY, SQLITE_LOCKED)
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+class WriteQueue:
+    """Поток записи с групповой фиксацией.
+
+    Записи из очереди выполняются одной транзакцией, пока их не наберётся
+    batch_size или не пройдёт max_delay_ms с первой. Каждая запись идёт в
+    своей точке сохранения, поэтому ошибка одной откатывает только её.
+    Future вызывающего завершается после COMMIT. При SQLITE_BUSY транзакция
+    повторяется с растущей паузой.
+    """
+
+    def __init__(self, pool, batch_size=256, max_delay_ms=0.0, busy_retries=5, busy_backoff=0.01):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, function, *args):
+        """Future с результатом function(conn, *args) после фиксации транзакции"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Очередь записи закрыта")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+            self._queue.put((future, function, args))
+        return future
+
+    def close(self):
+        """Запись оставшихся в очереди операций и остановка потока"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            batch = [entry for entry in batch if entry[0].set_running_or_notify_cancel()]
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        try:
+            conn = self.pool.acquire()
+        except sqlite3.Error as e:
+            for future, _, _ in batch:
+                future.set_exception(e)
+            return
+
+        try:
+            results = self._with_retry(conn, batch)
+        except Exception as e:
+            for future, _, _ in batch:
+                future.set_exception(e)
+        else:
+            for (future, _, _), (error, result) in zip(batch, results):
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+        finally:
+            conn.close()
+
+    def _with_retry(self, conn, batch):
+        delay = self.busy_backoff
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return self._transaction(conn, batch)
+            except sqlite3.OperationalError as e:
+                if attempt == self.busy_retries or not is_busy_error(e):
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+
+    def _transaction(self, conn, batch):
+        """[(ошибка, результат)] записей пакета, зафиксированных одной транзакцией"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            results = []
+            for _, function, args in batch:
+                conn.execute("SAVEPOINT write_queue")
+                try:
+                    results.append((None, function(conn, *args)))
+                except sqlite3.Error as e:
+                    if is_busy_error(e):
+                        raise
+                    conn.execute("ROLLBACK TO write_queue")
+                    results.append((e, None))
+                conn.execute("RELEASE write_queue")
+            conn.commit()
+            return results
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+
+@timed_methods
+class DatabaseManager:
+    def __init__(self, database="partners_management.db", pragmas=None, seed_demo=False,
+                 discount_brackets=DEFAULT_DISCOUNT_BRACKETS, metrics=None,
+                 write_batch_size=256, write_delay_ms=0.0, snapshot=False, snapshot_max_age=300.0,
+                 snapshot_interval=None):
+        self.database = database
+        self.metrics = metrics
+        self.discount_brackets = discount_brackets
+        self.discount_sql = discount_case_sql("COALESCE(ss.total_quantity, 0)", discount_brackets)
+        self.partners_select = PARTNERS_PAGE_SELECT.format(discount=self.discount_sql)
+        self.pool = ConnectionPool(self.database, pragmas, metrics=metrics)
+        self.writes = WriteQueue(self.pool, write_batch_size, write_delay_ms)
+        self.reference_cache = ReferenceCache(self)
+        self.ready = self.init_database()
+        if seed_demo:
+            self.seed_demo_data()
+        # Отчёты и выгрузки читают снимок базы, а не рабочий файл
+        self.snapshot = None
+        if snapshot:
+            self.snapshot = DatabaseSnapshot(self.database, snapshot_max_age, snapshot_interval)
+
+    def get_connection(self):
+        try:
+            return self.pool.acquire()
+        except sqlite3.Error as e:
+            print(f"Ошибка подключения к базе данных: {e}")
+            return None
+
+    def get_report_connection(self):
+        """Соединение для отчётов и сведения о свежести снимка (None - рабочая база)"""
+        if self.snapshot is None:
+            return self.get_connection(), None
+        try:
+            return self.snapshot.connect()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Ошибка при подготовке снимка базы: {e}")
+            return None, None
+
+    def interrupt(self, thread_id):
+        """Прерывание запросов, выполняемых в указанном потоке"""
+        self.pool.interrupt(thread_id)
+        if self.snapshot is not None:
+            self.snapshot.interrupt(thread_id)
+
+    def close(self):
+        """Запись очереди, обновление статистики планировщика и закрытие соединений"""
+        self.writes.close()
+        if self.snapshot is not None:
+            self.snapshot.close()
+        conn = self.get_connection()
+        if conn:
+            try:
+                conn.execute("PRAGMA optimize")
+            except sqlite3.Error as e:
+                print(f"Ошибка при оптимизации базы данных: {e}")
+            finally:
+                conn.close()
+        self.pool.close()
+
+    def init_database(self):
+        """Приведение схемы базы данных к актуальной версии; False при ошибке"""
+        conn = self.get_connection()
+        if not conn:
+            return False
+
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                # Индекс по ИНН, пропущенный из-за дублей, создаётся, когда их исправят
+                if not has_partner_inn_index(conn):
+                    create_partner_inn_index(conn)
+                    conn.commit()
+            else:
+                self._migrate(conn)
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Ошибка при инициализации базы данных: {e}")
+            conn.close()
+            return False
+
+        try:
+            # Загрузка продаж с --defer-indexes могла прерваться, не вернув индексы
+            restore_deferred_indexes(conn, abandoned=True)
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Ошибка при восстановлении индексов продаж: {e}")
+        finally:
+            conn.close()
+        return True
+
+    def _migrate(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        # Другой процесс мог обновить схему, пока мы ждали блокировку
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        applied = []
+        for target, description, statements in MIGRATIONS:
+            if target <= version:
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {target}")
+            applied.append((target, description))
+        conn.commit()
+        for target, description in applied:
+            print(f"Применена миграция {target}: {description}")
+        print("База данных успешно инициализирована")
+
+    def seed_demo_data(self):
+        """Заполнение пустой базы демонстрационными данными"""
+        conn = self.get_connection()
+        if not conn:
+            return
+
+        try:
+            cursor = conn.cursor()
+            self.add_test_data(cursor)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка при добавлении тестовых данных: {e}")
+        finally:
+            conn.close()
+
+    def add_test_data(self, cursor):
+        """Добавление тестовых данных"""
+        cursor.execute("SELECT COUNT(*) as count FROM managers")
+        if cursor.fetchone()['count'] == 0:
+            cursor.execute('''
+                INSERT INTO managers (login, password_hash, full_name, role) 
+                VALUES (?, ?, ?, ?)
+            ''', ('manager', hash_password('pass'), 'Менеджер', 'Менеджер'))
+
+        cursor.execute("SELECT COUNT(*) as count FROM type_partners")
+        if cursor.fetchone()['count'] == 0:
+            cursor.execute('''
+                INSERT INTO type_partners (type_name) VALUES 
+                ('Поставщик'), ('Дистрибьютор'), ('Розничный партнер'), ('Оптовый покупатель')
+            ''')
+
+        cursor.execute("SELECT COUNT(*) as count FROM partners")
+        if cursor.fetchone()['count'] == 0:
+            cursor.execute('''
+                INSERT INTO partners (name_partner, id_type_partner, director, email, phone_number, legal_address, inn, current_rating) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', ('ООО "СтройМатериалы"', 1, 'Иванов Иван Иванович', 'info@stroymat.ru', '+7-495-123-45-67',
+                  'г. Москва, ул. Строителей, д. 1', '1234567890', 8))
+
+        cursor.execute("SELECT COUNT(*) as count FROM products")
+        if cursor.fetchone()['count'] == 0:
+            cursor.execute('''
+                INSERT INTO products (name_product, price) VALUES 
+                ('Ламинат Premium', 1500.50),
+                ('Паркетная доска', 3200.75)
+            ''')
+
+    def get_all_partners(self):
+        conn = self.get_connection()
+        if not conn:
+            return []
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(PARTNERS_QUERY)
+            partners = fetch_records(cursor, PARTNER_SHARED_FIELDS)
+            return partners
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении партнеров: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_partners_page(self, sort_key='name_partner', after=None, limit=200, descending=False):
+        """Страница списка партнеров после позиции after = (значение ключа, id_partner)"""
+        if sort_key not in PARTNER_SORT_KEYS:
+            raise ValueError(f"Неизвестный ключ сортировки: {sort_key}")
+
+        conn = self.get_connection()
+        if not conn:
+            return []
+
+        try:
+            if sort_key == 'type_name':
+                return self._get_partners_page_by_type(conn, after, limit, descending)
+            return self._get_partners_page_by_column(conn, sort_key, after, limit, descending)
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении партнеров: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def _get_partners_page_by_column(self, conn, sort_key, after, limit, descending):
+        expression = PARTNER_SORT_KEYS[sort_key]
+        direction = "DESC" if descending else "ASC"
+        op = '<' if descending else '>'
+        order = f" ORDER BY {expression} {direction}, p.id_partner {direction} LIMIT ?"
+
+        if after is None:
+            return fetch_records(conn.execute(self.partners_select + order, (limit,)),
+                                 PARTNER_SHARED_FIELDS)
+
+        # Два точных поиска по индексу вместо сравнения кортежей: остаток строк
+        # с тем же значением ключа, затем строки со следующими значениями.
+        rows = fetch_records(conn.execute(
+            self.partners_select + f" WHERE {expression} = ? AND p.id_partner {op} ?"
+            f" ORDER BY p.id_partner {direction} LIMIT ?",
+            (after[0], after[1], limit)), PARTNER_SHARED_FIELDS)
+        if len(rows) < limit:
+            rows += fetch_records(conn.execute(
+                self.partners_select + f" WHERE {expression} {op} ?" + order,
+                (after[0], limit - len(rows))), PARTNER_SHARED_FIELDS)
+        return rows
+
+    def _get_partners_page_by_type(self, conn, after, limit, descending):
+        # Типов немного, поэтому страница собирается из групп по типам в порядке
+        # названия; внутри группы строки идут по индексу (id_type_partner, id_partner).
+        groups = {}
+        for row in conn.execute("SELECT id_type_partner, type_name FROM type_partners"):
+            groups.setdefault(row['type_name'] or '', []).append(row['id_type_partner'])
+        ordered = sorted(groups.items(), reverse=descending)
+        null_group = ('', None)
+        ordered = ordered + [null_group] if descending else [null_group] + ordered
+
+        direction = "DESC" if descending else "ASC"
+        rows = []
+        for type_name, type_ids in ordered:
+            if len(rows) >= limit:
+                break
+
+            if after is not None and (type_name > after[0] if descending else type_name < after[0]):
+                continue
+
+            if type_ids is None:
+                condition = "p.id_type_partner IS NULL"
+                params = []
+            else:
+                condition = f"p.id_type_partner IN ({', '.join('?' * len(type_ids))})"
+                params = list(type_ids)
+
+            if after is not None and type_name == after[0]:
+                condition += f" AND p.id_partner {'<' if descending else '>'} ?"
+                params.append(after[1])
+
+            params.append(limit - len(rows))
+            rows.extend(fetch_records(conn.execute(
+                self.partners_select + f" WHERE {condition} ORDER BY p.id_partner {direction} LIMIT ?",
+                params), PARTNER_SHARED_FIELDS))
+        return rows
+
+    def get_partners_version(self):
+        """Текущий номер версии списка партнеров"""
+        conn = self.get_connection()
+        if not conn:
+            return 0
+
+        try:
+            return conn.execute("SELECT value FROM partner_version").fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении версии партнеров: {e}")
+            return 0
+        finally:
+            conn.close()
+
+    def get_partners_changed_since(self, version):
+        """Партнеры, изменённые после версии version, и id удалённых партнеров"""
+        conn = self.get_connection()
+        if not conn:
+            return None
+
+        try:
+            # Одна транзакция чтения: версия, изменения и удаления из одного снимка базы,
+            # иначе запись между запросами пропадёт до следующего изменения
+            conn.execute("BEGIN")
+            current = conn.execute("SELECT value FROM partner_version").fetchone()[0]
+            changed = fetch_records(conn.execute(
+                self.partners_select + " WHERE p.row_version > ? ORDER BY p.row_version", (version,)),
+                PARTNER_SHARED_FIELDS)
+            deleted = [row['id_partner'] for row in conn.execute(
+                "SELECT id_partner FROM partner_tombstones WHERE row_version > ?", (version,))]
+            conn.commit()
+            return {'version': current, 'changed': changed, 'deleted': deleted}
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Ошибка при получении изменений партнеров: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def search_partners(self, text, limit=200, offset=0):
+        """Поиск партнеров по наименованию, директору, email, телефону и ИНН.
+
+        Слова ищутся как префиксы. Если совпадений не больше
+        SEARCH_RANKING_LIMIT, результаты упорядочены по релевантности (bm25),
+        иначе - по id_partner: ранжирование всех совпадений слишком дорого,
+        а для широкого запроса и не несёт смысла.
+        """
+        query = partner_search_query(text)
+        if not query:
+            return []
+
+        conn = self.get_connection()
+        if not conn:
+            return []
+
+        try:
+            matches = conn.execute('''
+                SELECT COUNT(*) FROM (
+                    SELECT rowid FROM partners_fts WHERE partners_fts MATCH ? LIMIT ?
+                )
+            ''', (query, SEARCH_RANKING_LIMIT + 1)).fetchone()[0]
+            if matches > SEARCH_RANKING_LIMIT:
+                order = "f.rowid"
+            else:
+                order = "bm25(partners_fts, 10.0, 3.0, 2.0, 2.0, 5.0), f.rowid"
+
+            rows = conn.execute(self.partners_select.replace(
+                "FROM partners p",
+                "FROM partners_fts f JOIN partners p ON p.id_partner = f.rowid") + f'''
+                WHERE partners_fts MATCH ?
+                ORDER BY {order}
+                LIMIT ? OFFSET ?
+            ''', (query, limit, offset))
+            return fetch_records(rows, PARTNER_SHARED_FIELDS)
+        except sqlite3.Error as e:
+            print(f"Ошибка при поиске партнеров: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def open_partners_search(self, text):
+        """Курсор по результатам поиска партнеров"""
+        return PartnerSearchCursor(self, text)
+
+    def change_tracker(self):
+        """Отдельное соединение для дешёвой проверки изменений базы"""
+        return ChangeTracker(self.database)
+
+    def open_partners_cursor(self, sort_key='name_partner', descending=False):
+        """Курсор по списку партнеров для чтения блоками"""
+        return PartnerCursor(self, sort_key, descending)
+
+    def open_export_cursor(self, name):
+        """Потоковая выгрузка EXPORT_QUERIES[name]; курсор закрывает вызывающий"""
+        conn, snapshot = self.get_report_connection()
+        if not conn:
+            return None
+
+        try:
+            cursor = conn.cursor()
+            # Кортежи вместо sqlite3.Row: выгрузке не нужен доступ по именам
+            cursor.row_factory = None
+            cursor.execute(EXPORT_QUERIES[name].format(discount=self.discount_sql))
+            return ExportCursor(conn, cursor, snapshot)
+        except sqlite3.Error as e:
+            print(f"Ошибка при выгрузке данных: {e}")
+            conn.close()
+            return None
+
+    def get_partner_types(self):
+        conn = self.get_connection()
+        if not conn:
+            return []
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id_type_partner, type_name FROM type_partners")
+            types = fetch_records(cursor)
+            return types
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении типов партнеров: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_products(self):
+        conn = self.get_connection()
+        if not conn:
+            return []
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id_product, name_product, price FROM products")
+            products = [dict(row) for row in cursor.fetchall()]
+            return products
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении продукции: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_reference_versions(self):
+        """Версии справочников: {имя таблицы: номер версии}"""
+        conn = self.get_connection()
+        if not conn:
+            return {}
+
+        try:
+            return {row['name']: row['value']
+                    for row in conn.execute("SELECT name, value FROM reference_version")}
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении версий справочников: {e}")
+            return {}
+        finally:
+            conn.close()
+
+    def submit_add_partner(self, name, type_id, director, email, phone, address, inn, rating):
+        """Добавление партнера через очередь записи; Future с id нового партнера"""
+        return self.writes.submit(_insert_partner, (name, type_id, director, email, phone,
+                                                    address, inn, rating))
+
+    def submit_update_partner(self, partner_id, name, type_id, director, email,
+                              phone, address, inn, rating):
+        """Изменение партнера через очередь записи; Future с числом изменённых строк"""
+        return self.writes.submit(_update_partner, (name, type_id, director, email, phone,
+                                                    address, inn, rating, partner_id))
+
+    def submit_add_sale(self, partner_id, product_id, amount, total, sale_date):
+        """Добавление продажи через очередь записи; Future с id продажи"""
+        return self.writes.submit(_insert_sale, (partner_id, product_id, amount, total, sale_date))
+
+    def add_partner(self, name, type_id, director, email, phone, address, inn, rating):
+        try:
+            self.submit_add_partner(name, type_id, director, email, phone, address, inn, rating).result()
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при добавлении партнера: {e}")
+            return False
+
+    def update_partner(self, partner_id, name, type_id, director, email,
+                       phone, address, inn, rating):
+        try:
+            self.submit_update_partner(partner_id, name, type_id, director, email,
+                                       phone, address, inn, rating).result()
+            print(f"Партнер {partner_id} успешно обновлен")
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при обновлении партнера: {e}")
+            return False
+
+    def add_sale(self, partner_id, product_id, amount, total, sale_date):
+        try:
+            self.submit_add_sale(partner_id, product_id, amount, total, sale_date).result()
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка при добавлении продажи: {e}")
+            return False
+
+    def sync_partners(self, records, chunk_size=5000):
+        """Загрузка партнеров с обновлением по ИНН.
+
+        records - словари с полями partners и названием типа в type_name.
+        Все изменения выполняются одной транзакцией; строки без изменений
+        не перезаписываются. Возвращает счётчики и список отклонённых записей.
+        """
+        conn = self.get_connection()
+        if not conn:
+            return None
+
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'rejected': []}
+        try:
+            # PARTNER_UPSERT опирается на уникальный индекс по ИНН
+            if not has_partner_inn_index(conn):
+                print("Синхронизация партнеров недоступна: в базе повторяются ИНН, "
+                      "уникальный индекс по ИНН не создан")
+                for inn, partner_ids in duplicate_partner_inns(conn):
+                    print(f"  ИНН {inn}: id_partner {partner_ids}")
+                return None
+
+            types = {row['type_name']: row['id_type_partner']
+                     for row in conn.execute("SELECT id_type_partner, type_name FROM type_partners")}
+            known_inns = {row['inn'] for row in conn.execute("SELECT inn FROM partners WHERE inn IS NOT NULL")}
+
+            # Трассировка каждой строки executemany замедлила бы загрузку в разы
+            conn.stop_trace()
+            conn.execute("BEGIN IMMEDIATE")
+            chunk = []
+            changed = 0
+            for number, record in enumerate(records):
+                try:
+                    row = self._partner_sync_row(record, types)
+                except (KeyError, TypeError, ValueError) as e:
+                    counts['rejected'].append((number, record, str(e)))
+                    continue
+
+                if row[6] not in known_inns:
+                    known_inns.add(row[6])
+                    counts['inserted'] += 1
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    changed += conn.executemany(PARTNER_UPSERT, chunk).rowcount
+                    counts['unchanged'] += len(chunk)
+                    chunk = []
+
+            if chunk:
+                changed += conn.executemany(PARTNER_UPSERT, chunk).rowcount
+                counts['unchanged'] += len(chunk)
+            conn.commit()
+
+            counts['updated'] = changed - counts['inserted']
+            counts['unchanged'] -= changed
+            return counts
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Ошибка при синхронизации партнеров: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def _partner_sync_row(self, record, types):
+        name, inn = record['name_partner'], record['inn']
+        name = str(name).strip() if name is not None else ''
+        inn = str(inn).strip() if inn is not None else ''
+        if not name or not inn:
+            raise ValueError("не указано наименование или ИНН")
+
+        type_name = record.get('type_name')
+        type_id = None
+        if type_name:
+            type_id = types.get(type_name.strip())
+            if type_id is None:
+                raise ValueError(f"неизвестный тип партнера {type_name}")
+
+        rating = record.get('current_rating')
+        rating = 5 if rating in (None, '') else int(rating)
+        if rating < 1 or rating > 10:
+            raise ValueError("рейтинг должен быть от 1 до 10")
+
+        return (name, type_id, record.get('director'), record.get('email'),
+                record.get('phone_number'), record.get('legal_address'), inn, rating)
+
+    def get_partner_discounts(self, partner_ids=None):
+        """Скидки партнеров одним запросом с группировкой по sales_history.
+
+        partner_ids ограничивает расчёт одной страницей партнеров.
+        Возвращает {id_partner: {'total_quantity': ..., 'discount': ...}}.
+        """
+        conn = self.get_connection()
+        if not conn:
+            return {}
+
+        query = f'''
+            SELECT id_partner, total_quantity,
+                   {discount_case_sql("total_quantity", self.discount_brackets)} AS discount
+            FROM (
+                SELECT id_partner, COALESCE(SUM(amount_product), 0) AS total_quantity
+                FROM sales_history
+                WHERE id_partner IS NOT NULL{{}}
+                GROUP BY id_partner
+            )
+        '''
+        params = []
+        if partner_ids is not None:
+            partner_ids = list(partner_ids)
+            query = query.format(f" AND id_partner IN ({', '.join('?' * len(partner_ids))})")
+            params = partner_ids
+        else:
+            query = query.format("")
+
+        try:
+            return {row['id_partner']: {'total_quantity': row['total_quantity'],
+                                        'discount': row['discount']}
+                    for row in conn.execute(query, params)}
+        except sqlite3.Error as e:
+            print(f"Ошибка при расчёте скидок: {e}")
+            return {}
+        finally:
+            conn.close()
+
+    def get_partner_sales_stats(self, partner_id):
+        conn, snapshot = self.get_report_connection()
+        if not conn:
+            return {}
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT total_quantity, total_amount
+                FROM partner_sales_summary
+                WHERE id_partner = ?
+            ''', (partner_id,))
+            total_stats = cursor.fetchone() or {'total_quantity': 0, 'total_amount': 0}
+
+            cursor.execute('''
+                SELECT p.name_product, s.quantity, s.amount
+                FROM partner_product_summary s
+                JOIN products p ON s.id_product = p.id_product
+                WHERE s.id_partner = ?
+                ORDER BY s.amount DESC
+            ''', (partner_id,))
+            product_stats = fetch_records(cursor)
+
+            return {
+                'total_quantity': total_stats['total_quantity'] or 0,
+                'total_amount': total_stats['total_amount'] or 0,
+                'products': product_stats,
+                'snapshot': snapshot,
+            }
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении статистики: {e}")
+            return {}
+        finally:
+            conn.close()
+
+    def get_partner_sales_analytics(self, partner_id, date_from=None, date_to=None, bucket='month'):
+        """Продажи партнера за период с разбивкой по интервалам (day, week, month, quarter).
+
+        Читает только диапазон индекса idx_sales_partner_date. Возвращает итоги и
+        ряды по продукции, ряд итогов по интервалам с изменением к предыдущему
+        интервалу и, если задан весь период, итоги предыдущего периода той же длины.
+        """
+        if bucket not in SALES_BUCKETS:
+            raise ValueError(f"Неизвестный интервал группировки: {bucket}")
+
+        conditions = ["id_partner = ?"]
+        params = [partner_id]
+        if date_from:
+            conditions.append("sale_date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("sale_date <= ?")
+            params.append(date_to)
+        where = " AND ".join(conditions)
+
+        conn, snapshot = self.get_report_connection()
+        if not conn:
+            return {}
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT a.period, a.id_product, pr.name_product, a.quantity, a.amount
+                FROM (
+                    SELECT {SALES_BUCKETS[bucket]} AS period, id_product,
+                           SUM(amount_product) AS quantity, SUM(total_sale_amount) AS amount
+                    FROM sales_history
+                    WHERE {where}
+                    GROUP BY period, id_product
+                ) a
+                LEFT JOIN products pr ON pr.id_product = a.id_product
+            ''', params)
+            rows = cursor.fetchall()
+
+            previous = None
+            if date_from and date_to:
+                days = (date.fromisoformat(date_to) - date.fromisoformat(date_from)).days + 1
+                previous_to = date.fromisoformat(date_from) - timedelta(days=1)
+                previous_from = previous_to - timedelta(days=days - 1)
+                cursor.execute('''
+                    SELECT COALESCE(SUM(amount_product), 0) AS total_quantity,
+                           COALESCE(SUM(total_sale_amount), 0) AS total_amount
+                    FROM sales_history
+                    WHERE id_partner = ? AND sale_date >= ? AND sale_date <= ?
+                ''', (partner_id, previous_from.isoformat(), previous_to.isoformat()))
+                previous = dict(cursor.fetchone(),
+                                date_from=previous_from.isoformat(), date_to=previous_to.isoformat())
+        except sqlite3.Error as e:
+            print(f"Ошибка при получении аналитики продаж: {e}")
+            return {}
+        finally:
+            conn.close()
+
+        periods = [row['period'] for row in rows if row['period']]
+        labels = sorted(set(periods))
+        if date_from or date_to or periods:
+            try:
+                labels = sales_bucket_labels(date_from or min(periods), date_to or max(periods), bucket)
+            except ValueError:
+                # sale_date не в формате YYYY-MM-DD: периоды без заполнения пропусков
+                pass
+        position = {label: i for i, label in enumerate(labels)}
+
+        series = {}
+        products = {}
+        bucket_quantity = [0] * len(labels)
+        bucket_amount = [0] * len(labels)
+        for row in rows:
+            i = position.get(row['period'])
+            if i is None:
+                continue
+            quantity = row['quantity'] or 0
+            amount = row['amount'] or 0
+            bucket_quantity[i] += quantity
+            bucket_amount[i] += amount
+            if row['name_product'] is None:
+                continue
+            product = products.get(row['id_product'])
+            if product is None:
+                product = products[row['id_product']] = {
+                    'id_product': row['id_product'], 'name_product': row['name_product'],
+                    'quantity': 0, 'amount': 0,
+                }
+                series[row['id_product']] = {'quantity': [0] * len(labels), 'amount': [0] * len(labels)}
+            product['quantity'] += quantity
+            product['amount'] += amount
+            series[row['id_product']]['quantity'][i] = quantity
+            series[row['id_product']]['amount'][i] = amount
+
+        buckets = []
+        for i, label in enumerate(labels):
+            delta_quantity = delta_amount = delta_percent = None
+            if i:
+                delta_quantity = bucket_quantity[i] - bucket_quantity[i - 1]
+                delta_amount = bucket_amount[i] - bucket_amount[i - 1]
+                if bucket_amount[i - 1]:
+                    delta_percent = delta_amount / bucket_amount[i - 1] * 100
+            buckets.append({'period': label, 'quantity': bucket_quantity[i], 'amount': bucket_amount[i],
+                            'delta_quantity': delta_quantity, 'delta_amount': delta_amount,
+                            'delta_percent': delta_percent})
+
+        product_list = sorted(products.values(), key=lambda product: product['amount'], reverse=True)
+        for product in product_list:
+            product['series'] = series[product['id_product']]
+
+        return {
+            'bucket': bucket,
+            'date_from': date_from,
+            'date_to': date_to,
+            'total_quantity': sum(bucket_quantity),
+            'total_amount': sum(bucket_amount),
+            'products': product_list,
+            'buckets': buckets,
+            'previous': previous,
+            'snapshot': snapshot,
+        }
+
+    def append_sales_to_summaries(self, conn, after_id_sale):
+        """Пакетный учёт в сводных таблицах продаж с id_sale > after_id_sale.
+
+        Вызывается внутри транзакции загрузки, когда триггер вставки отключён.
+        """
+        for statement in SUMMARY_APPEND_SQL:
+            conn.execute(statement, (after_id_sale,))
+
+    def rebuild_sales_summaries(self, verify_only=False):
+        """Пересчёт сводных таблиц продаж с нуля.
+
+        Возвращает список расхождений между сохранёнными и пересчитанными
+        значениями (None при ошибке). При verify_only таблицы не изменяются.
+        """
+        conn = self.get_connection()
+        if not conn:
+            return None
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DROP TABLE IF EXISTS temp.fresh_partner_summary")
+            conn.execute("DROP TABLE IF EXISTS temp.fresh_product_summary")
+            conn.execute("CREATE TEMP TABLE fresh_partner_summary AS " + PARTNER_SUMMARY_SELECT)
+            conn.execute("CREATE TEMP TABLE fresh_product_summary AS " + PRODUCT_SUMMARY_SELECT)
+
+            drift = self._summary_drift(conn, 'partner_sales_summary', 'fresh_partner_summary',
+                                        ['id_partner'], ['total_quantity', 'total_amount'])
+            drift += self._summary_drift(conn, 'partner_product_summary', 'fresh_product_summary',
+                                         ['id_partner', 'id_product'], ['quantity', 'amount'])
+
+            if not verify_only:
+                conn.execute("DELETE FROM partner_sales_summary")
+                conn.execute("DELETE FROM partner_product_summary")
+                conn.execute("INSERT INTO partner_sales_summary SELECT * FROM fresh_partner_summary")
+                conn.execute("INSERT INTO partner_product_summary SELECT * FROM fresh_product_summary")
+
+            conn.execute("DROP TABLE temp.fresh_partner_summary")
+            conn.execute("DROP TABLE temp.fresh_product_summary")
+            conn.commit()
+            return drift
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Ошибка при пересчёте сводных таблиц: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def _summary_drift(self, conn, table, fresh, keys, values):
+        join = " AND ".join(f"s.{key} = f.{key}" for key in keys)
+        key_columns = ", ".join(f"COALESCE(s.{key}, f.{key}) AS {key}" for key in keys)
+        value_columns = ", ".join(f"f.{value} AS expected_{value}, s.{value} AS actual_{value}"
+                                  for value in values)
+        mismatch = " OR ".join([f"s.{keys[0]} IS NULL", "s.sales_count != f.sales_count"] +
+                               [f"ABS(s.{value} - f.{value}) > 0.005" for value in values])
+        query = f'''
+            SELECT '{table}' AS summary, {key_columns}, {value_columns}
+            FROM {fresh} f LEFT JOIN {table} s ON {join}
+            WHERE {mismatch}
+            UNION ALL
+            SELECT '{table}' AS summary, {key_columns}, {value_columns}
+            FROM {table} s LEFT JOIN {fresh} f ON {join}
+            WHERE f.{keys[0]} IS NULL
+        '''
+        return [dict(row) for row in conn.execute(query)]
+
+
+class ReferenceCache:
+    """Кэш справочников type_partners и products с индексами по id.
+
+    Справочники загружаются при первом обращении и дальше читаются из памяти.
+    validate() сверяет их версии в reference_version и сбрасывает устаревшие.
+    """
+
+    LOADERS = {
+        'type_partners': ('get_partner_types', 'id_type_partner'),
+        'products': ('get_products', 'id_product'),
+    }
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.tables = {}
+        self.versions = {}
+
+    def table(self, name):
+        """(строки, {id: номер строки}) справочника name"""
+        if name not in self.tables:
+            loader, key = self.LOADERS[name]
+            version = self.db_manager.get_reference_versions().get(name)
+            rows = getattr(self.db_manager, loader)()
+            self.tables[name] = (rows, {row[key]: number for number, row in enumerate(rows)})
+            self.versions[name] = version
+        return self.tables[name]
+
+    def validate(self):
+        """Сброс справочников, изменённых в базе; True, если что-то сброшено"""
+        stale = [name for name, version in self.db_manager.get_reference_versions().items()
+                 if name in self.tables and self.versions.get(name) != version]
+        for name in stale:
+            del self.tables[name]
+        return bool(stale)
+
+    def invalidate(self):
+        self.tables.clear()
+
+    def partner_types(self):
+        return self.table('type_partners')[0]
+
+    def partner_type_index(self, type_id):
+        """Номер типа в списке partner_types() или None"""
+        return self.table('type_partners')[1].get(type_id)
+
+    def partner_type(self, type_id):
+        rows, index = self.table('type_partners')
+        number = index.get(type_id)
+        return None if number is None else rows[number]
+
+    def products(self):
+        return self.table('products')[0]
+
+    def product(self, product_id):
+        rows, index = self.table('products')
+        number = index.get(product_id)
+        return None if number is None else rows[number]
+
+
+class ChangeTracker:
+    """Проверка изменений через PRAGMA data_version.
+
+    Значение меняется, когда изменения фиксирует любое другое соединение,
+    поэтому у трекера своё соединение, через которое ничего не пишется.
+    """
+
+    def __init__(self, database):
+        self.conn = sqlite3.connect(database, check_same_thread=False)
+        self.version = self.read_version()
+
+    def read_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def changed(self):
+        """Были ли зафиксированы изменения с прошлой проверки"""
+        version = self.read_version()
+        changed, self.version = version != self.version, version
+        return changed
+
+    def close(self):
+        self.conn.close()
+
+
+class PartnerCursor:
+    """Курсор по списку партнеров, строки читаются страницами по ключу сортировки"""
+
+    def __init__(self, db_manager, sort_key='name_partner', descending=False):
+        self.db_manager = db_manager
+        self.sort_key = sort_key
+        self.descending = descending
+        self.after = None
+        self.exhausted = False
+
+    def fetch(self, count):
+        if self.exhausted:
+            return []
+
+        rows = self.db_manager.get_partners_page(self.sort_key, self.after, count, self.descending)
+        if len(rows) < count:
+            self.exhausted = True
+        if rows:
+            self.after = partner_sort_position(self.sort_key, rows[-1])
+        return rows
+
+    def close(self):
+        self.exhausted = True
+
+
+class ExportCursor:
+    """Строки выгрузки читаются из курсора SQLite по мере записи, без списка в памяти.
+
+    snapshot - сведения о снимке базы, из которого идёт выгрузка, или None.
+    """
+
+    def __init__(self, conn, cursor, snapshot=None):
+        self.conn = conn
+        self.cursor = cursor
+        self.snapshot = snapshot
+        self.columns = [column[0] for column in cursor.description]
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def chunks(self, size=1000):
+        """Строки блоками по size: запись блока дешевле, чем построчная"""
+        fetchmany = self.cursor.fetchmany
+        rows = fetchmany(size)
+        while rows:
+            yield rows
+            rows = fetchmany(size)
+
+    def close(self):
+        self.cursor.close()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PartnerSearchCursor:
+    """Курсор по результатам полнотекстового поиска в порядке релевантности"""
+
+    after = None
+
+    def __init__(self, db_manager, text):
+        self.db_manager = db_manager
+        self.text = text
+        self.offset = 0
+        self.exhausted = False
+
+    def fetch(self, count):
+        if self.exhausted:
+            return []
+
+        rows = self.db_manager.search_partners(self.text, count, self.offset)
+        self.offset += len(rows)
+        if len(rows) < count:
+            self.exhausted = True
+        return rows
+
+    def close(self):
+        self.exhausted = True
@@ -0,0 +1,179 @@
+"""Детерминированная генерация базы заданного масштаба для замеров производительности.
+
+Одинаковые параметры и --seed дают одинаковое содержимое базы. Продажи
+распределены неравномерно: небольшая часть партнеров (дистрибьюторы)
+даёт большую часть строк sales_history.
+
+    python generate_data.py bench.db --partners 100000 --products 1000 --sales 20000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+from database import (DatabaseManager, SALES_SUMMARY_INSERT_TRIGGER, restore_deferred_indexes,
+                      touch_deferred_indexes)
+from sales_import import INSERT_SALE, defer_sales_indexes
+
+
+PARTNER_TYPES = ('Поставщик', 'Дистрибьютор', 'Розничный партнер', 'Оптовый покупатель')
+
+NAME_FORMS = ('ООО', 'АО', 'ИП', 'ЗАО')
+NAME_WORDS = ('Строй', 'Пол', 'Дом', 'Мастер', 'Паркет', 'Ламинат', 'Торг', 'Снаб',
+              'Декор', 'Интерьер', 'Комплект', 'Опт', 'Регион', 'Сервис', 'Град', 'Лес')
+SURNAMES = ('Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Волков', 'Лебедев')
+FIRST_NAMES = ('Иван', 'Пётр', 'Алексей', 'Сергей', 'Андрей', 'Дмитрий', 'Михаил', 'Николай')
+PATRONYMICS = ('Иванович', 'Петрович', 'Алексеевич', 'Сергеевич', 'Андреевич', 'Михайлович')
+CITIES = ('Москва', 'Санкт-Петербург', 'Казань', 'Екатеринбург', 'Новосибирск', 'Самара')
+PRODUCT_KINDS = ('Ламинат', 'Паркетная доска', 'Плинтус', 'Подложка', 'Инженерная доска', 'Пробка')
+
+
+def partner_rows(rng, count):
+    for i in range(1, count + 1):
+        words = rng.sample(NAME_WORDS, 2)
+        surname = rng.choice(SURNAMES)
+        yield (
+            f'{rng.choice(NAME_FORMS)} "{words[0]}{words[1].lower()}-{i}"',
+            rng.randint(1, len(PARTNER_TYPES)),
+            f"{surname} {rng.choice(FIRST_NAMES)} {rng.choice(PATRONYMICS)}",
+            f"info{i}@{words[0].lower()}{i}.ru",
+            f"+7-{rng.randint(900, 999)}-{rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}",
+            f"г. {rng.choice(CITIES)}, ул. {rng.choice(NAME_WORDS)}ская, д. {rng.randint(1, 200)}",
+            f"{7700000000 + i}",
+            rng.randint(1, 10),
+        )
+
+
+def product_rows(rng, count):
+    for i in range(1, count + 1):
+        yield f"{rng.choice(PRODUCT_KINDS)} арт. {i:05d}", round(rng.uniform(100, 10000), 2)
+
+
+def sales_rows(rng, count, partners, prices, start, days):
+    product_count = len(prices)
+    for _ in range(count):
+        # Куб равномерной величины смещает продажи к партнерам с малыми номерами
+        id_partner = int(partners * rng.random() ** 3) + 1
+        id_product = rng.randrange(product_count) + 1
+        amount = rng.randint(1, 100)
+        sale_date = start + timedelta(days=rng.randrange(days))
+        yield (id_partner, id_product, amount, round(prices[id_product - 1] * amount, 2),
+               sale_date.isoformat())
+
+
+def print_progress(stage, done, total):
+    print(f"\r{stage}: {done}/{total}", end='', file=sys.stderr, flush=True)
+    if done == total:
+        print(file=sys.stderr)
+
+
+def generate_database(path, partners=100000, products=1000, sales=20000000, seed=1,
+                      start_date='2020-01-01', days=1461, batch_size=50000,
+                      transaction_size=1000000, progress=print_progress):
+    """Создание новой базы path; возвращает число записей по таблицам и время"""
+    if os.path.exists(path):
+        raise FileExistsError(f"Файл {path} уже существует")
+    if sales and not (partners and products):
+        raise ValueError("Для генерации продаж нужны партнеры и продукция")
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    db_manager = DatabaseManager(path)
+    conn = db_manager.get_connection()
+    if not conn:
+        raise sqlite3.OperationalError("Ошибка подключения к базе данных")
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT INTO type_partners (type_name) VALUES (?)",
+                         [(name,) for name in PARTNER_TYPES])
+        rows = partner_rows(rng, partners)
+        done = 0
+        while done < partners:
+            batch = list(islice(rows, batch_size))
+            conn.executemany('''
+                INSERT INTO partners (name_partner, id_type_partner, director, email, phone_number,
+                                      legal_address, inn, current_rating)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            done += len(batch)
+            if progress:
+                progress("Партнеры", done, partners)
+
+        prices = []
+        for name, price in product_rows(rng, products):
+            conn.execute("INSERT INTO products (name_product, price) VALUES (?, ?)", (name, price))
+            prices.append(price)
+        conn.commit()
+        # Менеджер manager для входа в приложение
+        db_manager.seed_demo_data()
+
+        trigger_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                                   (SALES_SUMMARY_INSERT_TRIGGER,)).fetchone()['sql']
+        defer_sales_indexes(conn)
+
+        rows = sales_rows(rng, sales, partners, prices, date.fromisoformat(start_date), days)
+        done = 0
+        while done < sales:
+            conn.execute("BEGIN IMMEDIATE")
+            first_id = conn.execute("SELECT COALESCE(MAX(id_sale), 0) FROM sales_history").fetchone()[0]
+            conn.execute(f"DROP TRIGGER {SALES_SUMMARY_INSERT_TRIGGER}")
+            end = min(done + transaction_size, sales)
+            while done < end:
+                batch = list(islice(rows, min(batch_size, end - done)))
+                conn.executemany(INSERT_SALE, batch)
+                done += len(batch)
+            db_manager.append_sales_to_summaries(conn, first_id)
+            conn.execute(trigger_sql)
+            touch_deferred_indexes(conn)
+            conn.commit()
+            if progress:
+                progress("Продажи", done, sales)
+
+        if progress:
+            print("Создание индексов...", file=sys.stderr)
+        restore_deferred_indexes(conn)
+        conn.execute("ANALYZE")
+
+        return {
+            'partners': partners,
+            'products': products,
+            'sales': sales,
+            'seed': seed,
+            'seconds': time.perf_counter() - started,
+        }
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.close()
+        db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация базы для замеров производительности")
+    parser.add_argument('path', help="файл создаваемой базы")
+    parser.add_argument('--partners', type=int, default=100000)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--sales', type=int, default=20000000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--start-date', default='2020-01-01', help="первая дата продаж")
+    parser.add_argument('--days', type=int, default=1461, help="число дней в истории продаж")
+    args = parser.parse_args()
+
+    try:
+        counts = generate_database(args.path, args.partners, args.products, args.sales,
+                                   args.seed, args.start_date, args.days)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Ошибка генерации: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Создано партнеров: {counts['partners']}, продукции: {counts['products']}, "
+          f"продаж: {counts['sales']} за {counts['seconds']:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,261 +1,422 @@
+import time
+
+STARTUP_STARTED = time.perf_counter()
+
+import os
 import sys
-import sqlite3
+import json
+import base64
 import hashlib
-from datetime import datetime
+import sqlite3
+import threading
+import traceback
+from collections import OrderedDict
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QTableWidget, QTableWidgetItem,
-                             QPushButton, QLabel, QLineEdit, QComboBox,
-                             QTextEdit, QMessageBox, QHeaderView, QDialog,
-                             QFormLayout, QDialogButtonBox)
-from PyQt6.QtCore import Qt
+                             QTableView, QPushButton, QLabel, QLineEdit,
+                             QComboBox, QTextEdit, QMessageBox, QHeaderView,
+                             QDialog, QFormLayout, QDialogButtonBox,
+                             QStyledItemDelegate, QStyleOptionButton, QStyle,
+                             QDateEdit, QCheckBox, QTabWidget, QFileDialog)
+from PyQt6.QtGui import QKeySequence, QShortcut, QImage, QImageReader, QPixmap
+from PyQt6.QtCore import (Qt, QAbstractTableModel, QModelIndex, QEvent, QRect, QDate,
+                          QSize, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal,
+                          QBuffer, QByteArray, QIODevice)
 
+STARTUP_QT_IMPORTED = time.perf_counter()
 
-class DatabaseManager:
-    def __init__(self):
-        self.database = "partners_management.db"
-        self.init_database()
+from database import (DatabaseManager, QueryMetrics, PARTNER_SORT_KEYS,
+                      partner_search_query, partner_sort_position)
+from credentials import AuthenticationError, CredentialStore
 
-    def get_connection(self):
+
+class DatabaseTaskSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class DatabaseTask(QRunnable):
+    """Вызов DatabaseManager в рабочем потоке с возможностью отмены"""
+
+    def __init__(self, executor, function, args):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = DatabaseTaskSignals()
+        self.executor = executor
+        self.function = function
+        self.args = args
+        self.cancelled = False
+        self.thread_id = None
+        self.lock = threading.Lock()
+
+    def run(self):
         try:
-            connection = sqlite3.connect(self.database)
-            connection.row_factory = sqlite3.Row
-            return connection
-        except sqlite3.Error as e:
-            print(f"Ошибка подключения к базе данных: {e}")
+            with self.lock:
+                if self.cancelled:
+                    return
+                self.thread_id = threading.get_ident()
+
+            try:
+                result, error = self.function(*self.args), None
+            except Exception as e:
+                result, error = None, str(e)
+
+            with self.lock:
+                self.thread_id = None
+                if self.cancelled:
+                    return
+
+            if error is None:
+                self.signals.finished.emit(result)
+            else:
+                self.signals.failed.emit(error)
+        finally:
+            self.executor.task_done(self)
+
+    def cancel(self):
+        """Отмена задачи; выполняющийся запрос прерывается через interrupt()"""
+        with self.lock:
+            self.cancelled = True
+            if self.thread_id is not None:
+                self.executor.db_manager.interrupt(self.thread_id)
+
+
+class DatabaseExecutor:
+    """Выполнение запросов к базе данных вне GUI-потока"""
+
+    def __init__(self, db_manager, max_threads=2):
+        self.db_manager = db_manager
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(max_threads)
+        # Потоки не завершаются, чтобы переиспользовать их соединения из пула
+        self.thread_pool.setExpiryTimeout(-1)
+        self.tasks = set()
+        self.lock = threading.Lock()
+
+    def submit(self, function, *args, on_finished=None, on_failed=None):
+        task = DatabaseTask(self, function, args)
+        if on_finished:
+            task.signals.finished.connect(on_finished)
+        if on_failed:
+            task.signals.failed.connect(on_failed)
+        with self.lock:
+            self.tasks.add(task)
+        self.thread_pool.start(task)
+        return task
+
+    def task_done(self, task):
+        with self.lock:
+            self.tasks.discard(task)
+
+    def shutdown(self):
+        with self.lock:
+            tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        self.thread_pool.waitForDone()
+
+
+class StallDetector(QObject):
+    """Обнаружение блокировок главного потока дольше threshold_ms.
+
+    Таймер в главном потоке отмечает такты цикла событий. Фоновый поток,
+    заметив, что такта нет дольше половины порога, снимает стек главного
+    потока - это и есть вызов, из-за которого интерфейс не отвечает.
+    Когда цикл событий оживает, зависание записывается в metrics.
+    """
+
+    def __init__(self, metrics, threshold_ms=200, interval_ms=50, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.main_thread_id = threading.get_ident()
+        self.beat = time.perf_counter()
+        self.captured = None
+        self.stopped = threading.Event()
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.on_beat)
+        self.watchdog = threading.Thread(target=self.watch, name="stall-watchdog", daemon=True)
+
+    def start(self):
+        self.beat = time.perf_counter()
+        self.timer.start()
+        self.watchdog.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.stopped.set()
+        if self.watchdog.is_alive():
+            self.watchdog.join(1)
+
+    def on_beat(self):
+        now = time.perf_counter()
+        previous, self.beat = self.beat, now
+        captured, self.captured = self.captured, None
+        stall = now - previous - self.interval
+        if stall >= self.threshold:
+            call, stack = captured[1:] if captured and captured[0] == previous else (None, None)
+            self.metrics.record_stall(stall * 1000, call, stack)
+
+    def watch(self):
+        while not self.stopped.wait(self.interval / 2):
+            beat = self.beat
+            if self.captured is not None and self.captured[0] == beat:
+                continue
+            if time.perf_counter() - beat < self.interval + self.threshold / 2:
+                continue
+            frame = sys._current_frames().get(self.main_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)[-20:]
+            call = f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+            self.captured = (beat, call, stack)
+
+
+class LogoLoader(QObject):
+    """Миниатюры логотипов партнеров.
+
+    partners.logo - путь к файлу изображения (относительный - от каталога
+    базы) или data:-URI. Изображения читаются и уменьшаются в своём пуле
+    потоков: QImage можно использовать вне GUI-потока, QPixmap - нет.
+    Готовые миниатюры хранятся в памяти (не больше max_pixmaps) и на диске
+    под именем из хэша содержимого, так что после перезапуска исходные
+    файлы не декодируются заново. Первыми загружаются последние запросы -
+    строки, которые видны сейчас; самые старые отбрасываются. Логотип,
+    который не удалось прочитать или декодировать, сообщается сигналом
+    failed и больше не запрашивается.
+    """
+
+    loaded = pyqtSignal(str, int)
+    failed = pyqtSignal(str, int)
+    decoded = pyqtSignal(object, object)
+
+    def __init__(self, base_dir=".", cache_dir=None, max_pixmaps=500, max_pending=100,
+                 max_threads=2, parent=None):
+        super().__init__(parent)
+        self.base_dir = base_dir
+        self.cache_dir = cache_dir or os.path.join(base_dir, "logo_cache")
+        self.max_pixmaps = max_pixmaps
+        self.max_pending = max_pending
+        self.pixmaps = OrderedDict()
+        self.missing = set()
+        self.pending = OrderedDict()
+        self.running = set()
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(max_threads)
+        self.decoded.connect(self.on_decoded)
+
+    def pixmap(self, logo, size):
+        """Миниатюра из памяти; если её нет - None, а загрузка ставится в очередь"""
+        if not logo:
             return None
 
-    def init_database(self):
-        """Инициализация базы данных и создание таблиц"""
-        conn = self.get_connection()
-        if not conn:
+        key = (logo, size)
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+            return pixmap
+        if key not in self.missing:
+            self.request(key)
+        return None
+
+    def request(self, key):
+        with self.lock:
+            if self.closed or key in self.running:
+                return
+            if key in self.pending:
+                self.pending.move_to_end(key)
+                return
+            self.pending[key] = None
+            if len(self.pending) > self.max_pending:
+                # Строка снова запросит логотип, когда окажется на экране
+                self.pending.popitem(last=False)
+        self.thread_pool.start(self.decode_next)
+
+    def decode_next(self):
+        with self.lock:
+            if self.closed or not self.pending:
+                return
+            key, _ = self.pending.popitem()
+            self.running.add(key)
+        try:
+            image = self.thumbnail(*key)
+        except Exception as e:
+            print(f"Ошибка при загрузке логотипа: {e}")
+            image = None
+        self.decoded.emit(key, image)
+
+    def on_decoded(self, key, image):
+        with self.lock:
+            self.running.discard(key)
+        if image is None:
+            self.missing.add(key)
+            self.failed.emit(*key)
             return
+        self.pixmaps[key] = QPixmap.fromImage(image)
+        while len(self.pixmaps) > self.max_pixmaps:
+            self.pixmaps.popitem(last=False)
+        self.loaded.emit(*key)
 
+    def read_logo(self, logo):
+        """Байты изображения из data:-URI или файла; None, если прочитать не удалось"""
         try:
-            cursor = conn.cursor()
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS type_partners (
-                    id_type_partner INTEGER PRIMARY KEY AUTOINCREMENT,
-                    type_name TEXT NOT NULL
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS partners (
-                    id_partner INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name_partner TEXT NOT NULL,
-                    id_type_partner INTEGER,
-                    director TEXT,
-                    email TEXT,
-                    phone_number TEXT,
-                    legal_address TEXT,
-                    inn TEXT,
-                    current_rating INTEGER DEFAULT 5,
-                    logo TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (id_type_partner) REFERENCES type_partners(id_type_partner)
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS managers (
-                    id_manager INTEGER PRIMARY KEY AUTOINCREMENT,
-                    login TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    full_name TEXT NOT NULL,
-                    role TEXT NOT NULL,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS products (
-                    id_product INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name_product TEXT NOT NULL,
-                    price REAL
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sales_history (
-                    id_sale INTEGER PRIMARY KEY AUTOINCREMENT,
-                    id_partner INTEGER,
-                    id_product INTEGER,
-                    amount_product INTEGER,
-                    total_sale_amount REAL,
-                    sale_date DATE,
-                    FOREIGN KEY (id_partner) REFERENCES partners(id_partner),
-                    FOREIGN KEY (id_product) REFERENCES products(id_product)
-                )
-            ''')
-
-            self.add_test_data(cursor)
-            conn.commit()
-            print("База данных успешно инициализирована")
-
-        except sqlite3.Error as e:
-            print(f"Ошибка при инициализации базы данных: {e}")
-        finally:
-            conn.close()
-
-    def add_test_data(self, cursor):
-        """Добавление тестовых данных"""
-        cursor.execute("SELECT COUNT(*) as count FROM managers")
-        if cursor.fetchone()['count'] == 0:
-            cursor.execute('''
-                INSERT INTO managers (login, password_hash, full_name, role) 
-                VALUES (?, ?, ?, ?)
-            ''', ('manager', '1a1dc91c907325c69271ddf0c944bc72', 'Менеджер', 'Менеджер'))
-
-        cursor.execute("SELECT COUNT(*) as count FROM type_partners")
-        if cursor.fetchone()['count'] == 0:
-            cursor.execute('''
-                INSERT INTO type_partners (type_name) VALUES 
-                ('Поставщик'), ('Дистрибьютор'), ('Розничный партнер'), ('Оптовый покупатель')
-            ''')
-
-        cursor.execute("SELECT COUNT(*) as count FROM partners")
-        if cursor.fetchone()['count'] == 0:
-            cursor.execute('''
-                INSERT INTO partners (name_partner, id_type_partner, director, email, phone_number, legal_address, inn, current_rating) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', ('ООО "СтройМатериалы"', 1, 'Иванов Иван Иванович', 'info@stroymat.ru', '+7-495-123-45-67',
-                  'г. Москва, ул. Строителей, д. 1', '1234567890', 8))
-
-        cursor.execute("SELECT COUNT(*) as count FROM products")
-        if cursor.fetchone()['count'] == 0:
-            cursor.execute('''
-                INSERT INTO products (name_product, price) VALUES 
-                ('Ламинат Premium', 1500.50),
-                ('Паркетная доска', 3200.75)
-            ''')
-
-    def get_all_partners(self):
-        conn = self.get_connection()
-        if not conn:
-            return []
+            if logo.startswith("data:"):
+                return base64.b64decode(logo.partition(",")[2], validate=True)
+            with open(os.path.join(self.base_dir, logo), 'rb') as f:
+                return f.read()
+        except (OSError, ValueError):
+            return None
 
-        try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT p.id_partner, p.name_partner, tp.type_name, p.director, 
-                       p.email, p.phone_number, p.legal_address, p.inn, 
-                       p.current_rating, p.logo, p.id_type_partner
-                FROM partners p
-                LEFT JOIN type_partners tp ON p.id_type_partner = tp.id_type_partner
-                ORDER BY p.name_partner
-            ''')
-            partners = [dict(row) for row in cursor.fetchall()]
-            return partners
-        except sqlite3.Error as e:
-            print(f"Ошибка при получении партнеров: {e}")
-            return []
-        finally:
-            conn.close()
+    def thumbnail(self, logo, size):
+        """QImage не больше size x size; выполняется в рабочем потоке"""
+        data = self.read_logo(logo)
+        if data is None:
+            return None
 
-    def get_partner_types(self):
-        conn = self.get_connection()
-        if not conn:
-            return []
+        digest = hashlib.sha256(data).hexdigest()
+        cache_path = os.path.join(self.cache_dir, digest[:2], f"{digest}-{size}.png")
+        image = QImage(cache_path) if os.path.exists(cache_path) else QImage()
+        if not image.isNull():
+            return image
+
+        buffer = QBuffer()
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+        reader = QImageReader(buffer)
+        reader.setAutoTransform(True)
+        original = reader.size()
+        if original.isValid() and (original.width() > size or original.height() > size):
+            # JPEG уменьшается прямо при декодировании, без полноразмерной копии в памяти
+            reader.setScaledSize(original.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        if image.isNull():
+            return None
+        if image.width() > size or image.height() > size:
+            image = image.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio,
+                                 Qt.TransformationMode.SmoothTransformation)
 
         try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id_type_partner, type_name FROM type_partners")
-            types = [dict(row) for row in cursor.fetchall()]
-            return types
-        except sqlite3.Error as e:
-            print(f"Ошибка при получении типов партнеров: {e}")
-            return []
-        finally:
-            conn.close()
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temporary = f"{cache_path}.{threading.get_ident()}.tmp"
+            if image.save(temporary, "PNG"):
+                os.replace(temporary, cache_path)
+        except OSError as e:
+            print(f"Ошибка при сохранении миниатюры логотипа: {e}")
+        return image
 
-    def add_partner(self, name, type_id, director, email, phone, address, inn, rating):
-        conn = self.get_connection()
-        if not conn:
-            return False
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.pending.clear()
+        self.thread_pool.waitForDone()
 
-        try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO partners 
-                (name_partner, id_type_partner, director, email, phone_number, 
-                 legal_address, inn, current_rating)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (name, type_id, director, email, phone, address, inn, rating))
-            conn.commit()
-            return True
-        except sqlite3.Error as e:
-            print(f"Ошибка при добавлении партнера: {e}")
-            return False
-        finally:
-            conn.close()
 
-    def update_partner(self, partner_id, name, type_id, director, email,
-                       phone, address, inn, rating):
-        conn = self.get_connection()
-        if not conn:
-            return False
+class DiagnosticsDialog(QDialog):
+    """Скрытое окно диагностики (Ctrl+Shift+D в списке партнеров)"""
 
-        try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE partners 
-                SET name_partner=?, id_type_partner=?, director=?, email=?,
-                    phone_number=?, legal_address=?, inn=?, current_rating=?
-                WHERE id_partner=?
-            ''', (name, type_id, director, email, phone, address, inn, rating, partner_id))
-            conn.commit()
-            print(f"Партнер {partner_id} успешно обновлен")
-            return True
-        except sqlite3.Error as e:
-            print(f"Ошибка при обновлении партнера: {e}")
-            return False
-        finally:
-            conn.close()
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.setup_ui()
+        self.load_metrics()
+
+    def setup_ui(self):
+        self.setWindowTitle("Диагностика")
+        self.resize(900, 600)
+
+        layout = QVBoxLayout()
+        self.tabs = QTabWidget()
 
-    def get_partner_sales_stats(self, partner_id):
-        conn = self.get_connection()
-        if not conn:
-            return {}
+        self.statements_table = self.create_table("Запрос")
+        self.methods_table = self.create_table("Метод")
+        self.slow_text = QTextEdit()
+        self.slow_text.setReadOnly(True)
+        self.stalls_text = QTextEdit()
+        self.stalls_text.setReadOnly(True)
 
+        self.tabs.addTab(self.statements_table, "Запросы")
+        self.tabs.addTab(self.methods_table, "Методы")
+        self.tabs.addTab(self.slow_text, "Медленные запросы")
+        self.tabs.addTab(self.stalls_text, "Зависания")
+        layout.addWidget(self.tabs)
+
+        button_layout = QHBoxLayout()
+        refresh_btn = QPushButton("Обновить")
+        refresh_btn.clicked.connect(self.load_metrics)
+        export_btn = QPushButton("Экспорт...")
+        export_btn.clicked.connect(self.export_metrics)
+        reset_btn = QPushButton("Сбросить")
+        reset_btn.clicked.connect(self.reset_metrics)
+        close_btn = QPushButton("Закрыть")
+        close_btn.clicked.connect(self.accept)
+        button_layout.addWidget(refresh_btn)
+        button_layout.addWidget(export_btn)
+        button_layout.addWidget(reset_btn)
+        button_layout.addStretch()
+        button_layout.addWidget(close_btn)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def create_table(self, title):
+        table = QTableWidget()
+        table.setColumnCount(5)
+        table.setHorizontalHeaderLabels([title, "Вызовов", "Всего, мс", "Среднее, мс", "Макс., мс"])
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        return table
+
+    def fill_table(self, table, rows, field):
+        table.setRowCount(len(rows))
+        for row, entry in enumerate(rows):
+            table.setItem(row, 0, QTableWidgetItem(entry[field]))
+            for column, key in enumerate(('calls', 'total_ms', 'avg_ms', 'max_ms'), 1):
+                table.setItem(row, column, QTableWidgetItem(str(entry[key])))
+
+    def load_metrics(self):
+        snapshot = self.metrics.snapshot()
+        self.fill_table(self.statements_table, snapshot['statements'], 'sql')
+        self.fill_table(self.methods_table, snapshot['methods'], 'method')
+
+        slow = []
+        for entry in reversed(snapshot['slow_queries']):
+            plan = "\n".join(f"    {line}" for line in entry['plan'] or [])
+            slow.append(f"{entry['time']}  {entry['ms']} мс  [{entry['thread']}]\n{entry['sql']}\n{plan}")
+        self.slow_text.setPlainText("\n\n".join(slow) or
+                                    f"Запросов дольше {snapshot['slow_query_ms']} мс не было")
+
+        stalls = []
+        for entry in reversed(snapshot['stalls']):
+            stack = "".join(entry['stack'] or [])
+            stalls.append(f"{entry['time']}  {entry['ms']} мс  {entry['call'] or ''}\n{stack}")
+        self.stalls_text.setPlainText("\n\n".join(stalls) or "Зависаний не было")
+
+    def export_metrics(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Экспорт диагностики", "diagnostics.json",
+                                              "JSON (*.json)")
+        if not path:
+            return
         try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT SUM(sh.amount_product) as total_quantity,
-                       SUM(sh.total_sale_amount) as total_amount
-                FROM sales_history sh
-                WHERE sh.id_partner = ?
-            ''', (partner_id,))
-            total_stats = cursor.fetchone()
-
-            cursor.execute('''
-                SELECT p.name_product, SUM(sh.amount_product) as quantity,
-                       SUM(sh.total_sale_amount) as amount
-                FROM sales_history sh
-                JOIN products p ON sh.id_product = p.id_product
-                WHERE sh.id_partner = ?
-                GROUP BY p.id_product, p.name_product
-                ORDER BY amount DESC
-            ''', (partner_id,))
-            product_stats = [dict(row) for row in cursor.fetchall()]
-
-            return {
-                'total_quantity': total_stats['total_quantity'] or 0,
-                'total_amount': total_stats['total_amount'] or 0,
-                'products': product_stats
-            }
-        except sqlite3.Error as e:
-            print(f"Ошибка при получении статистики: {e}")
-            return {}
-        finally:
-            conn.close()
+            self.metrics.export(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить файл: {e}")
+
+    def reset_metrics(self):
+        self.metrics.reset()
+        self.load_metrics()
 
 
 class LoginWindow(QDialog):
-    def __init__(self, db_manager, parent=None):
+    def __init__(self, db_manager, parent=None, credentials=None, executor=None):
+        """Пароль проверяется через executor, чтобы медленный KDF не блокировал окно"""
         super().__init__(parent)
         self.db_manager = db_manager
+        self.credentials = credentials or CredentialStore(db_manager)
+        self.executor = executor
+        self.login_task = None
         self.setup_ui()
 
     def setup_ui(self):
@@ -283,13 +444,18 @@ class LoginWindow(QDialog):
 
         layout.addLayout(form_layout)
 
+        self.status_label = QLabel()
+        self.status_label.setStyleSheet("color: gray;")
+        layout.addWidget(self.status_label)
+
         button_layout = QHBoxLayout()
-        login_btn = QPushButton("Войти")
-        login_btn.clicked.connect(self.authenticate)
+        self.login_btn = QPushButton("Войти")
+        self.login_btn.setDefault(True)
+        self.login_btn.clicked.connect(self.authenticate)
         cancel_btn = QPushButton("Отмена")
         cancel_btn.clicked.connect(self.reject)
 
-        button_layout.addWidget(login_btn)
+        button_layout.addWidget(self.login_btn)
         button_layout.addWidget(cancel_btn)
 
         layout.addLayout(button_layout)
@@ -303,31 +469,43 @@ class LoginWindow(QDialog):
             QMessageBox.warning(self, "Ошибка", "Введите логин и пароль")
             return
 
-        password_hash = hashlib.md5(password.encode()).hexdigest()
-
-        conn = self.db_manager.get_connection()
-        if not conn:
-            QMessageBox.critical(self, "Ошибка", "Ошибка подключения к базе данных")
+        if self.executor is None:
+            try:
+                manager = self.credentials.authenticate(login, password)
+            except (AuthenticationError, sqlite3.Error) as e:
+                self.login_failed(str(e))
+                return
+            self.login_succeeded(manager)
             return
 
-        try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id_manager, login, full_name, role 
-                FROM managers 
-                WHERE login = ? AND password_hash = ? AND is_active = 1
-            ''', (login, password_hash))
-            manager = cursor.fetchone()
-
-            if manager:
-                self.manager_data = dict(manager)
-                self.accept()
-            else:
-                QMessageBox.warning(self, "Ошибка", "Неверный логин или пароль")
-        except sqlite3.Error as e:
-            QMessageBox.critical(self, "Ошибка", f"Ошибка базы данных: {e}")
-        finally:
-            conn.close()
+        self.set_busy(True)
+        self.login_task = self.executor.submit(self.credentials.authenticate, login, password,
+                                               on_finished=self.login_succeeded,
+                                               on_failed=self.login_failed)
+
+    def set_busy(self, busy):
+        self.login_btn.setEnabled(not busy)
+        self.login_edit.setEnabled(not busy)
+        self.password_edit.setEnabled(not busy)
+        self.status_label.setText("Проверка пароля..." if busy else "")
+
+    def login_succeeded(self, manager):
+        self.login_task = None
+        self.manager_data = manager
+        self.accept()
+
+    def login_failed(self, message):
+        self.login_task = None
+        self.set_busy(False)
+        self.password_edit.clear()
+        self.password_edit.setFocus()
+        QMessageBox.warning(self, "Ошибка", message)
+
+    def done(self, result):
+        if self.login_task is not None:
+            self.login_task.cancel()
+            self.login_task = None
+        super().done(result)
 
 
 class PartnerAddDialog(QDialog):
@@ -354,7 +532,7 @@ class PartnerAddDialog(QDialog):
         self.rating_edit = QLineEdit()
         self.rating_edit.setText("5")
 
-        partner_types = self.db_manager.get_partner_types()
+        partner_types = self.db_manager.reference_cache.partner_types()
         for type_data in partner_types:
             self.type_combo.addItem(type_data['type_name'], type_data['id_type_partner'])
 
@@ -447,7 +625,7 @@ class PartnerEditDialog(QDialog):
         self.inn_edit = QLineEdit()
         self.rating_edit = QLineEdit()
 
-        partner_types = self.db_manager.get_partner_types()
+        partner_types = self.db_manager.reference_cache.partner_types()
         for type_data in partner_types:
             self.type_combo.addItem(type_data['type_name'], type_data['id_type_partner'])
 
@@ -485,11 +663,10 @@ class PartnerEditDialog(QDialog):
 
             partner_type_id = self.partner_data.get('id_type_partner')
 
-            if partner_type_id:
-                for i in range(self.type_combo.count()):
-                    if self.type_combo.itemData(i) == partner_type_id:
-                        self.type_combo.setCurrentIndex(i)
-                        break
+            # Комбобокс заполнен в порядке кэша справочника, номер строки совпадает
+            type_index = self.db_manager.reference_cache.partner_type_index(partner_type_id)
+            if type_index is not None:
+                self.type_combo.setCurrentIndex(type_index)
 
     def validate_and_accept(self):
         """Проверка заполнения обязательных полей"""
@@ -536,23 +713,36 @@ class PartnerEditDialog(QDialog):
 
 
 class PartnerDetailDialog(QDialog):
-    def __init__(self, partner_data, db_manager, parent=None):
+    LOGO_SIZE = 128
+
+    def __init__(self, partner_data, db_manager, parent=None, executor=None, logos=None):
         super().__init__(parent)
         self.partner_data = partner_data
         self.db_manager = db_manager
+        self.executor = executor
+        self.logos = logos
+        self.stats_task = None
+        self.analytics_task = None
         self.setup_ui()
         self.load_partner_details()
+        self.load_logo()
 
     def setup_ui(self):
         self.setWindowTitle(f"Детальная информация: {self.partner_data['name_partner']}")
         self.setModal(True)
-        self.resize(600, 500)
+        self.resize(700, 700)
 
         layout = QVBoxLayout()
 
         info_group = QWidget()
         info_layout = QFormLayout(info_group)
 
+        self.logo_label = QLabel()
+        self.logo_label.setFixedSize(self.LOGO_SIZE, self.LOGO_SIZE)
+        self.logo_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.logo_label.setVisible(bool(self.partner_data.get('logo')))
+        info_layout.addRow(self.logo_label)
+
         self.name_label = QLabel(self.partner_data['name_partner'])
         self.type_label = QLabel(self.partner_data['type_name'])
         self.director_label = QLabel(self.partner_data['director'])
@@ -575,11 +765,57 @@ class PartnerDetailDialog(QDialog):
         stats_layout = QVBoxLayout(stats_group)
         stats_layout.addWidget(QLabel("<b>Статистика продаж:</b>"))
 
+        self.stats_status_label = QLabel()
+        self.stats_status_label.setStyleSheet("color: gray;")
+        stats_layout.addWidget(self.stats_status_label)
+
+        range_layout = QHBoxLayout()
+        self.all_time_check = QCheckBox("За всё время")
+        self.all_time_check.setChecked(True)
+        today = QDate.currentDate()
+        self.date_from_edit = QDateEdit(today.addYears(-1))
+        self.date_to_edit = QDateEdit(today)
+        self.bucket_combo = QComboBox()
+        for bucket, title in (('day', "По дням"), ('week', "По неделям"),
+                              ('month', "По месяцам"), ('quarter', "По кварталам")):
+            self.bucket_combo.addItem(title, bucket)
+        self.bucket_combo.setCurrentIndex(2)
+
+        range_layout.addWidget(self.all_time_check)
+        for label, edit in (("с", self.date_from_edit), ("по", self.date_to_edit)):
+            edit.setCalendarPopup(True)
+            edit.setDisplayFormat("dd.MM.yyyy")
+            edit.setEnabled(False)
+            range_layout.addWidget(QLabel(label))
+            range_layout.addWidget(edit)
+        range_layout.addWidget(self.bucket_combo)
+        range_layout.addStretch()
+        stats_layout.addLayout(range_layout)
+
+        # Частые изменения дат схлопываются в один запрос
+        self.range_timer = QTimer(self)
+        self.range_timer.setSingleShot(True)
+        self.range_timer.setInterval(150)
+        self.range_timer.timeout.connect(self.load_partner_details)
+        self.all_time_check.toggled.connect(self.on_range_changed)
+        self.date_from_edit.dateChanged.connect(self.on_range_changed)
+        self.date_to_edit.dateChanged.connect(self.on_range_changed)
+        self.bucket_combo.currentIndexChanged.connect(self.on_range_changed)
+
         self.stats_table = QTableWidget()
         self.stats_table.setColumnCount(3)
         self.stats_table.setHorizontalHeaderLabels(["Продукция", "Количество", "Сумма"])
         stats_layout.addWidget(self.stats_table)
 
+        self.comparison_label = QLabel()
+        stats_layout.addWidget(self.comparison_label)
+
+        self.dynamics_table = QTableWidget()
+        self.dynamics_table.setColumnCount(4)
+        self.dynamics_table.setHorizontalHeaderLabels(["Период", "Количество", "Сумма", "Изменение"])
+        self.dynamics_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        stats_layout.addWidget(self.dynamics_table)
+
         layout.addWidget(info_group)
         layout.addWidget(stats_group)
 
@@ -591,8 +827,137 @@ class PartnerDetailDialog(QDialog):
         layout.addLayout(button_layout)
         self.setLayout(layout)
 
+    def selected_range(self):
+        """Выбранный период (date_from, date_to) в формате YYYY-MM-DD или (None, None)"""
+        if self.all_time_check.isChecked():
+            return None, None
+        date_from = self.date_from_edit.date()
+        date_to = self.date_to_edit.date()
+        if date_from > date_to:
+            date_from, date_to = date_to, date_from
+        return (date_from.toString(Qt.DateFormat.ISODate), date_to.toString(Qt.DateFormat.ISODate))
+
+    def on_range_changed(self, *args):
+        all_time = self.all_time_check.isChecked()
+        self.date_from_edit.setEnabled(not all_time)
+        self.date_to_edit.setEnabled(not all_time)
+        self.range_timer.start()
+
     def load_partner_details(self):
-        stats = self.db_manager.get_partner_sales_stats(self.partner_data['id_partner'])
+        partner_id = self.partner_data['id_partner']
+        date_from, date_to = self.selected_range()
+        bucket = self.bucket_combo.currentData()
+        # За всё время итоги берутся из сводных таблиц, разбивка - из индекса по дате
+        all_time = date_from is None
+
+        if self.executor is None:
+            analytics = self.db_manager.get_partner_sales_analytics(partner_id, date_from, date_to, bucket)
+            if all_time:
+                self.show_stats(self.db_manager.get_partner_sales_stats(partner_id))
+            self.show_analytics(analytics)
+            return
+
+        self.cancel_tasks()
+        self.stats_status_label.setText("Загрузка статистики...")
+        if all_time:
+            self.stats_task = self.executor.submit(self.db_manager.get_partner_sales_stats, partner_id,
+                                                   on_finished=self.show_stats,
+                                                   on_failed=self.show_stats_error)
+        self.analytics_task = self.executor.submit(self.db_manager.get_partner_sales_analytics,
+                                                   partner_id, date_from, date_to, bucket,
+                                                   on_finished=self.show_analytics,
+                                                   on_failed=self.show_stats_error)
+
+    def load_logo(self):
+        if self.logos is None or not self.partner_data.get('logo'):
+            return
+        key = (self.partner_data['logo'], self.LOGO_SIZE)
+        if key in self.logos.missing:
+            self.logo_label.setText("Нет логотипа")
+            return
+        pixmap = self.logos.pixmap(*key)
+        if pixmap is None:
+            self.logo_label.setText("...")
+            self.logos.loaded.connect(self.on_logo_loaded)
+            self.logos.failed.connect(self.on_logo_failed)
+        else:
+            self.logo_label.setPixmap(pixmap)
+
+    def on_logo_loaded(self, logo, size):
+        if logo == self.partner_data['logo'] and size == self.LOGO_SIZE:
+            pixmap = self.logos.pixmap(logo, size)
+            # Миниатюру могли уже вытеснить из кэша; тогда она загрузится снова
+            if pixmap is not None:
+                self.disconnect_logos()
+                self.logo_label.setPixmap(pixmap)
+
+    def on_logo_failed(self, logo, size):
+        if logo == self.partner_data['logo'] and size == self.LOGO_SIZE:
+            self.disconnect_logos()
+            self.logo_label.setText("Нет логотипа")
+
+    def disconnect_logos(self):
+        for signal, slot in ((self.logos.loaded, self.on_logo_loaded),
+                             (self.logos.failed, self.on_logo_failed)):
+            try:
+                signal.disconnect(slot)
+            except TypeError:
+                pass
+
+    def cancel_tasks(self):
+        for task in (self.stats_task, self.analytics_task):
+            if task is not None:
+                task.cancel()
+        self.stats_task = self.analytics_task = None
+
+    def show_stats_error(self, message):
+        self.cancel_tasks()
+        self.stats_status_label.setText(f"Ошибка при получении статистики: {message}")
+
+    def done(self, result):
+        self.range_timer.stop()
+        self.cancel_tasks()
+        if self.logos is not None:
+            self.disconnect_logos()
+        super().done(result)
+
+    def show_analytics(self, analytics):
+        self.analytics_task = None
+        if not self.all_time_check.isChecked():
+            self.show_stats(analytics)
+
+        buckets = analytics.get('buckets', []) if analytics else []
+        self.dynamics_table.setRowCount(len(buckets))
+        for row, item in enumerate(buckets):
+            change = ""
+            if item['delta_amount'] is not None:
+                change = f"{item['delta_amount']:+,.2f} руб."
+                if item['delta_percent'] is not None:
+                    change += f" ({item['delta_percent']:+.1f}%)"
+            self.dynamics_table.setItem(row, 0, QTableWidgetItem(item['period']))
+            self.dynamics_table.setItem(row, 1, QTableWidgetItem(str(item['quantity'])))
+            self.dynamics_table.setItem(row, 2, QTableWidgetItem(f"{item['amount']:,.2f} руб."))
+            self.dynamics_table.setItem(row, 3, QTableWidgetItem(change))
+
+        previous = analytics.get('previous') if analytics else None
+        if previous:
+            delta = analytics['total_amount'] - previous['total_amount']
+            text = (f"Предыдущий период ({previous['date_from']} - {previous['date_to']}): "
+                    f"{previous['total_amount']:,.2f} руб., изменение {delta:+,.2f} руб.")
+            if previous['total_amount']:
+                text += f" ({delta / previous['total_amount'] * 100:+.1f}%)"
+            self.comparison_label.setText(text)
+        else:
+            self.comparison_label.setText("")
+
+    def show_stats(self, stats):
+        self.stats_task = None
+        self.stats_status_label.setText("" if stats else "Нет данных о продажах")
+        if stats and stats.get('snapshot'):
+            # Отчёт построен по снимку базы, а не по текущим данным
+            snapshot = stats['snapshot']
+            self.stats_status_label.setText(f"Данные на {snapshot['taken_at'].replace('T', ' ')} "
+                                            f"({int(snapshot['age_seconds'])} с назад)")
 
         if stats:
             total_quantity = stats['total_quantity']
@@ -610,15 +975,371 @@ class PartnerDetailDialog(QDialog):
             self.stats_table.setItem(len(stats['products']), 2, QTableWidgetItem(f"{total_amount:,.2f} руб."))
 
             self.stats_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        else:
+            self.stats_table.setRowCount(0)
+
+
+class PartnersTableModel(QAbstractTableModel):
+    """Модель списка партнеров с подгрузкой строк по мере прокрутки"""
+
+    COLUMNS = [
+        ('id_partner', "ID"),
+        ('name_partner', "Наименование"),
+        ('type_name', "Тип"),
+        ('director', "Директор"),
+        ('email', "Email"),
+        ('phone_number', "Телефон"),
+        ('current_rating', "Рейтинг"),
+        ('discount', "Скидка"),
+        (None, "Действия"),
+    ]
+    ACTIONS_COLUMN = len(COLUMNS) - 1
+    LOGO_COLUMN = 1
+    LOGO_SIZE = 24
+
+    loading_changed = pyqtSignal(bool)
+
+    def __init__(self, db_manager, block_size=200, parent=None, executor=None):
+        super().__init__(parent)
+        self.db_manager = db_manager
+        self.block_size = block_size
+        self.executor = executor
+        self.pending = None
+        self.partners = []
+        self.positions = []
+        self.rows_by_id = {}
+        self.source = None
+        self.sort_key = 'name_partner'
+        self.descending = False
+        self.tracker = None
+        self.synced_version = 0
+        self.refresh_requested = False
+        self.search_text = ""
+        self.logos = None
+        # Загруженные логотипы перерисовываются одним dataChanged, а не по одному
+        self.logo_timer = QTimer(self)
+        self.logo_timer.setSingleShot(True)
+        self.logo_timer.setInterval(30)
+        self.logo_timer.timeout.connect(self.on_logos_loaded)
+
+    def set_logo_loader(self, logos):
+        self.logos = logos
+        logos.loaded.connect(lambda logo, size: self.logo_timer.start())
+
+    def on_logos_loaded(self):
+        if self.partners:
+            self.dataChanged.emit(self.index(0, self.LOGO_COLUMN),
+                                  self.index(len(self.partners) - 1, self.LOGO_COLUMN),
+                                  [Qt.ItemDataRole.DecorationRole])
+
+    def reload(self):
+        """Сброс модели и открытие нового курсора"""
+        self.beginResetModel()
+        self.cancel_pending()
+        if self.source is not None:
+            self.source.close()
+        if self.tracker is None:
+            self.tracker = self.db_manager.change_tracker()
+        self.tracker.changed()
+        self.synced_version = self.db_manager.get_partners_version()
+        self.partners = []
+        self.positions = []
+        self.rows_by_id = {}
+        if self.search_text:
+            self.source = self.db_manager.open_partners_search(self.search_text)
+        else:
+            self.source = self.db_manager.open_partners_cursor(self.sort_key, self.descending)
+        self.endResetModel()
+        self.fetchMore()
+
+    def set_search_text(self, text):
+        """Фильтр по поисковой строке; пустая строка возвращает полный список"""
+        text = text.strip() if partner_search_query(text) else ""
+        if text != self.search_text:
+            self.search_text = text
+            self.reload()
+
+    def refresh(self):
+        """Применение изменений с последней синхронизации без перечитывания списка"""
+        if self.source is None:
+            self.reload()
+            return
+        if self.pending is not None:
+            # Изменения применятся после прихода загружаемого блока
+            self.refresh_requested = True
+            return
+        if not self.tracker.changed():
+            return
+        if self.search_text:
+            # Результаты поиска упорядочены по релевантности, их проще перечитать
+            self.reload()
+            return
+
+        changes = self.db_manager.get_partners_changed_since(self.synced_version)
+        if changes is None:
+            return
+        self.synced_version = changes['version']
+
+        for partner_id in changes['deleted']:
+            self.remove_partner(partner_id)
+        for partner in changes['changed']:
+            self.remove_partner(partner['id_partner'])
+            self.insert_partner(partner)
+
+    def find_position(self, position):
+        """Индекс, на котором стоит (или должна стоять) строка с позицией сортировки"""
+        low, high = 0, len(self.positions)
+        while low < high:
+            middle = (low + high) // 2
+            current = self.positions[middle]
+            if (current > position) if self.descending else (current < position):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def remove_partner(self, partner_id):
+        partner = self.rows_by_id.pop(partner_id, None)
+        if partner is None:
+            return
+
+        row = self.find_position(partner_sort_position(self.sort_key, partner))
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.partners[row]
+        del self.positions[row]
+        self.endRemoveRows()
+
+    def insert_partner(self, partner):
+        position = partner_sort_position(self.sort_key, partner)
+        # Строки за границей загруженной части придут со следующими блоками
+        if not self.source.exhausted:
+            after = self.source.after
+            if after is None or ((position < after) if self.descending else (position > after)):
+                return
+
+        row = self.find_position(position)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.partners.insert(row, partner)
+        self.positions.insert(row, position)
+        self.rows_by_id[partner['id_partner']] = partner
+        self.endInsertRows()
+
+    def partner(self, row):
+        return self.partners[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.partners)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.DecorationRole:
+            # Представление запрашивает оформление только у видимых строк
+            if index.column() != self.LOGO_COLUMN or self.logos is None:
+                return None
+            return self.logos.pixmap(self.partners[index.row()]['logo'], self.LOGO_SIZE)
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+
+        field = self.COLUMNS[index.column()][0]
+        if field is None:
+            return None
+        value = self.partners[index.row()][field]
+        if field == 'discount':
+            return f"{value}%"
+        return "" if value is None else str(value)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return self.COLUMNS[section][1]
+        return str(section + 1)
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        """Сортировка выполняется в базе данных, модель перечитывается с начала.
+
+        Результаты поиска всегда упорядочены по релевантности.
+        """
+        if not self.is_sortable(column):
+            return
+
+        sort_key = self.COLUMNS[column][0]
+        descending = order == Qt.SortOrder.DescendingOrder
+        if (sort_key, descending) == (self.sort_key, self.descending):
+            # setSortingEnabled повторяет текущую сортировку: загруженную страницу не перечитываем
+            return
+
+        self.sort_key = sort_key
+        self.descending = descending
+        if self.source is not None:
+            self.reload()
+
+    def is_sortable(self, column):
+        return self.COLUMNS[column][0] in PARTNER_SORT_KEYS
+
+    def sort_column(self):
+        return [field for field, title in self.COLUMNS].index(self.sort_key)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.source is None or self.pending is not None:
+            return False
+        return not self.source.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+
+        if self.executor is None:
+            self.append_rows(self.source, self.source.fetch(self.block_size))
+            return
+
+        source = self.source
+        self.pending = self.executor.submit(source.fetch, self.block_size,
+                                            on_finished=lambda rows: self.append_rows(source, rows),
+                                            on_failed=lambda message: self.append_rows(source, []))
+        self.loading_changed.emit(True)
+
+    def append_rows(self, source, rows):
+        if source is not self.source:
+            return
+        if self.pending is not None:
+            self.pending = None
+            self.loading_changed.emit(False)
+
+        rows = [row for row in rows if row['id_partner'] not in self.rows_by_id]
+        if rows:
+            first = len(self.partners)
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+            self.partners.extend(rows)
+            self.positions.extend(partner_sort_position(self.sort_key, row) for row in rows)
+            self.rows_by_id.update((row['id_partner'], row) for row in rows)
+            self.endInsertRows()
+
+        if self.refresh_requested:
+            self.refresh_requested = False
+            self.refresh()
+
+    def cancel_pending(self):
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+            self.loading_changed.emit(False)
+
+    def close(self):
+        self.cancel_pending()
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+        if self.tracker is not None:
+            self.tracker.close()
+            self.tracker = None
+
+
+class PartnerActionsDelegate(QStyledItemDelegate):
+    """Рисует кнопки действий в ячейке без создания виджетов на строку"""
+
+    edit_requested = pyqtSignal(int)
+    details_requested = pyqtSignal(int)
+
+    BUTTONS = ["Редактировать", "Детали"]
+    MARGIN = 3
+    SPACING = 6
+    PADDING = 12
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pressed = None
+
+    def button_rects(self, option):
+        rect = option.rect
+        height = rect.height() - 2 * self.MARGIN
+        x = rect.left() + self.MARGIN
+        rects = []
+        for text in self.BUTTONS:
+            width = option.fontMetrics.horizontalAdvance(text) + 2 * self.PADDING
+            rects.append(QRect(x, rect.top() + self.MARGIN, width, height))
+            x += width + self.SPACING
+        return rects
+
+    def button_at(self, option, pos):
+        for number, rect in enumerate(self.button_rects(option)):
+            if rect.contains(pos):
+                return number
+        return None
+
+    def paint(self, painter, option, index):
+        super().paint(painter, option, index)
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+
+        for number, (text, rect) in enumerate(zip(self.BUTTONS, self.button_rects(option))):
+            button = QStyleOptionButton()
+            button.rect = rect
+            button.text = text
+            button.state = QStyle.StateFlag.State_Enabled
+            if self.pressed == (index.row(), number):
+                button.state |= QStyle.StateFlag.State_Sunken
+            else:
+                button.state |= QStyle.StateFlag.State_Raised
+            style.drawControl(QStyle.ControlElement.CE_PushButton, button, painter, widget)
+
+    def preferred_width(self, font_metrics):
+        width = sum(font_metrics.horizontalAdvance(text) + 2 * self.PADDING
+                    for text in self.BUTTONS)
+        return width + 2 * self.MARGIN + self.SPACING * (len(self.BUTTONS) - 1)
+
+    def sizeHint(self, option, index):
+        return QSize(self.preferred_width(option.fontMetrics),
+                     option.fontMetrics.height() + 2 * self.PADDING)
+
+    def trigger(self, row, number):
+        if number == 0:
+            self.edit_requested.emit(row)
+        else:
+            self.details_requested.emit(row)
+
+    def editorEvent(self, event, model, option, index):
+        event_type = event.type()
+
+        if event_type in (QEvent.Type.MouseButtonPress, QEvent.Type.MouseButtonDblClick):
+            number = self.button_at(option, event.position().toPoint())
+            self.pressed = None if number is None else (index.row(), number)
+            return number is not None
+
+        if event_type == QEvent.Type.MouseButtonRelease:
+            pressed, self.pressed = self.pressed, None
+            number = self.button_at(option, event.position().toPoint())
+            if pressed is not None and pressed == (index.row(), number):
+                self.trigger(index.row(), number)
+                return True
+            return pressed is not None
+
+        if event_type == QEvent.Type.KeyPress:
+            # Пробел - редактирование, Enter обрабатывается через activated
+            if event.key() == Qt.Key.Key_Space:
+                self.trigger(index.row(), 0)
+                return True
+
+        return super().editorEvent(event, model, option, index)
 
 
 class PartnersViewWindow(QMainWindow):
-    def __init__(self, manager_data):
+    def __init__(self, manager_data, db_manager=None, executor=None, partners_model=None):
+        """partners_model может быть создан заранее, чтобы список начал загружаться до входа"""
         super().__init__()
         self.manager_data = manager_data
-        self.db_manager = DatabaseManager()
+        self.db_manager = db_manager or DatabaseManager()
+        self.db_executor = executor or DatabaseExecutor(self.db_manager)
+        self.partners_model = partners_model
+        # Справочники загружаются заранее, чтобы диалоги открывались без запросов
+        self.db_manager.reference_cache.partner_types()
         self.setup_ui()
-        self.load_partners()
+        if self.partners_model.source is None:
+            self.load_partners()
 
     def setup_ui(self):
         self.setWindowTitle(f"Система управления партнерами - Производственная компания 'Мастер пол'")
@@ -646,57 +1367,96 @@ class PartnersViewWindow(QMainWindow):
         button_layout = QHBoxLayout()
 
         self.refresh_btn = QPushButton("Обновить")
-        self.refresh_btn.clicked.connect(self.load_partners)
+        self.refresh_btn.clicked.connect(self.refresh_partners)
 
         self.add_btn = QPushButton("Добавить партнера")
         self.add_btn.clicked.connect(self.add_partner)
 
+        self.status_label = QLabel()
+        self.status_label.setStyleSheet("color: gray;")
+
         button_layout.addWidget(self.refresh_btn)
         button_layout.addWidget(self.add_btn)
         button_layout.addStretch()
+        button_layout.addWidget(self.status_label)
 
         layout.addLayout(button_layout)
 
-        self.partners_table = QTableWidget()
-        self.partners_table.setColumnCount(8)
-        self.partners_table.setHorizontalHeaderLabels([
-            "ID", "Наименование", "Тип", "Директор", "Email",
-            "Телефон", "Рейтинг", "Действия"
-        ])
-
-        self.partners_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-        self.partners_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Поиск по наименованию, директору, email, телефону или ИНН")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+        self.search_timer.timeout.connect(
+            lambda: self.partners_model.set_search_text(self.search_edit.text()))
+        self.search_edit.textChanged.connect(lambda text: self.search_timer.start())
+        layout.addWidget(self.search_edit)
+
+        if self.partners_model is None:
+            self.partners_model = PartnersTableModel(self.db_manager, parent=self,
+                                                     executor=self.db_executor)
+        self.partners_model.loading_changed.connect(
+            lambda loading: self.status_label.setText("Загрузка..." if loading else ""))
+        # Относительные пути логотипов считаются от каталога файла базы
+        database = getattr(self.db_manager, 'database', None)
+        self.logos = LogoLoader(os.path.dirname(os.path.abspath(database)) if database else os.getcwd(),
+                                parent=self)
+        self.partners_model.set_logo_loader(self.logos)
+
+        self.actions_delegate = PartnerActionsDelegate(self)
+        self.actions_delegate.edit_requested.connect(
+            lambda row: self.edit_partner(self.partners_model.partner(row)))
+        self.actions_delegate.details_requested.connect(
+            lambda row: self.show_partner_details(self.partners_model.partner(row)))
+
+        self.partners_table = QTableView()
+        self.partners_table.setModel(self.partners_model)
+        self.partners_table.setItemDelegateForColumn(PartnersTableModel.ACTIONS_COLUMN,
+                                                     self.actions_delegate)
+        self.partners_table.activated.connect(self.on_partner_activated)
+        header = self.partners_table.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        header.setSectionResizeMode(PartnersTableModel.ACTIONS_COLUMN, QHeaderView.ResizeMode.Fixed)
+        header.resizeSection(PartnersTableModel.ACTIONS_COLUMN,
+                             self.actions_delegate.preferred_width(self.partners_table.fontMetrics()))
+        header.setSortIndicator(self.partners_model.sort_column(),
+                                Qt.SortOrder.DescendingOrder if self.partners_model.descending
+                                else Qt.SortOrder.AscendingOrder)
+        header.sortIndicatorChanged.connect(self.on_sort_indicator_changed)
+        self.partners_table.setSortingEnabled(True)
+        self.partners_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.partners_table.setIconSize(QSize(PartnersTableModel.LOGO_SIZE, PartnersTableModel.LOGO_SIZE))
 
         layout.addWidget(self.partners_table)
 
-    def load_partners(self):
-        partners = self.db_manager.get_all_partners()
-        self.partners_table.setRowCount(len(partners))
+        if self.db_manager.metrics is not None:
+            diagnostics_shortcut = QShortcut(QKeySequence("Ctrl+Shift+D"), self)
+            diagnostics_shortcut.activated.connect(self.show_diagnostics)
 
-        for row, partner in enumerate(partners):
-            self.partners_table.setItem(row, 0, QTableWidgetItem(str(partner['id_partner'])))
-            self.partners_table.setItem(row, 1, QTableWidgetItem(partner['name_partner']))
-            self.partners_table.setItem(row, 2, QTableWidgetItem(partner['type_name']))
-            self.partners_table.setItem(row, 3, QTableWidgetItem(partner['director']))
-            self.partners_table.setItem(row, 4, QTableWidgetItem(partner['email']))
-            self.partners_table.setItem(row, 5, QTableWidgetItem(partner['phone_number']))
-            self.partners_table.setItem(row, 6, QTableWidgetItem(str(partner['current_rating'])))
+    def on_sort_indicator_changed(self, column, order):
+        # Столбцы скидки и действий не сортируются: возвращаем индикатор на текущий ключ
+        if not self.partners_model.is_sortable(column):
+            header = self.partners_table.horizontalHeader()
+            current_order = (Qt.SortOrder.DescendingOrder if self.partners_model.descending
+                             else Qt.SortOrder.AscendingOrder)
+            header.blockSignals(True)
+            header.setSortIndicator(self.partners_model.sort_column(), current_order)
+            header.blockSignals(False)
 
-            actions_widget = QWidget()
-            actions_layout = QHBoxLayout(actions_widget)
-            actions_layout.setContentsMargins(5, 5, 5, 5)
-
-            edit_btn = QPushButton("Редактировать")
-            edit_btn.clicked.connect(lambda checked, p=partner: self.edit_partner(p))
-
-            details_btn = QPushButton("Детали")
-            details_btn.clicked.connect(lambda checked, p=partner: self.show_partner_details(p))
+    def load_partners(self):
+        self.partners_model.reload()
 
-            actions_layout.addWidget(edit_btn)
-            actions_layout.addWidget(details_btn)
-            actions_layout.addStretch()
+    def refresh_partners(self):
+        # Переименованный тип партнера меняет строки, не трогая их версий
+        if self.db_manager.reference_cache.validate():
+            self.partners_model.reload()
+        else:
+            self.partners_model.refresh()
 
-            self.partners_table.setCellWidget(row, 7, actions_widget)
+    def on_partner_activated(self, index):
+        if index.column() == PartnersTableModel.ACTIONS_COLUMN:
+            self.show_partner_details(self.partners_model.partner(index.row()))
 
     def add_partner(self):
         dialog = PartnerAddDialog(self.db_manager, self)
@@ -715,7 +1475,7 @@ class PartnersViewWindow(QMainWindow):
 
             if success:
                 QMessageBox.information(self, "Успех", "Партнер успешно добавлен!")
-                self.load_partners()
+                self.refresh_partners()
             else:
                 QMessageBox.critical(self, "Ошибка", "Не удалось добавить партнера")
 
@@ -738,37 +1498,164 @@ class PartnersViewWindow(QMainWindow):
 
             if success:
                 QMessageBox.information(self, "Успех", "Данные партнера успешно обновлены!")
-                self.load_partners()
+                self.refresh_partners()
             else:
                 QMessageBox.critical(self, "Ошибка", "Не удалось обновить данные партнера")
 
     def show_partner_details(self, partner_data):
-        dialog = PartnerDetailDialog(partner_data, self.db_manager, self)
+        dialog = PartnerDetailDialog(partner_data, self.db_manager, self, executor=self.db_executor,
+                                     logos=self.logos)
         dialog.exec()
 
+    def show_diagnostics(self):
+        dialog = DiagnosticsDialog(self.db_manager.metrics, self)
+        dialog.exec()
+
+
+def command_line_option(name, default=None, convert=str):
+    """Значение параметра командной строки вида --name VALUE"""
+    if name in sys.argv[:-1]:
+        return convert(sys.argv[sys.argv.index(name) + 1])
+    return default
+
+
+class StartupTimer(QObject):
+    """Отметки времени запуска (--startup-timing) от начала импорта main.py"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.marks = {'qt_imported': round((STARTUP_QT_IMPORTED - STARTUP_STARTED) * 1000, 1)}
+        self.paint_marks = {}
+
+    def mark(self, name):
+        self.marks.setdefault(name, round((time.perf_counter() - STARTUP_STARTED) * 1000, 1))
+
+    def mark_on_paint(self, widget, name, ready=None):
+        """Отметка при первой отрисовке widget (после того, как ready() вернёт True)"""
+        self.paint_marks[widget] = (name, ready)
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Type.Paint and watched in self.paint_marks:
+            name, ready = self.paint_marks[watched]
+            if ready is None or ready():
+                self.mark(name)
+                del self.paint_marks[watched]
+                watched.removeEventFilter(self)
+        return False
+
+    def report(self):
+        marks = dict(self.marks)
+        if 'login_accepted' in marks and 'table_painted' in marks:
+            marks['table_painted_after_login'] = round(marks['table_painted'] - marks['login_accepted'], 1)
+        print(json.dumps(marks), file=sys.stderr)
+
 
 class MainApplication:
     def __init__(self):
         self.app = QApplication(sys.argv)
-        self.db_manager = DatabaseManager()
+        self.startup = StartupTimer() if '--startup-timing' in sys.argv else None
+        self.metrics = QueryMetrics(slow_query_ms=command_line_option('--slow-query-ms', 100, float))
+        self.metrics_file = command_line_option('--metrics-file')
+        self.stall_detector = StallDetector(self.metrics, command_line_option('--stall-ms', 200, float))
+        server = command_line_option('--server')
+        if server:
+            # База открыта сервером remote.py, приложение обращается к нему
+            from remote import RemoteCredentialStore, RemoteDatabaseManager
+            self.db_manager = RemoteDatabaseManager(server, metrics=self.metrics)
+            self.credentials = RemoteCredentialStore(self.db_manager)
+        else:
+            # Единственный DatabaseManager приложения: схема проверяется один раз
+            snapshot_max_age = command_line_option('--snapshot-max-age', None, float)
+            self.db_manager = DatabaseManager(seed_demo='--seed-demo' in sys.argv, metrics=self.metrics,
+                                              snapshot=snapshot_max_age is not None,
+                                              snapshot_max_age=snapshot_max_age)
+            self.credentials = CredentialStore(self.db_manager)
+        # Сервер отдаёт данные только после входа менеджера
+        self.prefetch_before_login = not server
+        self.db_executor = None
+        self.partners_model = None
+        self.main_window = None
         self.current_manager = None
+        self.mark('database_ready')
+
+    def mark(self, name):
+        if self.startup is not None:
+            self.startup.mark(name)
 
     def run(self):
-        if not self.db_manager.get_connection():
+        if not self.db_manager.ready:
             QMessageBox.critical(None, "Ошибка", "Не удалось подключиться к базе данных.")
-            return
-
-        login_window = LoginWindow(self.db_manager)
+            self.shutdown()
+            sys.exit(1)
+
+        self.stall_detector.start()
+        self.db_executor = DatabaseExecutor(self.db_manager)
+        login_window = LoginWindow(self.db_manager, credentials=self.credentials,
+                                   executor=self.db_executor)
+        if self.startup is not None:
+            self.startup.mark_on_paint(login_window, 'login_window_painted')
+        # Пока открыто окно входа, в фоне калибруется KDF паролей,
+        # читаются справочники и первая страница списка
+        if self.prefetch_before_login:
+            QTimer.singleShot(0, self.prefetch)
+
+        exit_code = 0
         if login_window.exec() == QDialog.DialogCode.Accepted:
+            self.mark('login_accepted')
             self.current_manager = login_window.manager_data
-            main_window = PartnersViewWindow(self.current_manager)
-            main_window.show()
-            sys.exit(self.app.exec())
-        else:
-            sys.exit(0)
+            self.prefetch()
+            self.main_window = PartnersViewWindow(self.current_manager, self.db_manager,
+                                                  self.db_executor, self.partners_model)
+            if self.startup is not None:
+                model = self.partners_model
+                self.startup.mark_on_paint(self.main_window.partners_table.viewport(), 'table_painted',
+                                           lambda: model.rowCount() > 0)
+                self.startup.mark_on_paint(self.main_window, 'main_window_painted')
+            self.main_window.show()
+            exit_code = self.app.exec()
+
+        self.shutdown()
+        sys.exit(exit_code)
+
+    def prefetch(self):
+        if self.partners_model is not None:
+            return
+        self.db_executor.submit(self.credentials.params)
+        self.db_executor.submit(self.db_manager.reference_cache.partner_types)
+        self.partners_model = PartnersTableModel(self.db_manager, executor=self.db_executor)
+        self.partners_model.reload()
+
+    def shutdown(self):
+        if self.partners_model is not None:
+            self.partners_model.close()
+        if self.main_window is not None:
+            self.main_window.logos.close()
+        if self.db_executor is not None:
+            self.db_executor.shutdown()
+        self.stall_detector.stop()
+        self.db_manager.close()
+        if self.metrics_file:
+            try:
+                self.metrics.export(self.metrics_file)
+            except OSError as e:
+                print(f"Ошибка при сохранении диагностики: {e}")
+        if self.startup is not None:
+            self.startup.report()
 
 
 def main():
+    if '--verify-summaries' in sys.argv or '--rebuild-summaries' in sys.argv:
+        db_manager = DatabaseManager()
+        drift = db_manager.rebuild_sales_summaries(verify_only='--verify-summaries' in sys.argv)
+        db_manager.close()
+        if drift is None:
+            sys.exit(1)
+        for row in drift:
+            print(row)
+        print(f"Расхождений в сводных таблицах: {len(drift)}")
+        sys.exit(1 if drift and '--verify-summaries' in sys.argv else 0)
+
     application = MainApplication()
     application.run()
 
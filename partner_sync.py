@@ -0,0 +1,43 @@
+"""Синхронизация справочника партнеров из CSV или JSON Lines по ИНН.
+
+Поля записей совпадают со столбцами таблицы partners, тип партнера
+задаётся названием в поле type_name.
+
+    python partner_sync.py partners.csv
+"""
+import argparse
+import sys
+
+from database import DatabaseManager
+from sales_import import detect_format, read_records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синхронизация партнеров по ИНН")
+    parser.add_argument('path', help="входной файл (.csv или .jsonl)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], dest='file_format')
+    parser.add_argument('--database', default="partners_management.db")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(args.database)
+    try:
+        records = read_records(args.path, args.file_format or detect_format(args.path))
+        counts = db_manager.sync_partners(records, args.chunk_size)
+    except OSError as e:
+        print(f"Ошибка чтения файла: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        db_manager.close()
+
+    if counts is None:
+        sys.exit(1)
+
+    for number, record, reason in counts['rejected']:
+        print(f"Запись {number} отклонена: {reason}", file=sys.stderr)
+    print(f"Добавлено: {counts['inserted']}, обновлено: {counts['updated']}, "
+          f"без изменений: {counts['unchanged']}, отклонено: {len(counts['rejected'])}")
+
+
+if __name__ == "__main__":
+    main()
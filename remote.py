@@ -0,0 +1,427 @@
+"""Сервер базы партнеров для нескольких рабочих мест и клиент к нему.
+
+Сервер - единственный процесс, который открывает partners_management.db.
+Рабочие места подключаются к нему вместо файла базы, поэтому блокировки
+SQLite не делятся между процессами и "database is locked" не возникает:
+
+    python remote.py --database partners_management.db --listen 127.0.0.1:8765
+    python main.py --server 127.0.0.1:8765
+
+Адрес вида unix:/путь/к/сокету слушает локальный сокет вместо TCP.
+
+Протокол - JSON по строке на сообщение. Запрос {"id", "method", "args",
+"kwargs"}, ответ {"id", "result"} или {"id", "error": {"type", "message"}}.
+Массив запросов в одной строке выполняется как пакет, ответ - массив в том
+же порядке. Чтение выполняется в пуле потоков со своими соединениями.
+Записи партнеров выполняет очередь записи DatabaseManager, объединяя
+одновременные запросы клиентов в общие транзакции; вход менеджеров
+проверяется в отдельном потоке.
+
+До входа менеджера соединению доступны только ping и authenticate. Успешный
+вход привязывает сеанс к соединению и возвращает его ключ в поле session;
+другие соединения того же клиента присоединяются к сеансу вызовом resume.
+Трафик не шифруется, поэтому сервер стоит слушать только в доверенной сети.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import secrets
+import socket
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from credentials import AuthenticationError, CredentialStore
+from database import (DatabaseManager, PartnerCursor, PartnerSearchCursor, Record, ReferenceCache,
+                      timed_methods)
+
+
+DEFAULT_ADDRESS = '127.0.0.1:8765'
+
+# Методы DatabaseManager, доступные клиентам
+READ_METHODS = (
+    'get_all_partners', 'get_partners_page', 'get_partners_version', 'get_partners_changed_since',
+    'search_partners', 'get_partner_types', 'get_products', 'get_reference_versions',
+    'get_partner_discounts', 'get_partner_sales_stats', 'get_partner_sales_analytics',
+)
+WRITE_METHODS = ('add_partner', 'update_partner', 'authenticate')
+
+# Методы, доступные соединению без сеанса менеджера
+PUBLIC_METHODS = ('ping', 'authenticate', 'resume')
+
+# Записи ждут фиксации в очереди записи DatabaseManager, не занимая поток
+WRITE_QUEUE = object()
+
+# Ошибки сервера, которые клиент поднимает с тем же типом
+REMOTE_ERRORS = {
+    'AuthenticationError': AuthenticationError,
+    'ValueError': ValueError,
+    'IntegrityError': sqlite3.IntegrityError,
+    'OperationalError': sqlite3.OperationalError,
+}
+
+
+def parse_address(address):
+    """(семейство сокета, адрес) из строки host:port или unix:/путь"""
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+def _json_default(value):
+    if isinstance(value, (sqlite3.Row, Record)):
+        return dict(value)
+    raise TypeError(f"Значение типа {type(value).__name__} не сериализуется в JSON")
+
+
+encode_message = json.JSONEncoder(ensure_ascii=False, default=_json_default).encode
+
+
+class DatabaseServer:
+    """asyncio-сервер, выполняющий методы DatabaseManager по запросам клиентов"""
+
+    def __init__(self, db_manager, readers=4):
+        self.db_manager = db_manager
+        self.credentials = CredentialStore(db_manager)
+        self.readers = ThreadPoolExecutor(readers, thread_name_prefix='db-reader')
+        # Проверка пароля медленная и пишет в login_attempts, поэтому не занимает потоки чтения
+        self.logins = ThreadPoolExecutor(1, thread_name_prefix='db-login')
+        # Ключ сеанса -> данные менеджера, вошедшего в него
+        self.sessions = {}
+
+    def login(self, session, login, password):
+        """Вход менеджера; соединение session переходит в новый сеанс"""
+        manager = self.credentials.authenticate(login, password)
+        token = secrets.token_urlsafe(32)
+        self.sessions[token] = manager
+        session['manager'] = manager
+        return dict(manager, session=token)
+
+    def resume(self, session, token):
+        """Привязка соединения к сеансу, открытому входом в другом соединении"""
+        manager = self.sessions.get(token)
+        if manager is None:
+            raise PermissionError("Сеанс не найден, войдите заново")
+        session['manager'] = manager
+        return True
+
+    def target(self, method, session):
+        """(функция, пул потоков) для метода протокола или None"""
+        if method == 'ping':
+            return (lambda: True), None
+        if method == 'authenticate':
+            return functools.partial(self.login, session), self.logins
+        if method == 'resume':
+            return functools.partial(self.resume, session), None
+        if method in READ_METHODS:
+            return getattr(self.db_manager, method), self.readers
+        if method in WRITE_METHODS:
+            return getattr(self.db_manager, f'submit_{method}'), WRITE_QUEUE
+        return None
+
+    async def call(self, request, session):
+        """Ответ на один запрос соединения с сеансом session"""
+        if not isinstance(request, dict):
+            return {'id': None, 'error': {'type': 'ValueError', 'message': "Запрос должен быть объектом"}}
+
+        request_id = request.get('id')
+        method = request.get('method')
+        target = self.target(method, session)
+        if target is None:
+            return {'id': request_id, 'error': {'type': 'ValueError',
+                                                'message': f"Неизвестный метод: {method}"}}
+        if method not in PUBLIC_METHODS and session.get('manager') is None:
+            return {'id': request_id, 'error': {'type': 'PermissionError',
+                                                'message': "Требуется вход менеджера"}}
+
+        function, executor = target
+        try:
+            call = functools.partial(function, *request.get('args', ()), **request.get('kwargs', {}))
+            if executor is WRITE_QUEUE:
+                result = await self.write(call())
+            elif executor is not None:
+                result = await asyncio.get_running_loop().run_in_executor(executor, call)
+            else:
+                result = call()
+        except Exception as e:
+            return {'id': request_id, 'error': {'type': type(e).__name__, 'message': str(e)}}
+        return {'id': request_id, 'result': result}
+
+    async def write(self, future):
+        """Ожидание записи из очереди DatabaseManager; True/False, как у add_partner"""
+        try:
+            await asyncio.wrap_future(future)
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка записи: {e}", file=sys.stderr)
+            return False
+
+    async def respond(self, line, stream, write_lock, session):
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            response = {'id': None, 'error': {'type': 'ValueError', 'message': f"Неверный JSON: {e}"}}
+        else:
+            if isinstance(message, list):
+                # Пакет: чтения выполняются параллельно, записи попадают в одну транзакцию
+                response = list(await asyncio.gather(*(self.call(request, session)
+                                                       for request in message)))
+            else:
+                response = await self.call(message, session)
+
+        try:
+            data = encode_message(response)
+        except TypeError as e:
+            data = encode_message({'id': response.get('id') if isinstance(response, dict) else None,
+                                   'error': {'type': 'TypeError', 'message': str(e)}})
+        async with write_lock:
+            stream.write(data.encode() + b'\n')
+            await stream.drain()
+
+    async def handle_client(self, reader, stream):
+        # Запросы одного клиента выполняются конвейером, ответы несут id запроса
+        write_lock = asyncio.Lock()
+        session = {}
+        pending = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self.respond(line, stream, write_lock, session))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+            print(f"Ошибка соединения с клиентом: {e}", file=sys.stderr)
+        finally:
+            stream.close()
+
+    async def serve(self, address):
+        family, target = parse_address(address)
+        limit = 16 * 2 ** 20
+        if family == socket.AF_UNIX:
+            server = await asyncio.start_unix_server(self.handle_client, target, limit=limit)
+        else:
+            server = await asyncio.start_server(self.handle_client, *target, limit=limit)
+        print(f"Сервер базы данных слушает {address}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.readers.shutdown()
+        self.logins.shutdown()
+        self.db_manager.close()
+
+
+class RemoteError(sqlite3.DatabaseError):
+    """Ошибка сервера, не имеющая соответствия у клиента"""
+
+
+class RemoteChangeTracker:
+    """Проверка изменений списка партнеров по версии на сервере"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.version = db_manager.get_partners_version()
+
+    def changed(self):
+        """Были ли изменены партнеры с прошлой проверки"""
+        version = self.db_manager.get_partners_version()
+        changed, self.version = version != self.version, version
+        return changed
+
+    def close(self):
+        pass
+
+
+class RemoteDatabaseManager:
+    """DatabaseManager, выполняющий операции на сервере remote.py.
+
+    У каждого потока своё соединение с сервером; запрос и ответ идут по
+    нему последовательно. После authenticate() каждое соединение перед
+    первым запросом присоединяется к сеансу менеджера.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, metrics=None, timeout=30.0):
+        self.address = address
+        self.metrics = metrics
+        self.timeout = timeout
+        self._local = threading.local()
+        self._streams = []
+        self._lock = threading.Lock()
+        self.session = None
+        self.reference_cache = ReferenceCache(self)
+        try:
+            self.ready = self.call('ping')
+        except sqlite3.Error as e:
+            print(f"Ошибка подключения к серверу базы данных: {e}")
+            self.ready = False
+
+    def _stream(self):
+        stream = getattr(self._local, 'stream', None)
+        if stream is None:
+            family, target = parse_address(self.address)
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(target)
+            except OSError:
+                sock.close()
+                raise
+            if family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            stream = self._local.stream = sock.makefile('rwb')
+            self._local.session = None
+            with self._lock:
+                self._streams.append(stream)
+        if self.session is not None and self._local.session != self.session:
+            # Соединение открыто до входа или после обрыва
+            self._result(self._send(stream, {'id': 0, 'method': 'resume', 'args': [self.session]}))
+            self._local.session = self.session
+        return stream
+
+    def _drop_stream(self):
+        stream = getattr(self._local, 'stream', None)
+        self._local.stream = None
+        if stream is not None:
+            with self._lock:
+                if stream in self._streams:
+                    self._streams.remove(stream)
+            stream.close()
+
+    @staticmethod
+    def _send(stream, message):
+        """Отправка сообщения и чтение ответа на него"""
+        stream.write(encode_message(message).encode() + b'\n')
+        stream.flush()
+        line = stream.readline()
+        if not line:
+            raise ConnectionError("сервер закрыл соединение")
+        return json.loads(line)
+
+    def _exchange(self, message, retry):
+        """Отправка сообщения и чтение ответа; retry - можно ли повторить после обрыва"""
+        for attempt in (1, 2):
+            try:
+                return self._send(self._stream(), message)
+            except OSError as e:
+                self._drop_stream()
+                if attempt == 2 or not retry:
+                    raise sqlite3.OperationalError(f"Сервер базы данных {self.address} недоступен: {e}")
+
+    @staticmethod
+    def _result(response):
+        error = response.get('error')
+        if error is None:
+            return response.get('result')
+        raise REMOTE_ERRORS.get(error.get('type'), RemoteError)(error.get('message'))
+
+    def call(self, method, *args, **kwargs):
+        """Вызов метода на сервере"""
+        request = {'id': 0, 'method': method, 'args': args, 'kwargs': kwargs}
+        return self._result(self._exchange(request, method not in WRITE_METHODS))
+
+    def authenticate(self, login, password):
+        """Вход менеджера; дальше все соединения клиента работают в его сеансе"""
+        manager = self.call('authenticate', login, password)
+        self.session = self._local.session = manager.pop('session')
+        return manager
+
+    def get_partner_discounts(self, partner_ids=None):
+        # Ключи объектов JSON - строки
+        return {int(key): value
+                for key, value in self.call('get_partner_discounts', partner_ids).items()}
+
+    def open_partners_search(self, text):
+        """Курсор по результатам поиска партнеров"""
+        return PartnerSearchCursor(self, text)
+
+    def change_tracker(self):
+        return RemoteChangeTracker(self)
+
+    def open_partners_cursor(self, sort_key='name_partner', descending=False):
+        """Курсор по списку партнеров для чтения блоками"""
+        return PartnerCursor(self, sort_key, descending)
+
+    def get_connection(self):
+        # Файл базы открывает только сервер
+        return None
+
+    def interrupt(self, thread_id):
+        # Запрос уже выполняется на сервере; его ответ будет отброшен
+        pass
+
+    def close(self):
+        with self._lock:
+            streams, self._streams = self._streams, []
+        for stream in streams:
+            stream.close()
+
+
+def _remote_method(name):
+    def method(self, *args, **kwargs):
+        return self.call(name, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+for _name in READ_METHODS + ('add_partner', 'update_partner'):
+    if not hasattr(RemoteDatabaseManager, _name):
+        setattr(RemoteDatabaseManager, _name, _remote_method(_name))
+RemoteDatabaseManager = timed_methods(RemoteDatabaseManager)
+
+
+class RemoteCredentialStore:
+    """Вход менеджеров через сервер: пароли проверяет и хранит сервер"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+
+    def params(self):
+        # Калибровка KDF выполняется на сервере
+        return None
+
+    def authenticate(self, login, password):
+        """Данные менеджера при успешном входе, иначе AuthenticationError"""
+        try:
+            return self.db_manager.authenticate(login, password)
+        except sqlite3.Error as e:
+            raise AuthenticationError(f"Ошибка подключения к серверу базы данных: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервер базы партнеров для нескольких рабочих мест")
+    parser.add_argument('--database', default="partners_management.db")
+    parser.add_argument('--listen', default=DEFAULT_ADDRESS, help="host:port или unix:/путь")
+    parser.add_argument('--readers', type=int, default=4, help="потоков чтения")
+    parser.add_argument('--seed-demo', action='store_true', help="добавить демонстрационные данные")
+    parser.add_argument('--snapshot-max-age', type=float,
+                        help="строить отчёты по снимку базы не старше указанного числа секунд")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(args.database, seed_demo=args.seed_demo,
+                                 snapshot=args.snapshot_max_age is not None,
+                                 snapshot_max_age=args.snapshot_max_age)
+    if not db_manager.ready:
+        print("Не удалось подключиться к базе данных", file=sys.stderr)
+        sys.exit(1)
+
+    server = DatabaseServer(db_manager, args.readers)
+    try:
+        asyncio.run(server.serve(args.listen))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Ошибка запуска сервера: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""Колоночный движок аналитики продаж в памяти (NumPy).
+
+sales_history один раз загружается в массивы столбцов: id как int32,
+дата как номер дня от 1970-01-01, количество int32, сумма float64. Дальше
+refresh() дочитывает только строки с новыми id_sale, а суммы по группам,
+топ-N и сводные таблицы считаются векторно через np.bincount без запросов
+к базе.
+
+    python sales_engine.py --database bench.db --verify
+    python sales_engine.py --database bench.db --top partner --limit 10
+    python sales_engine.py --database bench.db --pivot partner month --date-from 2023-01-01
+
+NumPy - необязательная зависимость: без неё модуль импортируется, но
+SalesEngine создать нельзя (NUMPY_AVAILABLE = False).
+"""
+import argparse
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from database import (DatabaseManager, PARTNER_SUMMARY_SELECT, PRODUCT_SUMMARY_SELECT,
+                      SALES_BUCKETS)
+
+
+NUMPY_AVAILABLE = np is not None
+
+# Дата, которую не удалось разобрать (или NULL)
+MISSING_DAY = -2 ** 31
+
+LOAD_QUERY = f'''
+    SELECT id_sale, COALESCE(id_partner, 0), COALESCE(id_product, 0),
+           COALESCE(amount_product, 0), COALESCE(total_sale_amount, 0),
+           COALESCE(CAST(julianday(sale_date) - 2440587.5 AS INTEGER), {MISSING_DAY})
+    FROM sales_history
+    WHERE id_sale > ?
+    ORDER BY id_sale
+'''
+
+SALES_VERSION_QUERY = "SELECT value FROM sales_version"
+
+DIMENSIONS = ('partner', 'product') + tuple(SALES_BUCKETS)
+VALUES = ('quantity', 'amount', 'count')
+
+# Сравнение сумм float64 с суммами SQLite, накопленными в другом порядке
+AMOUNT_TOLERANCE = 0.005
+
+
+class SalesEngine:
+    """Продажи в массивах NumPy: суммы по группам, топ-N и сводные таблицы.
+
+    Запросы принимают фильтры date_from/date_to (YYYY-MM-DD включительно),
+    partner_ids и product_ids. Строки без партнера или продукции не попадают
+    в группы по ним, как в сводных таблицах базы.
+    """
+
+    # В порядке столбцов LOAD_QUERY после id_sale
+    COLUMNS = (('id_partner', 'int32'), ('id_product', 'int32'), ('quantity', 'int32'),
+               ('amount', 'float64'), ('day', 'int32'))
+
+    def __init__(self, db_manager, chunk_size=200000):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("Для SalesEngine нужен пакет numpy")
+        self.db_manager = db_manager
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.row_type = np.dtype([('id_sale', 'int64')] + list(self.COLUMNS))
+        self._clear()
+
+    def _clear(self):
+        self.size = 0
+        self.last_id = 0
+        self.version = None
+        self.columns = {name: np.empty(0, dtype) for name, dtype in self.COLUMNS}
+
+    def _append(self, rows):
+        if self.size + len(rows) > len(self.columns['day']):
+            # Запас по ёмкости: дочитывание не копирует весь массив каждый раз
+            capacity = max(self.size + len(rows), 2 * len(self.columns['day']), 1024)
+            for name, column in self.columns.items():
+                grown = np.empty(capacity, column.dtype)
+                grown[:self.size] = column[:self.size]
+                self.columns[name] = grown
+        for name, _ in self.COLUMNS:
+            self.columns[name][self.size:self.size + len(rows)] = rows[name]
+        self.size += len(rows)
+        self.last_id = int(rows['id_sale'][-1])
+
+    def _load(self, conn):
+        cursor = conn.cursor()
+        # Кортежи вместо sqlite3.Row: np.fromiter разбирает их напрямую
+        cursor.row_factory = None
+        cursor.execute(LOAD_QUERY, (self.last_id,))
+        added = 0
+        while True:
+            rows = cursor.fetchmany(self.chunk_size)
+            if not rows:
+                return added
+            self._append(np.fromiter(rows, dtype=self.row_type, count=len(rows)))
+            added += len(rows)
+
+    def refresh(self):
+        """Дочитывание новых продаж; число добавленных строк или None при ошибке.
+
+        Если после загрузки строки sales_history изменялись или удалялись
+        (выросла sales_version), данные перечитываются полностью.
+        """
+        conn = self.db_manager.get_connection()
+        if not conn:
+            return None
+
+        try:
+            with self.lock:
+                # Версия и новые строки читаются из одного состояния базы
+                conn.execute("BEGIN")
+                version = conn.execute(SALES_VERSION_QUERY).fetchone()[0]
+                if self.version is not None and version != self.version:
+                    self._clear()
+                added = self._load(conn)
+                self.version = version
+                return added
+        except sqlite3.Error as e:
+            print(f"Ошибка при загрузке продаж в память: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def reload(self):
+        """Полная перезагрузка продаж"""
+        with self.lock:
+            self._clear()
+        return self.refresh()
+
+    def _view(self, date_from=None, date_to=None, partner_ids=None, product_ids=None):
+        """Столбцы строк, подходящих под фильтры"""
+        with self.lock:
+            columns = {name: column[:self.size] for name, column in self.columns.items()}
+
+        mask = None
+        for condition in self._conditions(columns, date_from, date_to, partner_ids, product_ids):
+            mask = condition if mask is None else mask & condition
+        if mask is None:
+            return columns
+        return {name: column[mask] for name, column in columns.items()}
+
+    @staticmethod
+    def _conditions(columns, date_from, date_to, partner_ids, product_ids):
+        day = columns['day']
+        if date_from:
+            yield day >= np.datetime64(date_from, 'D').astype(np.int64)
+        if date_to:
+            yield (day <= np.datetime64(date_to, 'D').astype(np.int64)) & (day != MISSING_DAY)
+        if partner_ids is not None:
+            yield np.isin(columns['id_partner'], np.asarray(list(partner_ids), dtype=np.int32))
+        if product_ids is not None:
+            yield np.isin(columns['id_product'], np.asarray(list(product_ids), dtype=np.int32))
+
+    @staticmethod
+    def _keys(columns, dimension):
+        """(ключи строк, маска строк, у которых ключ есть)"""
+        if dimension == 'partner':
+            keys = columns['id_partner']
+            return keys, keys != 0
+        if dimension == 'product':
+            keys = columns['id_product']
+            return keys, keys != 0
+
+        day = columns['day'].astype(np.int64)
+        valid = day != MISSING_DAY
+        if dimension == 'day':
+            return day, valid
+        if dimension == 'week':
+            # 1970-01-01 - четверг: понедельник недели на (day + 3) % 7 дней раньше
+            return day - (day + 3) % 7, valid
+        months = day.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        if dimension == 'month':
+            return months, valid
+        if dimension == 'quarter':
+            return months // 3, valid
+        raise ValueError(f"Неизвестное измерение: {dimension}")
+
+    @staticmethod
+    def _weights(columns, value):
+        if value == 'count':
+            return None
+        if value in ('quantity', 'amount'):
+            return columns[value]
+        raise ValueError(f"Неизвестная величина: {value}")
+
+    @staticmethod
+    def _labels(keys, dimension):
+        """Метки групп в том же виде, что выражения SALES_BUCKETS"""
+        if dimension in ('partner', 'product'):
+            return keys.tolist()
+        if dimension in ('day', 'week'):
+            return [str(day) for day in keys.astype('datetime64[D]')]
+        if dimension == 'month':
+            return [str(month) for month in keys.astype('datetime64[M]')]
+        return [f"{1970 + quarter // 4}-Q{quarter % 4 + 1}" for quarter in keys.tolist()]
+
+    def _grouped(self, columns, dimension, value):
+        """(ключи групп по возрастанию, суммы) по одному измерению"""
+        keys, valid = self._keys(columns, dimension)
+        weights = self._weights(columns, value)
+        if not valid.all():
+            keys = keys[valid]
+            weights = None if weights is None else weights[valid]
+        if not len(keys):
+            return np.empty(0, np.int64), np.empty(0)
+
+        # Ключи - плотные целые (id, номера дней и месяцев), поэтому bincount
+        # по сдвинутому ключу вместо сортировки
+        low = int(keys.min())
+        totals = np.bincount(keys - low, weights=weights)
+        present = np.bincount(keys - low) > 0 if weights is not None else totals > 0
+        groups = np.flatnonzero(present)
+        return groups + low, totals[groups]
+
+    def group_sum(self, by, value='amount', **filters):
+        """{группа: сумма value} по измерению by (partner, product, day, week, month, quarter)"""
+        groups, totals = self._grouped(self._view(**filters), by, value)
+        return dict(zip(self._labels(groups, by), totals.tolist()))
+
+    def top(self, by, n=10, value='amount', **filters):
+        """n групп с наибольшей суммой value: [(группа, сумма)] по убыванию"""
+        groups, totals = self._grouped(self._view(**filters), by, value)
+        if len(totals) > n:
+            chosen = np.argpartition(-totals, n - 1)[:n]
+        else:
+            chosen = np.arange(len(totals))
+        chosen = chosen[np.lexsort((groups[chosen], -totals[chosen]))]
+        return list(zip(self._labels(groups[chosen], by), totals[chosen].tolist()))
+
+    def pivot(self, rows='partner', columns='month', value='amount', **filters):
+        """Сводная таблица: {'rows': [...], 'columns': [...], 'values': массив len(rows) x len(columns)}"""
+        view = self._view(**filters)
+        row_keys, row_valid = self._keys(view, rows)
+        column_keys, column_valid = self._keys(view, columns)
+        weights = self._weights(view, value)
+        valid = row_valid & column_valid
+        if not valid.all():
+            row_keys, column_keys = row_keys[valid], column_keys[valid]
+            weights = None if weights is None else weights[valid]
+
+        row_groups, row_index = np.unique(row_keys, return_inverse=True)
+        column_groups, column_index = np.unique(column_keys, return_inverse=True)
+        cells = len(row_groups) * len(column_groups)
+        values = np.bincount(row_index.astype(np.int64) * len(column_groups) + column_index,
+                             weights=weights, minlength=cells).reshape(len(row_groups), len(column_groups))
+        return {
+            'rows': self._labels(row_groups, rows),
+            'columns': self._labels(column_groups, columns),
+            'values': values,
+        }
+
+    def verify(self):
+        """Сверка с группировками SQL по sales_history; список расхождений (None при ошибке)"""
+        conn = self.db_manager.get_connection()
+        if not conn:
+            return None
+
+        try:
+            drift = []
+            partner_rows = conn.execute(PARTNER_SUMMARY_SELECT).fetchall()
+            product_rows = conn.execute(PRODUCT_SUMMARY_SELECT).fetchall()
+            month_rows = conn.execute(f'''
+                SELECT {SALES_BUCKETS['month']} AS period, COUNT(*) AS sales_count,
+                       COALESCE(SUM(amount_product), 0) AS quantity,
+                       COALESCE(SUM(total_sale_amount), 0) AS amount
+                FROM sales_history
+                WHERE sale_date IS NOT NULL
+                GROUP BY period
+            ''').fetchall()
+            top_rows = conn.execute('''
+                SELECT id_partner, SUM(total_sale_amount) AS amount
+                FROM sales_history
+                WHERE id_partner IS NOT NULL
+                GROUP BY id_partner
+                ORDER BY amount DESC, id_partner
+                LIMIT 10
+            ''').fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка при сверке движка продаж: {e}")
+            return None
+        finally:
+            conn.close()
+
+        def compare(check, expected, actual):
+            for key in expected.keys() | actual.keys():
+                want, got = expected.get(key), actual.get(key)
+                if want is None or got is None or any(abs(w - g) > AMOUNT_TOLERANCE
+                                                      for w, g in zip(want, got)):
+                    drift.append({'check': check, 'key': key, 'expected': want, 'actual': got})
+
+        engine = {name: self.group_sum('partner', name) for name in VALUES}
+        compare('partner', {row['id_partner']: (row['sales_count'], row['total_quantity'], row['total_amount'])
+                            for row in partner_rows},
+                {key: (engine['count'][key], engine['quantity'][key], engine['amount'][key])
+                 for key in engine['count']})
+
+        engine = {name: self.group_sum('month', name) for name in VALUES}
+        compare('month', {row['period']: (row['sales_count'], row['quantity'], row['amount'])
+                          for row in month_rows},
+                {key: (engine['count'][key], engine['quantity'][key], engine['amount'][key])
+                 for key in engine['count']})
+
+        # Продукция по партнерам - сводная таблица по партнерам первой сотни
+        partner_ids = sorted(row['id_partner'] for row in partner_rows)[:100]
+        expected = {(row['id_partner'], row['id_product']): (row['quantity'], row['amount'])
+                    for row in product_rows if row['id_partner'] in set(partner_ids)}
+        actual = {}
+        pivots = [self.pivot('partner', 'product', name, partner_ids=partner_ids)
+                  for name in ('quantity', 'amount')]
+        for i, partner in enumerate(pivots[0]['rows']):
+            for j, product in enumerate(pivots[0]['columns']):
+                if pivots[0]['values'][i, j] or pivots[1]['values'][i, j]:
+                    actual[(partner, product)] = (pivots[0]['values'][i, j], pivots[1]['values'][i, j])
+        compare('partner_product', expected, actual)
+
+        compare('top', {number: (row['amount'],) for number, row in enumerate(top_rows)},
+                {number: (amount,) for number, (_, amount) in enumerate(self.top('partner', len(top_rows)))})
+        return drift
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Аналитика продаж в памяти (NumPy)")
+    parser.add_argument('--database', default="partners_management.db")
+    parser.add_argument('--verify', action='store_true', help="сверить результаты с запросами SQL")
+    parser.add_argument('--top', choices=DIMENSIONS, help="группы с наибольшей суммой")
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--pivot', nargs=2, choices=DIMENSIONS, metavar=('ROWS', 'COLUMNS'))
+    parser.add_argument('--value', choices=VALUES, default='amount')
+    parser.add_argument('--date-from')
+    parser.add_argument('--date-to')
+    args = parser.parse_args()
+
+    if not NUMPY_AVAILABLE:
+        print("Для движка аналитики нужен пакет numpy", file=sys.stderr)
+        sys.exit(1)
+
+    db_manager = DatabaseManager(args.database)
+    try:
+        engine = SalesEngine(db_manager)
+        started = time.perf_counter()
+        if engine.refresh() is None:
+            sys.exit(1)
+        print(f"Загружено продаж: {engine.size} за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+        filters = {'date_from': args.date_from, 'date_to': args.date_to}
+
+        if args.top:
+            for key, total in engine.top(args.top, args.limit, args.value, **filters):
+                print(f"{key}\t{total:.2f}")
+        if args.pivot:
+            result = engine.pivot(*args.pivot, value=args.value, **filters)
+            print("\t".join([""] + [str(column) for column in result['columns']]))
+            for key, values in zip(result['rows'], result['values']):
+                print("\t".join([str(key)] + [f"{value:.2f}" for value in values]))
+        if args.verify:
+            drift = engine.verify()
+            if drift is None:
+                sys.exit(1)
+            for row in drift:
+                print(row)
+            print(f"Расхождений с SQL: {len(drift)}")
+            sys.exit(1 if drift else 0)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
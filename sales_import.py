@@ -0,0 +1,302 @@
+"""Потоковая загрузка истории продаж из CSV или JSON Lines.
+
+Записи входного файла содержат поля inn, name_product, amount_product,
+sale_date и необязательное total_sale_amount (по умолчанию цена продукта,
+умноженная на количество). ИНН и наименования продукции сопоставляются
+с идентификаторами по словарям в памяти, строки пишутся через executemany
+крупными транзакциями. После каждой транзакции в базе сохраняется номер
+последней обработанной записи, поэтому прерванную загрузку можно продолжить.
+
+    python sales_import.py sales.csv --rejects rejected.csv --defer-indexes
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import date
+from itertools import islice
+
+from database import (DatabaseManager, SALES_SUMMARY_INSERT_TRIGGER, deferred_indexes_owner,
+                      restore_deferred_indexes, touch_deferred_indexes)
+
+
+FIELDS = ('inn', 'name_product', 'amount_product', 'total_sale_amount', 'sale_date')
+
+INSERT_SALE = '''
+    INSERT INTO sales_history (id_partner, id_product, amount_product, total_sale_amount, sale_date)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+
+def detect_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_records(path, file_format):
+    """Записи входного файла в виде словарей"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if file_format == 'csv':
+            reader = csv.reader(f)
+            header = [name.strip() for name in next(reader, [])]
+            for values in reader:
+                if values:
+                    yield dict(zip(header, values))
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield record if isinstance(record, dict) else {'_raw': line}
+
+
+def resolve_records(records, partners, products, rejects, start=0):
+    """Пары (номер записи, строка для вставки или None, если запись отклонена)"""
+    for number, record in enumerate(records, start):
+        try:
+            inn = str(record['inn']).strip()
+            id_partner = partners.get(inn)
+            if id_partner is None:
+                raise ValueError(f"неизвестный ИНН {inn}")
+
+            name = str(record['name_product']).strip()
+            product = products.get(name)
+            if product is None:
+                raise ValueError(f"неизвестная продукция {name}")
+            id_product, price = product
+
+            amount = int(record['amount_product'])
+            if amount <= 0:
+                raise ValueError("количество должно быть положительным")
+
+            total = record.get('total_sale_amount')
+            if total in (None, ''):
+                if price is None:
+                    raise ValueError("не указана сумма и у продукции нет цены")
+                total = price * amount
+            else:
+                total = float(total)
+
+            sale_date = date.fromisoformat(str(record['sale_date']).strip()[:10]).isoformat()
+        except KeyError as e:
+            rejects.append((number, record, f"нет поля {e.args[0]}"))
+            yield number, None
+        except (TypeError, ValueError) as e:
+            rejects.append((number, record, str(e)))
+            yield number, None
+        else:
+            yield number, (id_partner, id_product, amount, total, sale_date)
+
+
+class RejectsWriter:
+    """Файл отклонённых записей в формате входного файла с полем reason"""
+
+    def __init__(self, path, file_format, append):
+        self.file_format = file_format
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, 'a' if append else 'w', newline='', encoding='utf-8')
+        if file_format == 'csv':
+            self.writer = csv.writer(self.file)
+            if not exists:
+                self.writer.writerow(('record',) + FIELDS + ('reason',))
+
+    def write(self, rejects):
+        for number, record, reason in rejects:
+            if self.file_format == 'csv':
+                self.writer.writerow([number] + [record.get(field, '') for field in FIELDS] + [reason])
+            else:
+                row = dict(record, record=number, reason=reason)
+                self.file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def print_progress(progress):
+    rate = progress['imported'] / progress['seconds'] if progress['seconds'] else 0
+    print(f"\rЗагружено: {progress['imported']}, отклонено: {progress['rejected']}, "
+          f"{rate:,.0f} строк/с", end='', file=sys.stderr, flush=True)
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def defer_sales_indexes(conn):
+    """Удаление вторичных индексов sales_history с сохранением их определений"""
+    conn.execute("BEGIN IMMEDIATE")
+    indexes = conn.execute('''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = 'sales_history' AND sql IS NOT NULL
+    ''').fetchall()
+    pid, host = deferred_indexes_owner()
+    for index in indexes:
+        conn.execute('''
+            INSERT OR REPLACE INTO import_deferred_indexes (name, sql, owner_pid, owner_host, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (index['name'], index['sql'], pid, host))
+        conn.execute(f'DROP INDEX "{index["name"]}"')
+    conn.commit()
+
+
+def import_sales(db_manager, path, file_format=None, rejects_path=None, batch_size=10000,
+                 transaction_size=200000, defer_indexes=False, restart=False,
+                 progress=print_progress):
+    """Загрузка продаж из файла; возвращает счётчики загруженных и отклонённых записей"""
+    file_format = file_format or detect_format(path)
+    source = os.path.abspath(path)
+    fingerprint = file_fingerprint(path)
+
+    conn = db_manager.get_connection()
+    if not conn:
+        raise sqlite3.OperationalError("Ошибка подключения к базе данных")
+
+    rejects_file = None
+    try:
+        if restart:
+            conn.execute("DELETE FROM import_checkpoints WHERE source = ?", (source,))
+            conn.commit()
+
+        checkpoint = conn.execute(
+            "SELECT fingerprint, records, completed FROM import_checkpoints WHERE source = ?",
+            (source,)).fetchone()
+        start = 0
+        if checkpoint:
+            if checkpoint['fingerprint'] == fingerprint:
+                start = checkpoint['records']
+            elif not checkpoint['completed']:
+                raise ValueError(f"Файл {path} изменился после прерванной загрузки, "
+                                 f"для загрузки с начала укажите --restart")
+            # Новый файл на месте полностью загруженного загружается с начала
+
+        partners = {row['inn']: row['id_partner']
+                    for row in conn.execute("SELECT inn, id_partner FROM partners WHERE inn IS NOT NULL")}
+        products = {row['name_product']: (row['id_product'], row['price'])
+                    for row in conn.execute("SELECT name_product, id_product, price FROM products")}
+
+        trigger_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                                   (SALES_SUMMARY_INSERT_TRIGGER,)).fetchone()
+
+        if defer_indexes:
+            defer_sales_indexes(conn)
+
+        if rejects_path:
+            rejects_file = RejectsWriter(rejects_path, file_format, append=start > 0)
+
+        rejects = []
+        records = islice(read_records(path, file_format), start, None)
+        rows = resolve_records(records, partners, products, rejects, start)
+
+        counts = {'resumed_from': start, 'imported': 0, 'rejected': 0}
+        started = time.perf_counter()
+        finished = False
+        while not finished:
+            conn.execute("BEGIN IMMEDIATE")
+            first_id = conn.execute("SELECT COALESCE(MAX(id_sale), 0) FROM sales_history").fetchone()[0]
+            # Сводные таблицы обновляются одним запросом на транзакцию, а не триггером на строку
+            if trigger_sql:
+                conn.execute(f"DROP TRIGGER {SALES_SUMMARY_INSERT_TRIGGER}")
+
+            processed = imported = 0
+            last_number = None
+            while processed < transaction_size:
+                chunk = list(islice(rows, batch_size))
+                if not chunk:
+                    finished = True
+                    break
+                batch = [row for number, row in chunk if row is not None]
+                conn.executemany(INSERT_SALE, batch)
+                processed += len(chunk)
+                imported += len(batch)
+                last_number = chunk[-1][0]
+
+            if imported:
+                db_manager.append_sales_to_summaries(conn, first_id)
+            if trigger_sql:
+                conn.execute(trigger_sql['sql'])
+            if last_number is not None:
+                conn.execute('''
+                    INSERT INTO import_checkpoints (source, fingerprint, records, completed, updated_at)
+                    VALUES (?, ?, ?, 0, CURRENT_TIMESTAMP)
+                    ON CONFLICT (source) DO UPDATE SET
+                        fingerprint = excluded.fingerprint, records = excluded.records,
+                        completed = 0, updated_at = excluded.updated_at
+                ''', (source, fingerprint, last_number + 1))
+            if defer_indexes:
+                touch_deferred_indexes(conn)
+            conn.commit()
+
+            counts['imported'] += imported
+            counts['rejected'] += len(rejects)
+            if rejects_file:
+                rejects_file.write(rejects)
+            rejects.clear()
+
+            counts['seconds'] = time.perf_counter() - started
+            if progress:
+                progress(counts)
+
+        # Повторный запуск с тем же файлом ничего не загрузит, а изменённый файл загрузится с начала
+        conn.execute("UPDATE import_checkpoints SET completed = 1 WHERE source = ?", (source,))
+        conn.commit()
+
+        restore_deferred_indexes(conn)
+        counts['seconds'] = time.perf_counter() - started
+        return counts
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        # Индексы возвращаются и после ошибки, иначе база осталась бы без них
+        if defer_indexes:
+            try:
+                restore_deferred_indexes(conn)
+            except sqlite3.Error as e:
+                print(f"Ошибка при восстановлении индексов продаж: {e}", file=sys.stderr)
+        conn.close()
+        if rejects_file:
+            rejects_file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка истории продаж из CSV или JSON Lines")
+    parser.add_argument('path', help="входной файл (.csv или .jsonl)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], dest='file_format')
+    parser.add_argument('--database', default="partners_management.db")
+    parser.add_argument('--rejects', help="файл для отклонённых записей")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--transaction-size', type=int, default=200000)
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help="удалить индексы sales_history на время загрузки")
+    parser.add_argument('--restart', action='store_true',
+                        help="загрузить файл с начала, не продолжая прерванную загрузку")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(args.database)
+    try:
+        counts = import_sales(db_manager, args.path, args.file_format, args.rejects,
+                              args.batch_size, args.transaction_size, args.defer_indexes,
+                              args.restart)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"\nОшибка загрузки: {e}", file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\nЗагрузка прервана, повторный запуск продолжит её с последней транзакции",
+              file=sys.stderr)
+        sys.exit(130)
+    finally:
+        db_manager.close()
+
+    print(f"\nЗагружено {counts['imported']} записей, отклонено {counts['rejected']} "
+          f"за {counts['seconds']:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Окно списка партнеров на модели, загруженной до входа менеджера"""
+import os
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PyQt6.QtWidgets')
+from PyQt6 import QtCore
+
+from database import DatabaseManager
+from generate_data import generate_database
+from main import PartnersTableModel, PartnersViewWindow
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    path = str(tmp_path / "partners.db")
+    generate_database(path, partners=500, products=5, sales=100, progress=None)
+    db_manager = DatabaseManager(path)
+    yield db_manager
+    db_manager.close()
+
+
+def test_window_keeps_prefetched_page(app, db_manager, monkeypatch):
+    model = PartnersTableModel(db_manager)
+    model.reload()
+    rows = model.rowCount()
+    assert rows > 0
+
+    reloads = []
+    monkeypatch.setattr(model, 'reload', lambda: reloads.append(True))
+    window = PartnersViewWindow({'login': 'manager', 'full_name': 'Менеджер'}, db_manager, partners_model=model)
+    try:
+        assert reloads == []
+        assert model.rowCount() == rows
+
+        # Смена столбца сортировки по-прежнему перечитывает список
+        window.partners_table.sortByColumn(0, QtCore.Qt.SortOrder.DescendingOrder)
+        assert reloads == [True]
+    finally:
+        window.logos.close()
+        model.close()
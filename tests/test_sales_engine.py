@@ -0,0 +1,117 @@
+"""Сверка колоночного движка продаж с запросами SQL на сгенерированной базе"""
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from database import DatabaseManager, SALES_BUCKETS
+from generate_data import generate_database
+from sales_engine import SalesEngine
+
+
+DATE_FROM, DATE_TO = '2020-02-10', '2020-09-15'
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    path = str(tmp_path / "sales.db")
+    generate_database(path, partners=300, products=25, sales=20000, start_date='2020-01-01',
+                      days=400, progress=None)
+    db_manager = DatabaseManager(path)
+    yield db_manager
+    db_manager.close()
+
+
+@pytest.fixture
+def engine(db_manager):
+    engine = SalesEngine(db_manager, chunk_size=3000)
+    engine.refresh()
+    return engine
+
+
+def sql_rows(db_manager, query, params=()):
+    conn = db_manager.get_connection()
+    try:
+        return conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+
+
+def test_loaded_engine_matches_sql(engine):
+    assert engine.size == 20000
+    assert engine.verify() == []
+
+
+def test_appended_sales_are_read_incrementally(db_manager, engine):
+    for day in range(50):
+        assert db_manager.add_sale(1 + day % 7, 1 + day % 3, day + 1, 10.5 * day, f"2020-03-{day % 28 + 1:02d}")
+    assert db_manager.add_sale(5, 2, 3, 99.0, None)
+
+    assert engine.refresh() == 51
+    assert engine.size == 20051
+    assert engine.verify() == []
+
+
+def test_deleted_sales_trigger_full_reload(db_manager, engine):
+    conn = db_manager.get_connection()
+    try:
+        conn.execute("DELETE FROM sales_history WHERE id_sale IN "
+                     "(SELECT id_sale FROM sales_history WHERE id_partner = 3 LIMIT 5)")
+        conn.commit()
+    finally:
+        conn.close()
+
+    # Удаление не видно по id_sale: растёт sales_version, движок перечитывает всё
+    engine.refresh()
+    assert engine.size == 19995
+    assert engine.verify() == []
+
+
+def test_edits_keeping_partner_totals_trigger_full_reload(db_manager, engine):
+    conn = db_manager.get_connection()
+    try:
+        sale = conn.execute("SELECT id_sale, id_product FROM sales_history WHERE id_partner = 3 "
+                            "ORDER BY id_sale LIMIT 1").fetchone()
+        conn.execute("UPDATE sales_history SET sale_date = '2020-05-05' WHERE id_sale = ?",
+                     (sale['id_sale'],))
+        conn.execute("UPDATE sales_history SET id_product = ? WHERE id_sale = ?",
+                     (sale['id_product'] % 25 + 1, sale['id_sale']))
+        conn.commit()
+    finally:
+        conn.close()
+
+    # Итоги партнера не изменились, но дата и продукция строки другие
+    engine.refresh()
+    assert engine.size == 20000
+    assert engine.verify() == []
+
+
+@pytest.mark.parametrize('bucket', sorted(SALES_BUCKETS))
+def test_bucket_sums_with_filters_match_sql(db_manager, engine, bucket):
+    expected = {row[0]: (row[1], row[2]) for row in sql_rows(db_manager, f'''
+        SELECT {SALES_BUCKETS[bucket]} AS period, SUM(amount_product), SUM(total_sale_amount)
+        FROM sales_history
+        WHERE sale_date >= ? AND sale_date <= ? AND id_partner IN (1, 2, 3, 50)
+        GROUP BY period
+    ''', (DATE_FROM, DATE_TO))}
+    filters = {'date_from': DATE_FROM, 'date_to': DATE_TO, 'partner_ids': [1, 2, 3, 50]}
+    quantity = engine.group_sum(bucket, 'quantity', **filters)
+    amount = engine.group_sum(bucket, 'amount', **filters)
+
+    assert expected
+    assert quantity.keys() == expected.keys()
+    for period, (want_quantity, want_amount) in expected.items():
+        assert quantity[period] == want_quantity
+        assert amount[period] == pytest.approx(want_amount, abs=0.005)
+
+
+def test_top_partners_match_sql(db_manager, engine):
+    expected = sql_rows(db_manager, '''
+        SELECT id_partner, SUM(total_sale_amount) AS amount
+        FROM sales_history
+        GROUP BY id_partner
+        ORDER BY amount DESC, id_partner
+        LIMIT 5
+    ''')
+    top = engine.top('partner', 5)
+    assert [partner for partner, _ in top] == [row[0] for row in expected]
+    assert [amount for _, amount in top] == pytest.approx([row[1] for row in expected], abs=0.005)